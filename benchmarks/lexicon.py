@@ -0,0 +1,84 @@
+"""
+Benchmarks building and querying a spiel.lexicon.BKTree, alongside the
+equivalent searches on a spiel.lexicon.Trie
+
+Usage:
+python benchmarks/lexicon.py [--sizes N [N ...]] [--queries Q]
+
+Words are generated at random from a small syllable inventory, so that the
+lexicon has the kind of near neighbours found in real corpora.
+"""
+import random
+import time
+from argparse import ArgumentParser
+
+from spiel.lexicon import BKTree, Trie
+
+SYLLABLES = ['ki', 'wa', 'pa', 'ma', 'ni', 'ta', 'ko', 'si', 'â', 'w', 'k']
+
+
+def random_word(rng):
+    """
+    Generates a random word of two to eight syllables
+    """
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 8)))
+
+
+def timed(func, *args):
+    """
+    Calls *func* and returns its result along with the seconds it took
+    """
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def benchmark(size, num_queries, rng):
+    """
+    Builds a tree of *size* words and times queries against it
+    """
+    words = [random_word(rng) for _ in range(size)]
+    queries = [random_word(rng) for _ in range(num_queries)]
+
+    tree, build_time = timed(BKTree.build, words)
+    print(f"{size:>9} words: built {len(tree)} nodes in {build_time:.2f}s")
+
+    for max_distance in (1, 2):
+        _, query_time = timed(lambda: [tree.query(query, max_distance)
+                                       for query in queries])
+        print(f"{'':>9}  query(k={max_distance}): "
+              f"{1000 * query_time / num_queries:.2f}ms per query")
+
+    _, nearest_time = timed(lambda: [tree.nearest(query, 5)
+                                     for query in queries])
+    print(f"{'':>9}  nearest(5): "
+          f"{1000 * nearest_time / num_queries:.2f}ms per query")
+
+    trie, build_time = timed(Trie.build, words)
+    print(f"{'':>9}  trie built in {build_time:.2f}s")
+
+    for max_distance in (1, 2):
+        _, search_time = timed(lambda: [trie.search(query, max_distance)
+                                        for query in queries])
+        print(f"{'':>9}  trie search(k={max_distance}): "
+              f"{1000 * search_time / num_queries:.2f}ms per query")
+
+
+def main():
+    """
+    Entry point into the script
+    """
+    parser = ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10 ** 4, 10 ** 5, 10 ** 6])
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    for size in args.sizes:
+        benchmark(size, args.queries, rng)
+
+
+if __name__ == '__main__':
+    main()
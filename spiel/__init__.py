@@ -0,0 +1,6 @@
+"""
+spiel
+
+Segmentation of polysynthetic languages
+"""
+__version__ = '0.1.0'
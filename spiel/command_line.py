@@ -4,65 +4,218 @@ spiel.command_line
 Command line interface into SPieL
 
 Usage:
-spiel --train TRAIN_FILE [--test TEST_FILE]
+spiel --train TRAIN_FILE [--test TEST_FILE] [--alignment-cache CACHE_FILE]
+            [--save-model MODEL_DIR] [--jobs N]
+spiel train TRAIN_FILE --out MODEL_DIR [--alignment-cache CACHE_FILE]
+            [--no-grid-search]
+spiel run --model MODEL_DIR TEST_FILE [--jobs N]
+spiel compile-corpus INPUT_FILE OUTPUT_FILE [--non-strict]
+spiel segment --model MODEL_DIR [--format {tsv,jsonl}] [--batch-size N]
+              [--words] [--jobs N]
+spiel serve --model MODEL_DIR [--host HOST] [--port PORT | --socket PATH]
+            [--batch-size N] [--max-wait SECONDS] [--max-pending N]
 """
+import asyncio
+from itertools import tee
+import json
+import os
 import sys
-import re
 from argparse import ArgumentParser
 
-from spiel.data import load_file as load_instances
+from spiel.data import Corpus, iter_instances
+from spiel.levenshtein import AlignmentCache
+from spiel.pipeline import DEFAULT_BATCH_SIZE, Pipeline, segment_parallel
 from spiel.segmentation import ConstraintSegmenter, Featurizer
 from spiel.sequence_labelling import SequenceLabeller
+from spiel import server
+from spiel.util import num_workers
+from spiel.vocab import Tokenizer
 
 
-def parse_args():
+# The tokens of a shape: a character and any length marks that follow it
+TOKEN_PATTERN = r'.[·]*'
+
+
+def parse_args(argv=None):
     """
     Parses the arguments from the command line
+
+    Arguments that do not start with a command are parsed as the original
+    train-and-evaluate form.
+
+    :param argv: The arguments to parse. Defaults to sys.argv[1:]
+    :type argv: list of str
     """
-    parser = ArgumentParser()
+    argv = sys.argv[1:] if argv is None else argv
+
+    if argv and argv[0] in COMMANDS:
+        parser = ArgumentParser(prog='spiel')
+        commands = parser.add_subparsers(dest='command')
+        add_train_args(commands.add_parser(
+            'train', help='train a model and save it to a directory'))
+        add_run_args(commands.add_parser(
+            'run', help='evaluate a saved model on an instance file'))
+        add_compile_corpus_args(commands.add_parser(
+            'compile-corpus',
+            help='convert an instance file to a binary corpus'))
+        add_segment_args(commands.add_parser(
+            'segment',
+            help='segment shapes from standard input with a saved model'))
+        add_serve_args(commands.add_parser(
+            'serve', help='answer segmentation requests over a socket'))
+        return parser.parse_args(argv)
+
+    parser = ArgumentParser(prog='spiel')
     parser.add_argument('--train', dest='train_file', required=True)
     parser.add_argument('--test', dest='test_file')
-    return parser.parse_args()
+    parser.add_argument('--alignment-cache', dest='alignment_cache_file',
+                        help='file to keep alignments in between runs')
+    parser.add_argument('--save-model', dest='model_dir',
+                        help='directory to save the trained model to')
+    add_jobs_arg(parser)
+    parser.set_defaults(command=None)
+    return parser.parse_args(argv)
+
+
+def add_train_args(parser):
+    """
+    Adds the arguments of the train command to a parser
+    """
+    parser.add_argument('train_file', help='instance file to train on, or '
+                        'ARCHIVE#SPLIT for one split of an archive')
+    parser.add_argument('--out', dest='model_dir', required=True,
+                        help='directory to save the trained model to')
+    parser.add_argument('--alignment-cache', dest='alignment_cache_file',
+                        help='file to keep alignments in between runs')
+    parser.add_argument('--no-grid-search', dest='grid_search',
+                        action='store_false',
+                        help='train the labeller with the default settings '
+                             'instead of searching for the best ones')
+
+
+def add_run_args(parser):
+    """
+    Adds the arguments of the run command to a parser
+    """
+    parser.add_argument('--model', dest='model_dir', required=True,
+                        help='model saved by the train command')
+    parser.add_argument('test_file', help='instance file to evaluate on, or '
+                        'ARCHIVE#SPLIT for one split of an archive')
+    add_jobs_arg(parser)
+
+
+def add_compile_corpus_args(parser):
+    """
+    Adds the arguments of the compile-corpus command to a parser
+    """
+    parser.add_argument('input_file', help='instance file to read, or '
+                        'ARCHIVE#SPLIT for one split of an archive')
+    parser.add_argument('output_file', help='file to write the corpus to')
+    parser.add_argument('--non-strict', dest='strict', action='store_false',
+                        help='allow instances without segments or labels')
+
+
+def add_segment_args(parser):
+    """
+    Adds the arguments of the segment command to a parser
+    """
+    parser.add_argument('--model', dest='model_dir', required=True,
+                        help='model saved by the train command')
+    parser.add_argument('--format', choices=sorted(OUTPUT_FORMATS),
+                        default='tsv', help='how to write each result')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='number of shapes to segment at a time')
+    parser.add_argument('--words', action='store_true',
+                        help='segment each word of a line, rather than the '
+                             'whole line')
+    add_jobs_arg(parser)
+
+
+def add_serve_args(parser):
+    """
+    Adds the arguments of the serve command to a parser
+    """
+    parser.add_argument('--model', dest='model_dir', required=True,
+                        help='model saved by the train command')
+    parser.add_argument('--host', default=server.DEFAULT_HOST,
+                        help='interface to listen on')
+    address = parser.add_mutually_exclusive_group()
+    address.add_argument('--port', type=int, default=server.DEFAULT_PORT,
+                         help='TCP port to listen on')
+    address.add_argument('--socket', dest='socket_path',
+                         help='Unix socket to listen on instead of a port')
+    parser.add_argument('--batch-size', type=int,
+                        default=server.DEFAULT_BATCH_SIZE,
+                        help='most shapes to segment at a time')
+    parser.add_argument('--max-wait', type=float,
+                        default=server.DEFAULT_MAX_WAIT,
+                        help='longest to wait to fill a batch, in seconds')
+    parser.add_argument('--max-pending', type=int,
+                        default=server.DEFAULT_MAX_PENDING,
+                        help='most shapes to queue before making clients '
+                             'wait')
+
+
+def add_jobs_arg(parser):
+    """
+    Adds the argument for the number of processes to segment with to a
+    parser
+    """
+    parser.add_argument('--jobs', dest='n_jobs', type=int, default=1,
+                        help='number of processes to segment with; -1 for '
+                             'one per CPU')
+
+
+def init_alignment_cache(path):
+    """
+    Initializes the cache of alignments used while featurizing
+
+    :param path: A file that alignments are kept in between runs, if any
+    :type path: str
+    :rtype: AlignmentCache
+    """
+    if path and os.path.exists(path):
+        return AlignmentCache.load(path)
+    return AlignmentCache()
 
 
-def init_segmenter(instances, featurizer):
+def init_segmenter(corpus, featurizer):
     """
     Initializes the segmenter
 
-    :param instances: The instances to train the segmenter on
-    :type instances: list of Instance
+    :param corpus: The instances to train the segmenter on
+    :type corpus: spiel.data.Corpus
     :param featurizer: The featurizer to use to split the instances:
     :type featurizer: spiel.segmentation.Featurizer
     :rtype: ConstraintSegmenter
     """
     segmenter = ConstraintSegmenter(featurizer=featurizer)
-
-    data = [(instance.shape, instance.annotations) for instance in instances]
-    segmenter.train(*zip(*data))
-
+    segmenter.train(corpus)
     return segmenter
 
 
-def init_labeller(instances, featurizer):
+def init_labeller(corpus, featurizer, grid_search=True):
     """
     Initializes the labeller
 
-    :param instances: The instances to train the labeller on
-    :type instances: list of Instance
+    :param corpus: The instances to train the labeller on
+    :type corpus: spiel.data.Corpus
     :param featurizer: The featurizer to use to split the instances:
     :type featurizer: spiel.segmentation.Featurizer
+    :param grid_search: Whether to search for the best labeller settings
+    :type grid_search: bool
     :rtype: SequenceLabeller
     """
-    data = [list(zip(*featurizer.analogize(instance.shape,
-                                           instance.annotations)))
-            for instance in instances]
+    data = [list(zip(*featurizer.analogize(corpus.tokens(index),
+                                           corpus.annotations(index))))
+            for index in corpus.annotated_indices()]
 
     labeller = SequenceLabeller()
-    labeller.train(*zip(*data), grid_search=True)
+    labeller.train(*zip(*data), grid_search=grid_search)
     return labeller
 
 
-def run_pipeline(segmenter, labeller, instances):
+def run_pipeline(segmenter, labeller, instances, n_jobs=1):
     """
     Runs the segmenter/labeller pipeline on a list of instances and prints the
     results to the console
@@ -72,15 +225,30 @@ def run_pipeline(segmenter, labeller, instances):
     :param labeller: An object to label the tokens
     :type labeller: SequenceLabeller
     :param instances: The instances to run the pipeline on
-    :type instances: list of Instance
+    :type instances: iterable of Instance
+    :param n_jobs: The number of processes to segment with; see
+                   spiel.pipeline.segment_parallel()
+    :type n_jobs: int
     """
     num_tests = 0
     num_right = 0
 
-    for instance in instances:
-        segments = segmenter.segment(instance.shape)
-        labels = labeller.label(segments)
+    if num_workers(n_jobs) == 1:
+        results = ((instance, segmenter.segment(instance.tokens))
+                   for instance in instances)
+        results = ((instance, segments, labeller.label(segments))
+                   for instance, segments in results)
+    else:
+        instances, shapes = tee(instances)
+        annotations = segment_parallel(
+            Pipeline(segmenter, labeller),
+            (instance.tokens for instance in shapes), n_jobs)
+        results = ((instance, [segment for segment, _ in annotation],
+                    [label for _, label in annotation])
+                   for instance, (_, annotation) in zip(instances,
+                                                        annotations))
 
+    for instance, segments, labels in results:
         prediction = '-'.join([f"{segment}/{label}"
                                for segment, label in zip(segments, labels)])
 
@@ -99,22 +267,185 @@ def run_pipeline(segmenter, labeller, instances):
         print(f"Accuracy: {num_right/num_tests}")
 
 
-def main():
+def compile_corpus(args):
     """
-    Entry point into the script
+    Reads an instance file and writes it out as a compiled corpus, which
+    spiel.data.load_file() can open much faster
     """
-    args = parse_args()
+    tokenizer = Tokenizer(TOKEN_PATTERN)
+    corpus = Corpus.load(args.input_file, strict=args.strict,
+                         tokenize=tokenizer)
+    corpus.save(args.output_file)
+    print(f"Compiled {len(corpus)} instances into {args.output_file}.")
+
+
+def segment(args):
+    """
+    Segments and labels each shape from standard input, writing one result
+    per shape to standard output as it goes
+    """
+    write_result = OUTPUT_FORMATS[args.format]
+
+    if args.words:
+        shapes = (word for line in sys.stdin for word in line.split())
+    else:
+        shapes = (line.strip() for line in sys.stdin)
+
+    if num_workers(args.n_jobs) == 1:
+        results = Pipeline.load(args.model_dir).stream(shapes,
+                                                       args.batch_size)
+    else:
+        results = segment_parallel(args.model_dir, shapes, args.n_jobs,
+                                   args.batch_size)
 
-    train_instances = load_instances(args.train_file)
-    featurizer = Featurizer(mode='basic',
-                            tokenize=lambda x: re.findall(r'.[·]*', x))
-    segmenter = init_segmenter(train_instances, featurizer)
-    labeller = init_labeller(train_instances, featurizer)
+    batch = []
+    for shape, annotations in results:
+        batch.append(write_result(shape, annotations))
+        if len(batch) == args.batch_size:
+            sys.stdout.write(''.join(batch))
+            sys.stdout.flush()
+            batch = []
+    sys.stdout.write(''.join(batch))
+    sys.stdout.flush()
+
+
+def serve(args):
+    """
+    Loads a saved model, and answers segmentation requests with it until
+    interrupted
+    """
+    segmentation_server = server.SegmentationServer(
+        Pipeline.load(args.model_dir), batch_size=args.batch_size,
+        max_wait=args.max_wait, max_pending=args.max_pending)
+
+    async def run_server():
+        await segmentation_server.start(args.host, args.port,
+                                        args.socket_path)
+        print(f"Listening on {segmentation_server.address}.", flush=True)
+        await segmentation_server.serve_forever()
+
+    try:
+        asyncio.run(run_server())
+    except KeyboardInterrupt:
+        pass
+
+
+def format_tsv(shape, annotations):
+    """
+    Formats a result as a line of tab-separated shape, segments, and labels,
+    with spaces between the segments and between the labels
+
+    :rtype: str
+    """
+    segments = ' '.join(segment for segment, _ in annotations)
+    labels = ' '.join(label for _, label in annotations)
+    return f'{shape}\t{segments}\t{labels}\n'
+
+
+def format_jsonl(shape, annotations):
+    """
+    Formats a result as a line of JSON
+
+    :rtype: str
+    """
+    return json.dumps({
+        'shape': shape,
+        'segments': [segment for segment, _ in annotations],
+        'labels': [label for _, label in annotations]
+    }, ensure_ascii=False) + '\n'
+
+
+def init_pipeline(corpus, alignment_cache_file=None, grid_search=True):
+    """
+    Trains the segmenter and labeller
+
+    :param corpus: The instances to train on, loaded with a Tokenizer for
+                   TOKEN_PATTERN
+    :type corpus: spiel.data.Corpus
+    :param alignment_cache_file: A file that alignments are kept in between
+                                 runs, if any
+    :type alignment_cache_file: str
+    :param grid_search: Whether to search for the best labeller settings
+    :type grid_search: bool
+    :rtype: spiel.pipeline.Pipeline
+    """
+    alignment_cache = init_alignment_cache(alignment_cache_file)
+    featurizer = Featurizer(mode='basic', tokenize=Tokenizer(TOKEN_PATTERN),
+                            alignment_cache=alignment_cache)
+    segmenter = init_segmenter(corpus, featurizer)
+    labeller = init_labeller(corpus, featurizer, grid_search)
+
+    if alignment_cache_file:
+        alignment_cache.save(alignment_cache_file)
+
+    return Pipeline(segmenter, labeller)
+
+
+def train(args):
+    """
+    Trains the segmenter and labeller, and saves them to a model directory
+    """
+    tokenizer = Tokenizer(TOKEN_PATTERN)
+    corpus = Corpus.load(args.train_file, tokenize=tokenizer)
+    pipeline = init_pipeline(corpus, args.alignment_cache_file,
+                             args.grid_search)
+    pipeline.save_model(args.model_dir)
+    print(f"Saved model to {args.model_dir}.")
+
+
+def run(args):
+    """
+    Loads a saved model, and reports how it does on a file of instances
+    """
+    pipeline = Pipeline.load_model(args.model_dir)
+    tokenizer = pipeline.segmenter.featurizer.tokenize
+    test_instances = iter_instances(args.test_file, strict=False,
+                                    tokenize=tokenizer)
+    print('Test results')
+    run_pipeline(pipeline.segmenter, pipeline.labeller, test_instances,
+                 args.n_jobs)
+
+
+def evaluate(args):
+    """
+    Trains the segmenter and labeller, and reports how they do on the
+    training instances and any test instances
+    """
+    tokenizer = Tokenizer(TOKEN_PATTERN)
+    corpus = Corpus.load(args.train_file, tokenize=tokenizer)
+    pipeline = init_pipeline(corpus, args.alignment_cache_file)
+    segmenter, labeller = pipeline.segmenter, pipeline.labeller
+
+    if args.model_dir:
+        pipeline.save_model(args.model_dir)
 
     print('Train results')
-    run_pipeline(segmenter, labeller, train_instances)
+    run_pipeline(segmenter, labeller, corpus, args.n_jobs)
 
     if args.test_file:
-        test_instances = load_instances(args.test_file, strict=False)
+        test_instances = iter_instances(args.test_file, strict=False,
+                                        tokenize=tokenizer)
         print('\nTest results')
-        run_pipeline(segmenter, labeller, test_instances)
+        run_pipeline(segmenter, labeller, test_instances, args.n_jobs)
+
+
+COMMANDS = {
+    'train': train,
+    'run': run,
+    'compile-corpus': compile_corpus,
+    'segment': segment,
+    'serve': serve
+}
+
+OUTPUT_FORMATS = {
+    'tsv': format_tsv,
+    'jsonl': format_jsonl
+}
+
+
+def main():
+    """
+    Entry point into the script
+    """
+    args = parse_args()
+    COMMANDS.get(args.command, evaluate)(args)
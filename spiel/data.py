@@ -3,6 +3,63 @@ spiel.data
 
 Module for organizing input data to the SPieL system
 """
+from array import array
+import bz2
+from concurrent.futures import ProcessPoolExecutor
+import gzip
+import io
+import json
+import lzma
+import mmap
+import os
+from pathlib import PurePosixPath
+import pickle
+import struct
+import sys
+import tarfile
+import zlib
+import numpy as np
+from spiel.util import num_workers
+from spiel.vocab import Vocabulary
+
+
+# Marks the start of a compiled corpus file, followed by its format version
+# and the length of its JSON header
+CORPUS_MAGIC = b'SPIELCOR'
+CORPUS_VERSION = 1
+CORPUS_PREAMBLE = struct.Struct('<8sII')
+
+# The byte boundary that each array in a compiled corpus starts on
+CORPUS_ALIGNMENT = 64
+
+# The modules that decompress each kind of compressed file, by the bytes the
+# files start with and by their extensions
+COMPRESSION_MAGIC = {
+    b'\x1f\x8b': gzip,
+    b'BZh': bz2,
+    b'\xfd7zXZ\x00': lzma
+}
+COMPRESSION_EXTENSIONS = {'.gz': gzip, '.bz2': bz2, '.xz': lzma}
+
+# The extensions of tar archives that paired instance files are read from
+ARCHIVE_EXTENSIONS = ('.tar', '.tgz', '.tar.gz', '.tar.bz2', '.tar.xz')
+
+# Separates an archive from the split to read from it, as in corpus.tgz#train
+ARCHIVE_SPLIT_SEPARATOR = '#'
+
+# The extensions of the shapes and segmentations in a pair of files, and the
+# separator between segments in the latter
+ORIGINAL_EXTENSION = '.original'
+SEGMENTED_EXTENSION = '.segmented'
+SEGMENT_SEPARATOR = '-'
+
+# The extension of the index that InstanceIndex.open() keeps beside an
+# instance file
+INDEX_EXTENSION = '.idx'
+
+# The number of chunks load_parallel() splits a file into for each worker,
+# so that uneven chunks even out
+CHUNKS_PER_WORKER = 4
 
 
 class ParseError(ValueError):
@@ -12,8 +69,13 @@ class ParseError(ValueError):
 class Instance:
     """
     Represents a single end-to-end training instance
+
+    Its strings are interned, since the same segments and labels turn up
+    over and over in a corpus.
     """
-    def __init__(self, shape, segments, labels):
+    __slots__ = ('shape', 'tokens', '_segments', '_labels', '_annotations')
+
+    def __init__(self, shape, segments, labels, tokens=None):
         """
         Initializes the instance
 
@@ -23,13 +85,46 @@ class Instance:
         :type segments: list of str
         :param labels: The labels for each segment
         :type labels: list of str
+        :param tokens: The tokens of the shape. Defaults to its characters.
+        :type tokens: list of str
         """
-        self.shape = shape
+        self.shape = sys.intern(shape)
+        if tokens is None:
+            tokens = list(shape)
+        self.tokens = self.__intern_all(tokens)
         self.segments = segments
         self.labels = labels
 
+    @property
+    def segments(self):
+        """
+        The segments that make up the shape
+
+        :rtype: list of str
+        """
+        return self._segments
+
+    @segments.setter
+    def segments(self, segments):
+        self._segments = self.__intern_all(segments)
+        self._annotations = None
+
+    @property
+    def labels(self):
+        """
+        The labels for each segment
+
+        :rtype: list of str
+        """
+        return self._labels
+
+    @labels.setter
+    def labels(self, labels):
+        self._labels = self.__intern_all(labels)
+        self._annotations = None
+
     @staticmethod
-    def fit(lines, strict):
+    def fit(lines, strict, tokenize=None):
         """
         Generates an Instance object from lines of text
 
@@ -37,6 +132,9 @@ class Instance:
         :type lines: list of str
         :param strict: Whether the Instance must have segments and labels
         :type strict: bool
+        :param tokenize: A function to tokenize the shape with. Defaults to
+                         list()
+        :type tokenize: callable
         :rtype: Instance
         """
         try:
@@ -48,18 +146,25 @@ class Instance:
 
         if (segments or labels) and not len(segments) == len(labels):
             raise ParseError(f"Number of segments must match number of \
-    labels; got segments '{segments}' segments, but labels '{labels}'.")
+labels; got segments '{segments}', but labels '{labels}'.")
 
-        return Instance(''.join(shape), segments, labels)
+        shape = ''.join(shape)
+        tokens = tokenize(shape) if tokenize else None
+        return Instance(shape, segments, labels, tokens)
 
     @property
     def annotations(self):
         """
         Returns the combination of the instance's segments and labels
 
+        The list is only built once, and is shared between calls, so it
+        should not be modified.
+
         :rtype: list of (str, str)
         """
-        return list(zip(self.segments, self.labels))
+        if self._annotations is None:
+            self._annotations = list(zip(self.segments, self.labels))
+        return self._annotations
 
     def annotation_string(self):
         """
@@ -68,21 +173,635 @@ class Instance:
         return '-'.join([f"{segment}/{label}"
                          for segment, label in self.annotations])
 
+    @staticmethod
+    def __intern_all(strings):
+        if strings is None:
+            return None
+        return [sys.intern(string) for string in strings]
+
     def __eq__(self, other):
         return self.shape == other.shape and \
                self.segments == other.segments and \
                self.labels == other.labels
 
 
-def load_file(file_name, strict=True):
+class Corpus:
+    """
+    A column-oriented store of many instances
+
+    Rather than holding an object and lists of strings for each instance,
+    the tokens, segments, and labels of all of the instances are kept as
+    ids in flat arrays, with offset arrays marking where each instance's
+    slice begins and ends. The ids index into string tables shared by the
+    whole corpus. Individual instances can be read through InstanceViews.
+
+    Shapes are stored as their tokens, so the shape of an instance is the
+    concatenation of its tokens; the tokenizer used to build the corpus
+    should not drop any characters.
+    """
+    def __init__(self, token_table, segment_table, label_table, token_ids,
+                 token_offsets, segment_ids, label_ids, segment_offsets,
+                 annotated):
+        """
+        Initializes the corpus; see from_instances() to build one
+
+        :param token_table: The strings of the tokens
+        :type token_table: spiel.vocab.Vocabulary
+        :param segment_table: The strings of the segments
+        :type segment_table: spiel.vocab.Vocabulary
+        :param label_table: The strings of the labels
+        :type label_table: spiel.vocab.Vocabulary
+        :param token_ids: The token ids of every shape, end to end
+        :type token_ids: np.array
+        :param token_offsets: Where each shape starts in *token_ids*, plus
+                              the total length at the end
+        :type token_offsets: np.array
+        :param segment_ids: The segment ids of every instance, end to end
+        :type segment_ids: np.array
+        :param label_ids: The label id of each segment in *segment_ids*
+        :type label_ids: np.array
+        :param segment_offsets: Where each instance starts in
+                                *segment_ids*, plus the total length
+        :type segment_offsets: np.array
+        :param annotated: Whether each instance has segments and labels
+        :type annotated: np.array of bool
+        """
+        self.token_table = token_table
+        self.segment_table = segment_table
+        self.label_table = label_table
+        self.token_ids = token_ids
+        self.token_offsets = token_offsets
+        self.segment_ids = segment_ids
+        self.label_ids = label_ids
+        self.segment_offsets = segment_offsets
+        self.annotated = annotated
+
+    @staticmethod
+    def from_instances(instances):
+        """
+        Packs instances into a corpus
+
+        The instances are only read once, in order, so they can be streamed
+        in with iter_instances().
+
+        :param instances: The instances to pack
+        :type instances: iterable of Instance
+        :rtype: Corpus
+        """
+        tokens, segments, labels = Vocabulary(), Vocabulary(), Vocabulary()
+        token_ids, segment_ids, label_ids = array('i'), array('i'), array('i')
+        token_offsets, segment_offsets = array('q', [0]), array('q', [0])
+        annotated = array('b')
+
+        for instance in instances:
+            token_ids.extend(map(tokens.id, instance.tokens))
+            token_offsets.append(len(token_ids))
+            annotated.append(instance.segments is not None)
+            if instance.segments is not None:
+                segment_ids.extend(map(segments.id, instance.segments))
+                label_ids.extend(map(labels.id, instance.labels))
+            segment_offsets.append(len(segment_ids))
+
+        return Corpus(tokens, segments, labels,
+                      np.frombuffer(token_ids, dtype=np.intc),
+                      np.frombuffer(token_offsets, dtype=np.int64),
+                      np.frombuffer(segment_ids, dtype=np.intc),
+                      np.frombuffer(label_ids, dtype=np.intc),
+                      np.frombuffer(segment_offsets, dtype=np.int64),
+                      np.frombuffer(annotated, dtype=np.bool_))
+
+    @staticmethod
+    def load(path_or_lines, strict=True, tokenize=None):
+        """
+        Reads a corpus from instance-formatted lines, or a file of them; see
+        iter_instances()
+
+        :rtype: Corpus
+        """
+        if isinstance(path_or_lines, (str, os.PathLike)) \
+                and is_compiled(path_or_lines):
+            return Corpus.load_compiled(path_or_lines)
+        return Corpus.from_instances(iter_instances(path_or_lines, strict,
+                                                    tokenize))
+
+    @staticmethod
+    def load_compiled(path):
+        """
+        Opens a corpus written by save()
+
+        The arrays are memory-mapped rather than read, so opening even a
+        very large corpus is fast, and processes that open the same file
+        share its pages.
+
+        :param path: The file to open
+        :type path: str or os.PathLike
+        :rtype: Corpus
+        """
+        with open(path, 'rb') as corpus_file:
+            magic, version, header_length = CORPUS_PREAMBLE.unpack(
+                corpus_file.read(CORPUS_PREAMBLE.size))
+            if not magic == CORPUS_MAGIC:
+                raise ParseError(f"{os.fspath(path)} is not a compiled corpus")
+            if version > CORPUS_VERSION:
+                raise ParseError(f"{os.fspath(path)} is a version {version} \
+corpus; only versions up to {CORPUS_VERSION} can be read")
+            header = json.loads(corpus_file.read(header_length))
+            buffer = mmap.mmap(corpus_file.fileno(), 0,
+                               access=mmap.ACCESS_READ)
+
+        start = Corpus.__align(CORPUS_PREAMBLE.size + header_length)
+        arrays = [np.frombuffer(buffer, dtype=spec['dtype'],
+                                count=spec['length'],
+                                offset=start + spec['offset'])
+                  for spec in header['arrays']]
+
+        tables = []
+        for strings in header['tables']:
+            table = Vocabulary(strings)
+            table.freeze()
+            tables.append(table)
+
+        return Corpus(*tables, *arrays)
+
+    def save(self, path):
+        """
+        Writes the corpus to a compiled file that can be opened with
+        load_compiled()
+
+        The file starts with CORPUS_MAGIC, the format version, and the length
+        of a JSON header holding the string tables and the layout of the
+        arrays. The arrays follow, each aligned to CORPUS_ALIGNMENT bytes.
+
+        :param path: The file to write to
+        :type path: str or os.PathLike
+        """
+        tables = [self.token_table, self.segment_table, self.label_table]
+        # Ids are stored in the smallest type that holds them all
+        arrays = [self.token_ids.astype(np.min_scalar_type(len(tables[0]))),
+                  self.token_offsets,
+                  self.segment_ids.astype(np.min_scalar_type(len(tables[1]))),
+                  self.label_ids.astype(np.min_scalar_type(len(tables[2]))),
+                  self.segment_offsets, self.annotated]
+
+        specs = []
+        offset = 0
+        for values in arrays:
+            specs.append({'dtype': values.dtype.str, 'length': len(values),
+                          'offset': offset})
+            offset = Corpus.__align(offset + values.nbytes)
+
+        header = json.dumps({
+            'tables': [table.tokens[1:] for table in tables],
+            'arrays': specs
+        }).encode('utf-8')
+        start = Corpus.__align(CORPUS_PREAMBLE.size + len(header))
+
+        with open(path, 'wb') as corpus_file:
+            corpus_file.write(CORPUS_PREAMBLE.pack(CORPUS_MAGIC,
+                                                   CORPUS_VERSION,
+                                                   len(header)))
+            corpus_file.write(header)
+            for values, spec in zip(arrays, specs):
+                corpus_file.seek(start + spec['offset'])
+                corpus_file.write(np.ascontiguousarray(values).tobytes())
+            # Empty arrays at the end still need to fall within the file
+            corpus_file.truncate(start + offset)
+
+    @staticmethod
+    def __align(offset):
+        # Rounds up to the next multiple of CORPUS_ALIGNMENT
+        return -(-offset // CORPUS_ALIGNMENT) * CORPUS_ALIGNMENT
+
+    def shape(self, index):
+        """
+        :return: The shape of an instance
+        :rtype: str
+        """
+        return ''.join(self.tokens(index))
+
+    def shape_ids(self, index):
+        """
+        :return: The token ids of an instance's shape, as a view into the
+                 corpus
+        :rtype: np.array
+        """
+        return self.token_ids[self.token_offsets[index]:
+                              self.token_offsets[index+1]]
+
+    def tokens(self, index):
+        """
+        :return: The tokens of an instance's shape
+        :rtype: list of str
+        """
+        return self.token_table.decode(self.shape_ids(index))
+
+    def segments(self, index):
+        """
+        :return: The segments of an instance, or None if it has none
+        :rtype: list of str
+        """
+        if not self.annotated[index]:
+            return None
+        return self.segment_table.decode(self.segment_ids[
+            self.segment_offsets[index]:self.segment_offsets[index+1]])
+
+    def labels(self, index):
+        """
+        :return: The labels of an instance, or None if it has none
+        :rtype: list of str
+        """
+        if not self.annotated[index]:
+            return None
+        return self.label_table.decode(self.label_ids[
+            self.segment_offsets[index]:self.segment_offsets[index+1]])
+
+    def annotations(self, index):
+        """
+        :return: The segment/label pairs of an instance
+        :rtype: list of (str, str)
+        """
+        return list(zip(self.segments(index), self.labels(index)))
+
+    def annotated_indices(self):
+        """
+        :return: The indices of the instances that have segments and labels
+        :rtype: np.array
+        """
+        return np.flatnonzero(self.annotated)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Corpus index out of range')
+        return InstanceView(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield InstanceView(self, index)
+
+    def __len__(self):
+        return len(self.token_offsets) - 1
+
+
+class InstanceView:
+    """
+    A lightweight, read-only view of one instance in a Corpus, with the same
+    attributes as an Instance
+
+    Its attributes are decoded from the corpus each time they are read.
+    """
+    __slots__ = ('corpus', 'index')
+
+    def __init__(self, corpus, index):
+        """
+        Initializes the view
+
+        :param corpus: The corpus the instance belongs to
+        :type corpus: Corpus
+        :param index: The position of the instance in the corpus
+        :type index: int
+        """
+        self.corpus = corpus
+        self.index = index
+
+    @property
+    def shape(self):
+        """
+        The written shape of the instance
+
+        :rtype: str
+        """
+        return self.corpus.shape(self.index)
+
+    @property
+    def tokens(self):
+        """
+        The tokens of the shape
+
+        :rtype: list of str
+        """
+        return self.corpus.tokens(self.index)
+
+    @property
+    def segments(self):
+        """
+        The segments that make up the shape
+
+        :rtype: list of str
+        """
+        return self.corpus.segments(self.index)
+
+    @property
+    def labels(self):
+        """
+        The labels for each segment
+
+        :rtype: list of str
+        """
+        return self.corpus.labels(self.index)
+
+    @property
+    def annotations(self):
+        """
+        Returns the combination of the instance's segments and labels
+
+        :rtype: list of (str, str)
+        """
+        return self.corpus.annotations(self.index)
+
+    def annotation_string(self):
+        """
+        Returns a string representation of the instance's segments and labels
+        """
+        return '-'.join([f"{segment}/{label}"
+                         for segment, label in self.annotations])
+
+    def __eq__(self, other):
+        return self.shape == other.shape and \
+               self.segments == other.segments and \
+               self.labels == other.labels
+
+
+class InstanceIndex:
+    """
+    The byte ranges of the instances in an instance file, so that any one of
+    them can be read without parsing the rest
+
+    Each instance is also keyed by a hash of its shape, which divides the
+    file into shards that are the same every time, without any coordination
+    between the processes reading them.
+    """
+    def __init__(self, file_name, size, mtime, starts, ends, line_numbers,
+                 keys):
+        """
+        Initializes the index; see build()
+
+        :param file_name: The indexed file
+        :type file_name: str
+        :param size: The size of the file when it was indexed
+        :type size: int
+        :param mtime: The modification time of the file when it was indexed,
+                      in nanoseconds
+        :type mtime: int
+        :param starts: The byte offset that each instance starts at
+        :type starts: np.array
+        :param ends: The byte offset that each instance ends at
+        :type ends: np.array
+        :param line_numbers: The line that each instance starts on
+        :type line_numbers: np.array
+        :param keys: The CRC-32 of each shape
+        :type keys: np.array
+        """
+        self.file_name = file_name
+        self.size = size
+        self.mtime = mtime
+        self.starts = starts
+        self.ends = ends
+        self.line_numbers = line_numbers
+        self.keys = keys
+
+    @staticmethod
+    def build(file_name):
+        """
+        Indexes an instance file in a single pass over it
+
+        :param file_name: The file to index. It must be a plain instance
+                          file: compressed files and archives cannot be read
+                          from an offset, and compiled corpora have no
+                          instance text to index.
+        :type file_name: str or os.PathLike
+        :rtype: InstanceIndex
+        """
+        if is_compressed(file_name):
+            raise ParseError(f"{os.fspath(file_name)}: Compressed files \
+cannot be indexed.")
+        if is_compiled(file_name):
+            raise ParseError(f"{os.fspath(file_name)}: Compiled corpora \
+cannot be indexed; open them with Corpus.load_compiled() instead.")
+        if is_archive(file_name) or tarfile.is_tarfile(file_name):
+            raise ParseError(f"{os.fspath(file_name)}: Archives cannot be \
+indexed.")
+
+        starts, ends = array('q'), array('q')
+        line_numbers, keys = array('q'), array('I')
+        offset = 0
+        in_block = False
+
+        with open(file_name, 'rb') as instance_file:
+            stat = os.fstat(instance_file.fileno())
+            for line_number, line in enumerate(instance_file, 1):
+                if line.strip():
+                    if not in_block:
+                        starts.append(offset)
+                        line_numbers.append(line_number)
+                        keys.append(zlib.crc32(b''.join(line.split())))
+                        in_block = True
+                elif in_block:
+                    ends.append(offset)
+                    in_block = False
+                offset += len(line)
+
+        if in_block:
+            ends.append(offset)
+
+        return InstanceIndex(os.fspath(file_name), stat.st_size,
+                             stat.st_mtime_ns,
+                             *(np.array(values, dtype=np.int64)
+                               for values in (starts, ends, line_numbers)),
+                             np.array(keys, dtype=np.uint32))
+
+    @staticmethod
+    def open(file_name):
+        """
+        Loads the index kept beside an instance file, or builds and saves one
+        if there is none or the file has changed since it was built
+
+        :param file_name: The indexed file
+        :type file_name: str or os.PathLike
+        :rtype: InstanceIndex
+        """
+        index_path = f'{os.fspath(file_name)}{INDEX_EXTENSION}'
+        if os.path.exists(index_path):
+            index = InstanceIndex.load(index_path)
+            if index.is_current():
+                return index
+
+        index = InstanceIndex.build(file_name)
+        index.save(index_path)
+        return index
+
+    def save(self, path):
+        """
+        Saves the index to the specified path
+        """
+        with open(path, 'wb') as index_file:
+            pickle.dump(self, index_file)
+
+    @staticmethod
+    def load(path):
+        """
+        Loads a saved index from a specified path
+        """
+        with open(path, 'rb') as index_file:
+            return pickle.load(index_file)
+
+    def is_current(self):
+        """
+        Whether the indexed file is unchanged since the index was built
+
+        :rtype: bool
+        """
+        try:
+            stat = os.stat(self.file_name)
+        except OSError:
+            return False
+        return stat.st_size == self.size and stat.st_mtime_ns == self.mtime
+
+    def read(self, index, strict=True, tokenize=None):
+        """
+        Reads one instance from the file
+
+        :param index: The position of the instance in the file
+        :type index: int
+        :param strict: Whether the instance must have segments and labels
+        :type strict: bool
+        :param tokenize: A function to tokenize the shape with. Defaults to
+                         list()
+        :type tokenize: callable
+        :rtype: Instance
+        """
+        return next(self.read_many([index], strict, tokenize))
+
+    def read_many(self, indices, strict=True, tokenize=None):
+        """
+        Reads several instances from the file, in the order given; see read()
+
+        :param indices: The positions of the instances in the file
+        :type indices: iterable of int
+        :rtype: generator of Instance
+        """
+        with open(self.file_name, 'rb') as instance_file:
+            for index in indices:
+                if index < 0:
+                    index += len(self)
+                if not 0 <= index < len(self):
+                    raise IndexError(f"Instance {index} is out of range.")
+
+                instance_file.seek(self.starts[index])
+                data = instance_file.read(self.ends[index]
+                                          - self.starts[index])
+                lines = io.TextIOWrapper(io.BytesIO(data))
+
+                try:
+                    yield Instance.fit([line.split() for line in lines
+                                        if line.strip()],
+                                       strict, tokenize)
+                except ParseError as error:
+                    raise ParseError(f"{self.file_name}, line \
+{self.line_numbers[index]}: {error}") from error
+
+    def shard(self, shard, num_shards):
+        """
+        Finds the instances in one of *num_shards* shards of the file
+
+        Instances are assigned to shards by a hash of their shapes, so the
+        shards are of similar sizes and every instance with the same shape is
+        in the same one.
+
+        :param shard: The shard to find, from 0 to num_shards - 1
+        :type shard: int
+        :param num_shards: The number of shards to divide the file into
+        :type num_shards: int
+        :return: The positions of the instances in the shard, in order
+        :rtype: np.array
+        """
+        if not 0 <= shard < num_shards:
+            raise ValueError(f"Shard {shard} is not between 0 and \
+{num_shards - 1}.")
+        return np.flatnonzero(self.keys % num_shards == shard)
+
+    def iter_shard(self, shard, num_shards, strict=True, tokenize=None):
+        """
+        Reads the instances in one shard of the file; see shard() and read()
+
+        :rtype: generator of Instance
+        """
+        return self.read_many(self.shard(shard, num_shards), strict,
+                              tokenize)
+
+    def __len__(self):
+        return len(self.starts)
+
+
+def load_file(file_name, strict=True, tokenize=None, n_jobs=None):
+    """
+    Loads a list of instances from a file; see load()
+
+    If the file is a compiled corpus, it is opened as a Corpus instead, which
+    can be used in place of the list. Compressed files and archives are read
+    as iter_instances() reads them.
+
+    :param n_jobs: The number of processes to parse the file with; see
+                   load_parallel(). By default, it is parsed in the current
+                   process. Compressed files and archives cannot be split up,
+                   so they are always parsed in the current process.
+    :type n_jobs: int
+    """
+    if is_compiled(file_name):
+        return Corpus.load_compiled(file_name)
+    if n_jobs is not None and not n_jobs == 1 \
+            and not is_archive(file_name) \
+            and not is_compressed(file_name):
+        return load_parallel(file_name, strict, tokenize, n_jobs)
+    return list(iter_instances(file_name, strict, tokenize))
+
+
+def load_parallel(file_name, strict=True, tokenize=None, n_jobs=-1):
     """
-    Loads a list of instances from a file
+    Loads a list of instances from a file, parsing parts of it in several
+    processes at once
+
+    The file is split into byte ranges at blank lines, so that no instance
+    is split between two ranges, and the instances of each range are put
+    back together in order.
+
+    :param file_name: The file to read
+    :type file_name: str or os.PathLike
+    :param strict: Whether each instance must have segments and labels
+    :type strict: bool
+    :param tokenize: A function to tokenize each shape with. It has to be
+                     sent to the other processes, so it must be picklable,
+                     e.g. a spiel.vocab.Tokenizer rather than a lambda.
+    :type tokenize: callable
+    :param n_jobs: The number of processes to use; -1 uses every available
+                   CPU
+    :type n_jobs: int
+    :rtype: list of Instance
     """
-    with open(file_name) as instance_file:
-        return load(instance_file, strict)
+    workers = num_workers(n_jobs)
+    ranges = __chunk_ranges(file_name, workers * CHUNKS_PER_WORKER)
+    instances = []
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(__parse_chunk, file_name, start, end, strict,
+                               tokenize)
+                   for start, end in ranges]
 
+        for (start, _), future in zip(ranges, futures):
+            try:
+                instances.extend(future.result())
+            except ParseError as error:
+                # The chunk only knows where the error is relative to itself
+                line_number = __count_lines(file_name, start) \
+                    + error.line_number
+                raise ParseError(f"{os.fspath(file_name)}, line \
+{line_number}: {error.reason}") from error
 
-def load(lines, strict=True):
+    return instances
+
+
+def load(lines, strict=True, tokenize=None):
     """
     Loads a list of instances from a list of lines
 
@@ -93,23 +812,366 @@ def load(lines, strict=True):
     Line 3*n: Labels
     Line 4*n: blank
 
+    :param tokenize: A function to tokenize each shape with as it is loaded.
+                     Defaults to list()
+    :type tokenize: callable
     :return: A list of training instances
     :rtype: list of Instance
     """
-    instances = []
+    return list(iter_instances(lines, strict, tokenize))
+
 
+def iter_instances(path_or_lines, strict=True, tokenize=None):
+    """
+    Reads instances one at a time, as each block of lines is finished; see
+    load() for the format
+
+    Only the current block is held in memory, so files of any size can be
+    read. Files compressed with gzip, bzip2, or xz are decompressed as they
+    are read, and tar archives are read with iter_archive_instances(). An
+    archive that holds more than one split must be given with the split to
+    read, as in corpus.tgz#train, so that splits are not mixed by accident.
+
+    :param path_or_lines: A file to read from, or the lines to read
+    :type path_or_lines: str or os.PathLike or iterable of str
+    :param strict: Whether each instance must have segments and labels
+    :type strict: bool
+    :param tokenize: A function to tokenize each shape with as it is loaded.
+                     Defaults to list()
+    :type tokenize: callable
+    :return: The instances, in order
+    :rtype: generator of Instance
+    """
+    if isinstance(path_or_lines, (str, os.PathLike)):
+        if is_compiled(path_or_lines):
+            yield from Corpus.load_compiled(path_or_lines)
+            return
+        if is_archive(path_or_lines):
+            archive, split = split_archive_path(path_or_lines)
+            splits = archive_splits(archive)
+            if split is None and len(splits) > 1:
+                raise ParseError(f"{archive} holds several splits \
+({', '.join(splits)}); choose one, as in {archive}\
+{ARCHIVE_SPLIT_SEPARATOR}{splits[0]}.")
+            yield from iter_archive_instances(archive, split, tokenize)
+            return
+        with open_text(path_or_lines) as instance_file:
+            yield from __parse_blocks(instance_file, strict, tokenize,
+                                      f"{os.fspath(path_or_lines)}, ")
+    else:
+        yield from __parse_blocks(path_or_lines, strict, tokenize)
+
+
+def iter_paired_instances(originals, segmentations, tokenize=None,
+                          source=''):
+    """
+    Reads instances from a pair of line-aligned files, like those in the
+    nn/data corpora: one holds a shape on each line, and the other holds the
+    segmentation of each shape, with its segments separated by hyphens
+
+    Those files have no glosses, so each segment is used as its own label.
+
+    :param originals: The lines of shapes
+    :type originals: iterable of str
+    :param segmentations: The lines of segmentations
+    :type segmentations: iterable of str
+    :param tokenize: A function to tokenize each shape with as it is loaded.
+                     Defaults to list()
+    :type tokenize: callable
+    :param source: Where the lines come from, to start error messages with
+    :type source: str
+    :rtype: generator of Instance
+    """
+    originals, segmentations = iter(originals), iter(segmentations)
+
+    for line_number, shape in enumerate(originals, 1):
+        segmentation = next(segmentations, None)
+        if segmentation is None:
+            raise ParseError(f"{source}line {line_number}: There are more \
+shapes than segmentations.")
+
+        shape, segments = shape.strip(), segmentation.split()
+        if not shape:
+            continue
+        if not segments:
+            raise ParseError(f"{source}line {line_number}: Shape '{shape}' \
+has no segmentation.")
+
+        segments = ''.join(segments).split(SEGMENT_SEPARATOR)
+        yield Instance(shape, segments, segments,
+                       tokenize(shape) if tokenize else None)
+
+    if any(line.strip() for line in segmentations):
+        raise ParseError(f"{source}There are more segmentations than \
+shapes.")
+
+
+def iter_archive_instances(archive, split=None, tokenize=None):
+    """
+    Reads instances from the pairs of .original and .segmented files in a
+    tar archive, without extracting them; see iter_paired_instances()
+
+    :param archive: The archive to read, compressed or not
+    :type archive: str or os.PathLike
+    :param split: Only read the pairs in a directory with this name, or
+                  whose names end in it, e.g. 'train' for
+                  pa-corpus/train/pa-train.original. Defaults to every pair.
+    :type split: str
+    :param tokenize: A function to tokenize each shape with as it is loaded.
+                     Defaults to list()
+    :type tokenize: callable
+    :rtype: generator of Instance
+    """
+    with tarfile.open(archive, 'r:*') as archive_file:
+        members = {member.name: member for member in archive_file
+                   if member.isfile()}
+
+        for name in members:
+            stem = PurePosixPath(name)
+            if not stem.suffix == ORIGINAL_EXTENSION:
+                continue
+            stem = stem.with_suffix('')
+            if split is not None and split not in stem.parts[:-1] \
+                    and not stem.name.endswith(split):
+                continue
+
+            segmented = members.get(f'{stem}{SEGMENTED_EXTENSION}')
+            if segmented is None:
+                raise ParseError(f"{os.fspath(archive)}: {name} has no \
+{SEGMENTED_EXTENSION} file.")
+
+            # Members of a compressed archive can only be read in order, so
+            # both files of a pair are read before either is parsed
+            originals = __read_lines(archive_file, members[name])
+            segmentations = __read_lines(archive_file, segmented)
+            yield from iter_paired_instances(
+                originals, segmentations, tokenize,
+                f"{os.fspath(archive)}, {name}, ")
+
+
+def archive_splits(archive):
+    """
+    Lists the splits that the pairs of files in a tar archive belong to: the
+    directories they are in, or the names of pairs that are not in one
+
+    :param archive: The archive to list, compressed or not
+    :type archive: str or os.PathLike
+    :rtype: list of str
+    """
+    with tarfile.open(archive, 'r:*') as archive_file:
+        stems = [PurePosixPath(member.name).with_suffix('')
+                 for member in archive_file
+                 if member.isfile()
+                 and member.name.endswith(ORIGINAL_EXTENSION)]
+    return sorted({stem.parts[-2] if len(stem.parts) > 1 else stem.name
+                   for stem in stems})
+
+
+def split_archive_path(path):
+    """
+    Separates a path like corpus.tgz#train into the archive and the split to
+    read from it
+
+    :param path: The path to separate
+    :type path: str or os.PathLike
+    :return: The path and the split, or the whole path and None if it names
+             no split
+    :rtype: (str, str)
+    """
+    path = os.fspath(path)
+    archive, separator, split = path.rpartition(ARCHIVE_SPLIT_SEPARATOR)
+    if separator and split and archive.endswith(ARCHIVE_EXTENSIONS):
+        return archive, split
+    return path, None
+
+
+def open_text(path):
+    """
+    Opens a file for reading as text, decompressing it as it is read if it is
+    compressed with gzip, bzip2, or xz
+
+    Compressed files are recognized by the bytes they start with, or by
+    their extensions if they are empty.
+
+    :param path: The file to open
+    :type path: str or os.PathLike
+    :rtype: io.TextIOBase
+    """
+    compression = __compression(path)
+    if compression is None:
+        return open(path)
+    return compression.open(path, 'rt')
+
+
+def is_compressed(path):
+    """
+    Determines whether a file is compressed in a way that open_text()
+    recognizes
+
+    :param path: The file to check
+    :type path: str or os.PathLike
+    :rtype: bool
+    """
+    return __compression(path) is not None
+
+
+def is_archive(path):
+    """
+    Determines whether a path names a tar archive, by its extension; it may
+    name a split of one, as in corpus.tgz#train
+
+    :param path: The path to check
+    :type path: str or os.PathLike
+    :rtype: bool
+    """
+    return split_archive_path(path)[0].endswith(ARCHIVE_EXTENSIONS)
+
+
+def is_compiled(path):
+    """
+    Determines whether a file is a compiled corpus, rather than text
+
+    :param path: The file to check
+    :type path: str or os.PathLike
+    :rtype: bool
+    """
+    if is_archive(path):
+        return False
+    with open(path, 'rb') as corpus_file:
+        return corpus_file.read(len(CORPUS_MAGIC)) == CORPUS_MAGIC
+
+
+def __compression(path):
+    """
+    Finds the module that decompresses a file, if it is compressed
+
+    :rtype: module
+    """
+    with open(path, 'rb') as data_file:
+        start = data_file.read(max(len(magic) for magic in COMPRESSION_MAGIC))
+
+    for magic, module in COMPRESSION_MAGIC.items():
+        if start.startswith(magic):
+            return module
+    if not start:
+        return COMPRESSION_EXTENSIONS.get(os.path.splitext(path)[1])
+    return None
+
+
+def __read_lines(archive_file, member):
+    """
+    Reads the lines of a file in an archive
+
+    :rtype: list of str
+    """
+    with archive_file.extractfile(member) as member_file:
+        return io.TextIOWrapper(member_file, encoding='utf-8').readlines()
+
+
+def __chunk_ranges(file_name, num_chunks):
+    """
+    Splits a file into about *num_chunks* byte ranges of similar sizes,
+    each of which ends just after a blank line or at the end of the file
+
+    :rtype: list of (int, int)
+    """
+    size = os.path.getsize(file_name)
+    boundaries = [0]
+
+    with open(file_name, 'rb') as instance_file:
+        for chunk in range(1, num_chunks):
+            target = size * chunk // num_chunks
+            if target <= boundaries[-1]:
+                continue
+
+            # Skip the rest of the line the target falls in, and then up to
+            # the next blank line
+            instance_file.seek(target)
+            instance_file.readline()
+            line = instance_file.readline()
+            while line and line.strip():
+                line = instance_file.readline()
+
+            boundary = instance_file.tell()
+            if boundary >= size:
+                break
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+
+    boundaries.append(size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:])
+            if end > start]
+
+
+def __parse_chunk(file_name, start, end, strict, tokenize):
+    """
+    Parses the instances in a byte range of a file
+
+    :rtype: list of Instance
+    """
+    with open(file_name, 'rb') as instance_file:
+        instance_file.seek(start)
+        data = instance_file.read(end - start)
+
+    # Decode the same way that open() would in text mode
+    lines = io.TextIOWrapper(io.BytesIO(data))
+    return list(__parse_blocks(lines, strict, tokenize))
+
+
+def __count_lines(file_name, end):
+    """
+    Counts the lines in a file before a byte offset
+
+    :rtype: int
+    """
+    with open(file_name, 'rb') as instance_file:
+        return instance_file.read(end).count(b'\n')
+
+
+def __parse_blocks(lines, strict, tokenize, source=''):
+    """
+    Parses blank-line-delimited blocks of lines into instances
+
+    :param lines: The lines to parse
+    :type lines: iterable of str
+    :param strict: Whether each instance must have segments and labels
+    :type strict: bool
+    :param tokenize: A function to tokenize each shape with
+    :type tokenize: callable
+    :param source: Where the lines come from, to start error messages with
+    :type source: str
+    :rtype: generator of Instance
+    """
     data = []
+    first_line = None
 
-    for line in lines:
+    for line_number, line in enumerate(lines, 1):
         line = line.strip()
         if not line:
             if data:
-                instances.append(Instance.fit(data, strict))
+                yield __fit(data, strict, tokenize, source, first_line)
                 data = []
         else:
+            if not data:
+                first_line = line_number
             data.append(line.split())
 
     if data:
-        instances.append(Instance.fit(data, strict))
+        yield __fit(data, strict, tokenize, source, first_line)
+
+
+def __fit(data, strict, tokenize, source, line_number):
+    """
+    Builds an instance from a block of lines, noting where the block started
+    in any error
+
+    :rtype: Instance
+    """
+    try:
+        return Instance.fit(data, strict, tokenize)
+    except ParseError as error:
+        located = ParseError(f"{source}line {line_number}: {error}")
+        located.line_number = line_number
+        located.reason = str(error)
+        raise located from error
 
-    return instances
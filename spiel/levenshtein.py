@@ -6,18 +6,52 @@ is designed to accept any list of comparables instead of just strings, create
 lists of operations that are independent of the contexts from which they were
 generated, and then apply those operations using arbitrary reference points
 instead of the original target.
+
+Anywhere an iterable of tokens is accepted, an array of token ids from
+spiel.vocab can be used instead, which saves mapping the tokens to ids here.
 """
 from abc import ABCMeta, abstractmethod
+from array import array
+from collections import namedtuple
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from operator import itemgetter
+import pickle
 import re
 import numpy as np
-from spiel.util import flatten
+from spiel.util import num_workers
+from spiel.vocab import is_encoded
 
 INSERT_SYMBOL = 'I'
 DELETE_SYMBOL = 'D'
 REPLACE_SYMBOL = 'R'
 
+# The number of matrix cells that a batched distance computation will hold in
+# memory at once
+BATCH_CELLS = 2 ** 22
+
+PADDING_ID = -1
+
+# The longest iterable (in tokens) that the bit-parallel backend will use as
+# its pattern; longer pairs are handled by the matrix
+BIT_PARALLEL_MAX_LENGTH = 64
+
+# The length (in tokens) above which operations() stops holding the whole
+# Levenshtein matrix in memory
+LINEAR_SPACE_THRESHOLD = 2000
+
+# The number of rows that the linear space alignment fills in at once
+BLOCK_ROWS = 64
 
-def distance(origin, target):
+# Marks a cell reached from its diagonal neighbour without any operation
+_MATCH = 3
+
+MATRIX_BACKEND = 'matrix'
+BIT_PARALLEL_BACKEND = 'bit_parallel'
+
+
+def distance(origin, target, max_distance=None, backend=None):
     """
     Finds the Levenshtein distance between two iterables
 
@@ -25,14 +59,110 @@ def distance(origin, target):
     :type origin: str or list of str
     :param target: The iterable to end at
     :type target: str or list of str
+    :param max_distance: If provided, only distances up to this value are
+                         computed exactly; anything further is reported as
+                         max_distance + 1. For iterables too long for the
+                         bit-parallel backend, this is much faster when only
+                         close matches are of interest.
+    :type max_distance: int
+    :param backend: The algorithm to use; one of 'matrix' or 'bit_parallel'.
+                    By default, the bit-parallel algorithm is used whenever
+                    one of the iterables is at most BIT_PARALLEL_MAX_LENGTH
+                    tokens long. For longer iterables, the bit-parallel
+                    backend falls back to the matrix, or to the banded
+                    computation if *max_distance* is given.
+    :type backend: str
     :return: The minimum edit distance between the two iterables
     :rtype: int
     """
-    matrix = __build_matrix(origin, target)
-    return matrix[-1, -1]
+    if backend not in (None, MATRIX_BACKEND, BIT_PARALLEL_BACKEND):
+        raise ValueError(f"Unknown backend '{backend}'")
+
+    fits_in_bits = min(len(origin), len(target)) <= BIT_PARALLEL_MAX_LENGTH
+
+    if fits_in_bits and not backend == MATRIX_BACKEND:
+        result = __bit_parallel_distance(origin, target)
+    elif max_distance is not None and not backend == MATRIX_BACKEND:
+        return __bounded_distance(origin, target, max_distance)
+    else:
+        result = __build_matrix(origin, target)[-1, -1]
+
+    if max_distance is not None:
+        result = min(result, max_distance + 1)
+    return result
+
+
+def distance_many(origins, targets, n_jobs=None):
+    """
+    Finds the Levenshtein distance between every origin and every target
+
+    :param origins: The iterables to start from
+    :type origins: list of str or list of list of str
+    :param targets: The iterables to end at
+    :type targets: list of str or list of list of str
+    :param n_jobs: The number of processes to spread the work over; -1 uses
+                   every available CPU. By default, everything is computed in
+                   the current process.
+    :type n_jobs: int
+    :return: A matrix with a row for each origin and a column for each target
+    :rtype: np.array
+    """
+    origins = list(origins)
+    targets = list(targets)
+    encoded = __encode(*origins, *targets)
+    origin_ids, target_ids = encoded[:len(origins)], encoded[len(origins):]
+    distances = np.empty((len(origins), len(targets)), dtype=int)
+
+    if not origins or not targets:
+        return distances
+
+    # Sorting by length keeps the padding within each batch to a minimum
+    origin_order = sorted(range(len(origins)), key=lambda i: len(origins[i]))
+    target_order = sorted(range(len(targets)), key=lambda i: len(targets[i]))
 
+    longest_target = len(targets[target_order[-1]])
+    target_batch_size = max(1, BATCH_CELLS // (longest_target + 1))
 
-def operations(origin, target):
+    batches = []
+    for target_batch in __chunks(target_order, target_batch_size):
+        width = len(targets[target_batch[-1]]) + 1
+        origin_batch_size = max(1, BATCH_CELLS // (len(target_batch) * width))
+        for origin_batch in __chunks(origin_order, origin_batch_size):
+            batches.append((origin_batch, target_batch))
+
+    jobs = [([origin_ids[i] for i in origin_batch],
+             [target_ids[i] for i in target_batch])
+            for origin_batch, target_batch in batches]
+
+    if n_jobs is None or n_jobs == 1:
+        results = [__distance_batch(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers(n_jobs)) as pool:
+            results = list(pool.map(__distance_batch, *zip(*jobs)))
+
+    for (origin_batch, target_batch), result in zip(batches, results):
+        distances[np.ix_(origin_batch, target_batch)] = result
+
+    return distances
+
+
+def pairwise_distances(sequences, n_jobs=None):
+    """
+    Finds the Levenshtein distance between every pair of iterables in a list
+
+    :param sequences: The iterables to compare
+    :type sequences: list of str or list of list of str
+    :param n_jobs: The number of processes to spread the work over; see
+                   distance_many()
+    :type n_jobs: int
+    :return: A symmetric matrix with a row and a column for each iterable
+    :rtype: np.array
+    """
+    sequences = list(sequences)
+    return distance_many(sequences, sequences, n_jobs=n_jobs)
+
+
+def operations(origin, target, linear_space=None):
     """
     Finds the operations needed to achieve the minimum edit distance between
     two iterables
@@ -41,31 +171,89 @@ def operations(origin, target):
     :type origin: str or list of str
     :param target: The iterable to end at
     :type target: str or list of str
+    :param linear_space: Whether to avoid holding the whole Levenshtein matrix
+                         in memory, at the cost of recomputing parts of it.
+                         By default, this is done when either iterable is
+                         longer than LINEAR_SPACE_THRESHOLD tokens. The
+                         operations are the same either way.
+    :type linear_space: bool
     :return: The operations used to get from the origin to the target
     :rtype: generator of Operation
     """
+    if linear_space is None:
+        linear_space = max(len(origin), len(target)) > LINEAR_SPACE_THRESHOLD
+
+    if linear_space:
+        yield from __linear_space_operations(origin, target)
+        return
+
     matrix = __build_matrix(origin, target)
     i, j = [x-1 for x in matrix.shape]
     curr = matrix[i, j]
 
     while curr > 0:
-        if origin[i-1] == target[j-1]:
-            # If the origin and target characters are identical, there is no
-            # operation. Just move up diagonally and carry on.
-            new_i, new_j = i-1, j-1
+        i, j, oper = __backtrace_step(origin, target, i, j,
+                                      lambda pos: matrix[pos[0], pos[1]])
+        if oper:
+            yield oper
+        curr = matrix[i, j]
+
+
+def edit_script(origin, target, linear_space=None):
+    """
+    Finds the operations needed to achieve the minimum edit distance between
+    two iterables, as a compact EditScript
+
+    :param origin: The iterable to start from
+    :type origin: str or list of str
+    :param target: The iterable to end at
+    :type target: str or list of str
+    :param linear_space: See operations()
+    :type linear_space: bool
+    :return: The operations used to get from the origin to the target
+    :rtype: EditScript
+    """
+    return EditScript.from_operations(operations(origin, target,
+                                                 linear_space=linear_space))
+
+
+def operations_many(pairs):
+    """
+    Finds the operations needed to achieve the minimum edit distance for many
+    pairs of iterables at once
+
+    The matrices of pairs of similar sizes are filled in together, and only
+    the direction taken into each cell is kept for the backtrace. The
+    operations are the same as those from operations().
+
+    :param pairs: Origin/target pairs
+    :type pairs: list of (str, str) or list of (list of str, list of str)
+    :return: The operations used to get from each origin to its target
+    :rtype: list of EditScript
+    """
+    pairs = list(pairs)
+    encoded = __encode(*[sequence for pair in pairs for sequence in pair])
+    scripts = [None] * len(pairs)
+
+    batched = []
+    for index, (origin, target) in enumerate(pairs):
+        if max(len(origin), len(target)) > LINEAR_SPACE_THRESHOLD:
+            scripts[index] = edit_script(origin, target, linear_space=True)
         else:
-            options = [(i-1, j), (i-1, j-1), (i, j-1)]
-            new_i, new_j = min(options, key=lambda pos: matrix[pos[0], pos[1]])
+            batched.append(index)
 
-            if new_i == i-1 and new_j == j-1:
-                yield ReplaceOperation(i-1, j-1)
-            elif new_i == i-1:
-                yield DeleteOperation(i-1)
-            else:
-                yield InsertOperation(i-1, j-1)
+    # Sorting by size keeps the padding within each batch to a minimum
+    batched.sort(key=lambda i: (len(pairs[i][0]), len(pairs[i][1])))
 
-        i, j = new_i, new_j
-        curr = matrix[i, j]
+    for batch in __cell_batches(pairs, batched):
+        directions = __directions_batch([encoded[2*i] for i in batch],
+                                        [encoded[2*i+1] for i in batch])
+        for index, batch_directions in zip(batch, directions):
+            origin, target = pairs[index]
+            scripts[index] = __trace_directions(batch_directions, len(origin),
+                                                len(target))
+
+    return scripts
 
 
 def apply_operations(origin, reference, ops):
@@ -79,23 +267,48 @@ def apply_operations(origin, reference, ops):
                       target, from which the operations will reference for new
                       characters
     :type reference: str or list of str
+    :param ops: The operations to apply
+    :type ops: list of Operation or EditScript
     :return: The origin iterable, modified by the operations
     :rtype: Same as origin
     """
     string_mode = isinstance(origin, str)
     origin = list(origin)
 
-    for oper in ops:
-        oper.apply(origin, reference)
+    # Changes are made to each position in the order they were given, and
+    # insertions at a position go right after its original element, ahead of
+    # any earlier insertions there
+    changes = sorted(__operation_codes(ops, len(origin)), key=itemgetter(1))
+    output = []
+    copied = 0
+
+    for index, position_changes in groupby(changes, key=itemgetter(1)):
+        # Everything up to the next changed position is copied over as is
+        output.extend(origin[copied:index])
+        copied = index + 1
+
+        element = origin[index]
+        insertions = []
+        for code, _, target_pos in position_changes:
+            if code == EditScript.INSERT:
+                insertions.append(reference[target_pos])
+            elif code == EditScript.REPLACE:
+                element = reference[target_pos]
+            else:
+                element = None
 
-    origin = [x for x in flatten(origin) if x]
+        output.append(element)
+        output.extend(reversed(insertions))
+
+    output.extend(origin[copied:])
+    output = [x for x in output if x]
     if string_mode:
-        origin = ''.join(origin)
+        output = ''.join(output)
 
-    return origin
+    return output
 
 
-def annotate(origin, reference, ops, annotation=None):
+def annotate(origin, reference, ops, annotation=None, structured=False):
     """
     Uses a list of operations to create an annotation for how the operations
     should be applied, using an origin and a reference target
@@ -104,32 +317,455 @@ def annotate(origin, reference, ops, annotation=None):
     :type origin: str or list
     :param reference: The original target
     :type reference: str or list
-    :ops: The operations to apply
-    :type ops: list of Operation
+    :param ops: The operations to apply
+    :type ops: list of Operation or EditScript
     :param annotation: An optional initialization for the annotation. If none
                        is provided, the annotation will be based on the
                        origin. If one is provided, it will be modified by this
                        method.
+    :param structured: Whether to give back AnnotatedLabels instead of
+                       rendering them as strings like 'a+R(a,b)+I(c)'
+    :type structured: bool
     :return: An annotation based on the operations
-    :rtype: list of str
+    :rtype: list of str or list of AnnotatedLabel
     """
     annotation = annotation or list(origin)
+    labels = [label if isinstance(label, AnnotatedLabel)
+              else AnnotatedLabel(label) for label in annotation]
 
     for oper in ops:
-        oper.annotate(annotation, origin, reference)
-
-    for i, label in reversed(list(enumerate(annotation))):
-        if label[0] == '+' and i > 0:
-            annotation[i-1] += label
-            del annotation[i]
+        labels[oper.origin_pos] = oper.annotate_label(
+            labels[oper.origin_pos], origin, reference)
+
+    # Whatever is left of a deleted element belongs to the one before it.
+    # Each deleted element passes on only its own directives, as they were
+    # before any merging, so a run of deletions keeps just the first one's;
+    # the classes that models are trained on depend on this.
+    merged = []
+    previous_kept = False
+    for label in labels:
+        if merged and label.is_deleted():
+            if previous_kept:
+                merged[-1] = merged[-1].extend(label.directives)
+            previous_kept = False
+        else:
+            merged.append(label)
+            previous_kept = True
 
+    annotation[:] = merged if structured else [str(label)
+                                               for label in merged]
     return annotation
 
 
+def __operation_codes(ops, length):
+    """
+    Converts operations into (code, origin_pos, target_pos) triples, with
+    negative origin positions counted back from the end of the origin
+
+    :param ops: The operations to convert
+    :type ops: list of Operation or EditScript
+    :param length: The length of the origin the operations apply to
+    :type length: int
+    :return: The triples for each operation
+    :rtype: generator of (int, int, int)
+    """
+    if isinstance(ops, EditScript):
+        codes = ops.codes
+        triples = zip(codes[0::3], codes[1::3], codes[2::3])
+    else:
+        triples = ((EditScript.CODES[oper.type], oper.origin_pos,
+                    oper.target_pos) for oper in ops)
+
+    for code, origin_pos, target_pos in triples:
+        if origin_pos < 0:
+            origin_pos += length
+        if not 0 <= origin_pos < length:
+            raise IndexError('Operation position out of range')
+        yield code, origin_pos, target_pos
+
+
+def __backtrace_step(origin, target, i, j, cost):
+    """
+    Takes one step back through a Levenshtein matrix, from the cell at (i, j)
+    toward the cell at (0, 0)
+
+    :param origin: The iterable the matrix starts from
+    :type origin: str or list of str
+    :param target: The iterable the matrix ends at
+    :type target: str or list of str
+    :param i: The row of the current cell
+    :type i: int
+    :param j: The column of the current cell
+    :type j: int
+    :param cost: A function giving the value of the matrix at an (i, j) pair
+    :type cost: callable
+    :return: The position of the next cell, and the operation taken to get
+             from it to the current cell, if any
+    :rtype: (int, int, Operation or None)
+    """
+    if i == 0:
+        # Only insertions are left along the top row...
+        return i, j-1, InsertOperation(i-1, j-1)
+    if j == 0:
+        # ...and only deletions are left along the first column
+        return i-1, j, DeleteOperation(i-1)
+
+    if origin[i-1] == target[j-1]:
+        # If the origin and target characters are identical, there is no
+        # operation. Just move up diagonally and carry on.
+        return i-1, j-1, None
+
+    options = [(i-1, j), (i-1, j-1), (i, j-1)]
+    new_i, new_j = min(options, key=cost)
+
+    if new_i == i-1 and new_j == j-1:
+        return new_i, new_j, ReplaceOperation(i-1, j-1)
+    if new_i == i-1:
+        return new_i, new_j, DeleteOperation(i-1)
+    return new_i, new_j, InsertOperation(i-1, j-1)
+
+
+def __linear_space_operations(origin, target):
+    """
+    Finds the same operations as operations(), without holding the whole
+    Levenshtein matrix in memory
+
+    The rows of the matrix are recomputed as needed in a divide and conquer
+    fashion (after Hirschberg, 1975): to follow the path back from the bottom
+    of a stretch of rows, only the row at its middle is kept, and each half is
+    then handled on its own. Following the same path as the full matrix keeps
+    the tie-breaking identical, and only O(m log n) values are held at once.
+
+    :param origin: The iterable to start from
+    :type origin: str or list of str
+    :param target: The iterable to end at
+    :type target: str or list of str
+    :return: The operations used to get from the origin to the target
+    :rtype: generator of Operation
+    """
+    origin_ids, target_ids = __encode(origin, target)
+    top_row = np.arange(len(target) + 1)
+
+    j = yield from __trace_rows(origin, target, origin_ids, target_ids,
+                                0, top_row, len(origin), len(target))
+
+    # Anything left over along the top row must be inserted
+    while j > 0:
+        j -= 1
+        yield InsertOperation(-1, j)
+
+
+def __trace_rows(origin, target, origin_ids, target_ids, first, top_row,
+                 last, column):
+    """
+    Follows the path back through a Levenshtein matrix from the cell at
+    (*last*, *column*) until it reaches row *first*
+
+    :param origin: The iterable to start from
+    :type origin: str or list of str
+    :param target: The iterable to end at
+    :type target: str or list of str
+    :param origin_ids: The encoded origin
+    :type origin_ids: np.array
+    :param target_ids: The encoded target
+    :type target_ids: np.array
+    :param first: The row at which to stop
+    :type first: int
+    :param top_row: The values of row *first*, up to at least *column*
+    :type top_row: np.array
+    :param last: The row to start from
+    :type last: int
+    :param column: The column to start from
+    :type column: int
+    :return: The operations along the path; the generator returns the column
+             at which the path reaches row *first*
+    :rtype: generator of Operation
+    """
+    offsets = np.arange(column + 1)
+    target_ids = target_ids[:column]
+
+    if last - first <= BLOCK_ROWS:
+        block = np.empty((last - first + 1, column + 1), dtype=int)
+        block[0] = top_row[:column+1]
+        for i in range(1, len(block)):
+            __fill_row(block[i], block[i-1], origin_ids[first+i-1],
+                       target_ids, offsets)
+
+        i, j = last, column
+        while i > first and block[i-first, j] > 0:
+            i, j, oper = __backtrace_step(
+                origin, target, i, j, lambda pos: block[pos[0]-first, pos[1]])
+            if oper:
+                yield oper
+
+        # A zero means that everything before this point is identical, so the
+        # path carries on diagonally without any more operations
+        return j - (i - first)
+
+    middle = (first + last) // 2
+    row = top_row[:column+1].copy()
+    prev_row = np.empty_like(row)
+    for i in range(first, middle):
+        row, prev_row = prev_row, row
+        __fill_row(row, prev_row, origin_ids[i], target_ids, offsets)
+
+    j = yield from __trace_rows(origin, target, origin_ids, target_ids,
+                                middle, row, last, column)
+    return (yield from __trace_rows(origin, target, origin_ids, target_ids,
+                                    first, top_row, middle, j))
+
+
+def __cell_batches(pairs, order):
+    """
+    Splits the indices in *order* into consecutive batches whose padded
+    matrices fit within BATCH_CELLS
+
+    :param pairs: The origin/target pairs the indices refer to
+    :type pairs: list of (str, str)
+    :param order: The indices to split up
+    :type order: list of int
+    :rtype: generator of list of int
+    """
+    batch = []
+    height = width = 0
+    for index in order:
+        origin, target = pairs[index]
+        new_height = max(height, len(origin) + 1)
+        new_width = max(width, len(target) + 1)
+        if batch and (len(batch) + 1) * new_height * new_width > BATCH_CELLS:
+            yield batch
+            batch = []
+            new_height, new_width = len(origin) + 1, len(target) + 1
+        batch.append(index)
+        height, width = new_height, new_width
+    if batch:
+        yield batch
+
+
+def __directions_batch(origin_ids, target_ids):
+    """
+    Fills in the Levenshtein matrices of a batch of encoded pairs, keeping
+    only the direction that operations() would take back out of each cell
+
+    :param origin_ids: The encoded origins
+    :type origin_ids: list of np.array
+    :param target_ids: The encoded targets, one per origin
+    :type target_ids: list of np.array
+    :return: A code for each cell below the first row and right of the first
+             column of each matrix: _MATCH, or the EditScript code of the
+             operation taken
+    :rtype: np.array
+    """
+    origins, _ = __pad(origin_ids)
+    targets, _ = __pad(target_ids)
+    offsets = np.arange(targets.shape[1] + 1)
+
+    directions = np.empty((len(origins), origins.shape[1], targets.shape[1]),
+                          dtype=np.uint8)
+    row = np.broadcast_to(offsets, (len(origins), len(offsets))).copy()
+    prev_row = np.empty_like(row)
+
+    for i in range(origins.shape[1]):
+        row, prev_row = prev_row, row
+        tokens = origins[:, i, None]
+        __fill_row(row, prev_row, tokens, targets, offsets)
+
+        # The same tie-breaking as the backtrace: deletion, then replacement,
+        # then insertion
+        above, diagonal, left = prev_row[:, 1:], prev_row[:, :-1], row[:, :-1]
+        directions[:, i] = np.where(
+            tokens == targets, _MATCH,
+            np.where((above <= diagonal) & (above <= left), EditScript.DELETE,
+                     np.where(diagonal <= left, EditScript.REPLACE,
+                              EditScript.INSERT)))
+
+    return directions
+
+
+def __trace_directions(directions, height, width):
+    """
+    Follows the directions out of a matrix from its last cell back to its
+    first
+
+    :param directions: The directions for each cell of a (padded) matrix
+    :type directions: np.array
+    :param height: The length of the origin
+    :type height: int
+    :param width: The length of the target
+    :type width: int
+    :rtype: EditScript
+    """
+    cells = directions.tobytes()
+    stride = directions.shape[1]
+    codes = array('i')
+    i, j = height, width
+
+    while i > 0 or j > 0:
+        if i == 0:
+            code = EditScript.INSERT
+        elif j == 0:
+            code = EditScript.DELETE
+        else:
+            code = cells[(i-1)*stride + j-1]
+
+        if code == _MATCH:
+            i, j = i-1, j-1
+        elif code == EditScript.REPLACE:
+            codes.extend((code, i-1, j-1))
+            i, j = i-1, j-1
+        elif code == EditScript.DELETE:
+            codes.extend((code, i-1, -1))
+            i -= 1
+        else:
+            codes.extend((code, i-1, j-1))
+            j -= 1
+
+    return EditScript(codes)
+
+
+def __bit_parallel_distance(origin, target):
+    """
+    Finds the Levenshtein distance between two iterables using Myers'
+    bit-vector algorithm, as formulated by Hyyrö (2001)
+
+    The shorter iterable is used as the pattern; each column of the matrix is
+    represented as bit vectors of the vertical differences between its cells,
+    so a whole column is computed with a handful of integer operations.
+
+    :param origin: The iterable to start from
+    :type origin: str or list of str
+    :param target: The iterable to end at
+    :type target: str or list of str
+    :return: The minimum edit distance between the two iterables
+    :rtype: int
+    """
+    if len(origin) < len(target):
+        pattern, text = origin, target
+    else:
+        pattern, text = target, origin
+
+    if len(pattern) == 0:
+        return len(text)
+
+    # One bitmask per distinct token, marking where it occurs in the pattern
+    masks = {}
+    for i, token in enumerate(pattern):
+        masks[token] = masks.get(token, 0) | (1 << i)
+
+    all_bits = (1 << len(pattern)) - 1
+    last_bit = 1 << (len(pattern) - 1)
+    positive = all_bits
+    negative = 0
+    score = len(pattern)
+
+    for token in text:
+        match = masks.get(token, 0)
+        vertical = match | negative
+        horizontal = (((match & positive) + positive) ^ positive) | match
+        horizontal_positive = negative | (~(horizontal | positive) & all_bits)
+        horizontal_negative = positive & horizontal
+
+        if horizontal_positive & last_bit:
+            score += 1
+        elif horizontal_negative & last_bit:
+            score -= 1
+
+        horizontal_positive = ((horizontal_positive << 1) | 1) & all_bits
+        horizontal_negative = (horizontal_negative << 1) & all_bits
+        positive = horizontal_negative | \
+            (~(vertical | horizontal_positive) & all_bits)
+        negative = horizontal_positive & vertical
+
+    return score
+
+
+def __bounded_distance(origin, target, max_distance):
+    """
+    Finds the Levenshtein distance between two iterables, giving up as soon
+    as it is known to be greater than *max_distance*
+
+    Only the diagonal band of the matrix that can hold values up to
+    *max_distance* is filled in, so the cost grows with the length of the
+    iterables times *max_distance* rather than with the product of their
+    lengths.
+
+    :param origin: The iterable to start from
+    :type origin: str or list of str
+    :param target: The iterable to end at
+    :type target: str or list of str
+    :param max_distance: The largest distance to compute exactly
+    :type max_distance: int
+    :return: The distance, or max_distance + 1 if it is greater
+    :rtype: int
+    """
+    too_far = max_distance + 1
+    origin, target = __trim_affixes(origin, target)
+
+    # The distance is symmetric, so keep the band along the longer iterable
+    if len(origin) < len(target):
+        origin, target = target, origin
+    width = len(target) + 1
+
+    if len(origin) - len(target) > max_distance:
+        return too_far
+
+    # Cells outside of the band are never written, so they read as too_far
+    prev_row = [j if j <= max_distance else too_far for j in range(width)]
+    row = [too_far] * width
+
+    for i in range(1, len(origin) + 1):
+        start = max(1, i - max_distance)
+        end = min(width - 1, i + max_distance)
+
+        row[start-1] = i if start == 1 and i <= max_distance else too_far
+        best = row[start-1]
+        token = origin[i-1]
+
+        for j in range(start, end + 1):
+            cost = prev_row[j-1] + (0 if token == target[j-1] else 1)
+            cost = min(cost, prev_row[j] + 1, row[j-1] + 1, too_far)
+            row[j] = cost
+            best = min(best, cost)
+
+        if best > max_distance:
+            return too_far
+
+        row, prev_row = prev_row, row
+
+    return prev_row[-1]
+
+
+def __trim_affixes(origin, target):
+    """
+    Removes any prefix and suffix that two iterables have in common, since
+    they do not contribute to the distance between them
+
+    :param origin: The first iterable
+    :type origin: str or list of str
+    :param target: The second iterable
+    :type target: str or list of str
+    :return: The iterables without their common prefix and suffix
+    :rtype: (str, str) or (list of str, list of str)
+    """
+    start = 0
+    shortest = min(len(origin), len(target))
+    while start < shortest and origin[start] == target[start]:
+        start += 1
+
+    end = 0
+    while end < shortest - start and origin[-1-end] == target[-1-end]:
+        end += 1
+
+    return origin[start:len(origin)-end], target[start:len(target)-end]
+
+
 def __build_matrix(origin, target):
     """
     Builds a Levenshtein matrix based on two iterables
 
+    The matrix is filled one row at a time; each row is computed from the
+    previous one with whole-array operations instead of cell by cell.
+
     :param origin: The iterable to start from
     :type origin: str or list of str
     :param target: The iterable to end at
@@ -137,33 +773,142 @@ def __build_matrix(origin, target):
     :return: The corresponding Levenshtein matrix
     :rtype: np.array
     """
+    origin_ids, target_ids = __encode(origin, target)
     width = len(origin) + 1
     height = len(target) + 1
 
-    matrix = np.zeros((width, height), dtype=int)
+    matrix = np.empty((width, height), dtype=int)
+    offsets = np.arange(height)
 
-    # Fill in the empty row and column
-    for i in range(width):
-        matrix[i][0] = i
-    for i in range(1, height):
-        matrix[0][i] = i
+    # Fill in the empty row; the empty column is filled row by row
+    matrix[0] = offsets
 
     # Fill in the rest of the Levenshtein matrix
     for i in range(1, width):
-        for j in range(1, height):
-            sub_cost = 0 if origin[i-1] == target[j-1] else 1
-            options = [
-                matrix[i-1, j] + 1,          # deletion
-                matrix[i, j-1] + 1,          # insertion
-                matrix[i-1, j-1] + sub_cost  # substitution
-            ]
-            best_option = min(options)
-
-            matrix[i, j] = best_option
+        __fill_row(matrix[i], matrix[i-1], origin_ids[i-1], target_ids,
+                   offsets)
 
     return matrix
 
 
+def __fill_row(row, prev_row, token, target_ids, offsets):
+    """
+    Fills in one row of a Levenshtein matrix from the row above it
+
+    Any leading dimensions are treated as a batch of independent matrices.
+
+    :param row: The row to fill in
+    :type row: np.array
+    :param prev_row: The row above *row*
+    :type prev_row: np.array
+    :param token: The id of the origin token that corresponds to *row*
+    :type token: int or np.array
+    :param target_ids: The ids of the target tokens
+    :type target_ids: np.array
+    :param offsets: The column indices of the matrix, i.e. np.arange(width)
+    :type offsets: np.array
+    """
+    row[..., 0] = prev_row[..., 0] + 1
+
+    # Deletions and substitutions only depend on the row above
+    np.minimum(prev_row[..., 1:] + 1,
+               prev_row[..., :-1] + (target_ids != token),
+               out=row[..., 1:])
+
+    # Insertions chain along the row: row[j] = min(row[k] + j - k) for k <= j,
+    # which is a running minimum once the column index is subtracted out
+    row -= offsets
+    np.minimum.accumulate(row, axis=-1, out=row)
+    row += offsets
+
+
+def __encode(*sequences):
+    """
+    Maps the tokens of several iterables onto shared integer ids, so that
+    tokens can be compared as whole arrays
+
+    :param sequences: The iterables to encode
+    :type sequences: str or list of str
+    :return: An array of ids for each iterable
+    :rtype: list of np.array
+    """
+    # Arrays of ids from a shared vocabulary can be compared as they are
+    if all(is_encoded(sequence) for sequence in sequences):
+        return [sequence.astype(int, copy=False) for sequence in sequences]
+
+    ids = {}
+    return [np.array([ids.setdefault(token, len(ids)) for token in sequence],
+                     dtype=int)
+            for sequence in sequences]
+
+
+def __distance_batch(origin_ids, target_ids):
+    """
+    Finds the distances between a batch of encoded origins and a batch of
+    encoded targets, filling the rows of all of their matrices at once
+
+    :param origin_ids: The encoded origins
+    :type origin_ids: list of np.array
+    :param target_ids: The encoded targets
+    :type target_ids: list of np.array
+    :return: A matrix with a row for each origin and a column for each target
+    :rtype: np.array
+    """
+    origins, origin_lengths = __pad(origin_ids)
+    targets, target_lengths = __pad(target_ids)
+    offsets = np.arange(targets.shape[1] + 1)
+    target_index = np.arange(len(targets))
+
+    distances = np.empty((len(origins), len(targets)), dtype=int)
+    distances[origin_lengths == 0] = target_lengths
+
+    row = np.broadcast_to(offsets, (len(origins), len(targets), len(offsets)))
+    row = row.copy()
+    prev_row = np.empty_like(row)
+
+    for i in range(origins.shape[1]):
+        row, prev_row = prev_row, row
+        __fill_row(row, prev_row, origins[:, i, None, None], targets, offsets)
+
+        finished = origin_lengths == i + 1
+        if finished.any():
+            distances[finished] = row[finished][:, target_index,
+                                                target_lengths]
+
+    return distances
+
+
+def __pad(sequences):
+    """
+    Packs encoded iterables into a single array, padding the shorter ones
+
+    :param sequences: The encoded iterables
+    :type sequences: list of np.array
+    :return: The padded array, and the original length of each iterable
+    :rtype: (np.array, np.array)
+    """
+    lengths = np.array([len(sequence) for sequence in sequences], dtype=int)
+    padded = np.full((len(sequences), lengths.max(initial=0)), PADDING_ID,
+                     dtype=int)
+    for i, sequence in enumerate(sequences):
+        padded[i, :len(sequence)] = sequence
+    return padded, lengths
+
+
+def __chunks(items, size):
+    """
+    Splits a list into consecutive chunks of at most *size* items
+
+    :param items: The list to split up
+    :type items: list
+    :param size: The maximum number of items per chunk
+    :type size: int
+    :rtype: generator of list
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start+size]
+
+
 class Operation(metaclass=ABCMeta):
     """
     Abstract base class for all Operations
@@ -194,18 +939,41 @@ class Operation(metaclass=ABCMeta):
         :type reference: list or str
         """
 
-    @abstractmethod
     def annotate(self, annotation, origin, reference):
         """
         Marks *annotation* as being modified by this operation
 
         :param annotation: The annotation to mark
-        :type annotation: list of str
+        :type annotation: list of str or list of AnnotatedLabel
+        :param origin: The original iterable
+        :type origin: list or str
+        :param reference: The reference that this operation should modify
+                          toward
+        :type reference: list or str
+        """
+        label = annotation[self.origin_pos]
+        if isinstance(label, AnnotatedLabel):
+            annotation[self.origin_pos] = self.annotate_label(label, origin,
+                                                              reference)
+        else:
+            annotation[self.origin_pos] = str(self.annotate_label(
+                AnnotatedLabel.parse(label), origin, reference))
+
+    @abstractmethod
+    def annotate_label(self, label, origin, reference):
+        """
+        Adds the directive for this operation to the label of the element it
+        applies to
+
+        :param label: The label to add to
+        :type label: AnnotatedLabel
         :param origin: The original iterable
         :type origin: list or str
         :param reference: The reference that this operation should modify
                           toward
         :type reference: list or str
+        :return: The new label
+        :rtype: AnnotatedLabel
         """
 
     def __eq__(self, other):
@@ -261,22 +1029,10 @@ class ReplaceOperation(Operation):
             index = 0
         origin[index] = reference[self.target_pos]
 
-    def annotate(self, annotation, origin, reference):
-        """
-        Marks *annotation* as being modified by this operation
-
-        :param annotation: The annotation to mark
-        :type annotation: list of str
-        :param origin: The original iterable
-        :type origin: list or str
-        :param reference: The reference that this operation should modify
-                          toward
-        :type reference: list or str
-        """
-        index = self.origin_pos
-        origin_str = origin[self.origin_pos]
-        target_str = reference[self.target_pos]
-        annotation[index] += f"+{REPLACE_SYMBOL}({origin_str},{target_str})"
+    def annotate_label(self, label, origin, reference):
+        directive = Directive(REPLACE_SYMBOL, (origin[self.origin_pos],
+                                               reference[self.target_pos]))
+        return label.extend((directive,))
 
     def __repr__(self):
         return f"Replace {self.origin_pos} with {self.target_pos}"
@@ -312,20 +1068,9 @@ class InsertOperation(Operation):
         origin, index = self.next_original_element(origin)
         origin[index] = [origin[index], reference[self.target_pos]]
 
-    def annotate(self, annotation, origin, reference):
-        """
-        Marks *annotation* as being modified by this operation
-
-        :param annotation: The annotation to mark
-        :type annotation: list of str
-        :param origin: The original iterable
-        :type origin: list or str
-        :param reference: The reference that this operation should modify
-                          toward
-        :type reference: list or str
-        """
-        target_str = reference[self.target_pos]
-        annotation[self.origin_pos] += f"+{INSERT_SYMBOL}({target_str})"
+    def annotate_label(self, label, origin, reference):
+        directive = Directive(INSERT_SYMBOL, (reference[self.target_pos],))
+        return label.extend((directive,))
 
     def __repr__(self):
         return f"Insert {self.target_pos} at position {self.origin_pos}"
@@ -357,22 +1102,247 @@ class DeleteOperation(Operation):
         origin, index = self.next_original_element(origin)
         origin[index] = None
 
-    def annotate(self, annotation, origin, reference):
+    def annotate_label(self, label, origin, reference):
+        # The element is gone, so only the directives are left of its label
+        directive = Directive(DELETE_SYMBOL, (origin[self.origin_pos],))
+        return AnnotatedLabel('', (directive,) + label.directives)
+
+    def __repr__(self):
+        return f"Delete at position {self.origin_pos}"
+
+
+class Directive(namedtuple('Directive', ['symbol', 'args'])):
+    """
+    An instruction for how an element of an annotation was changed by an
+    operation, such as Directive(REPLACE_SYMBOL, ('a', 'b'))
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return f"+{self.symbol}({','.join(self.args)})"
+
+
+class AnnotatedLabel(namedtuple('AnnotatedLabel', ['base', 'directives'])):
+    """
+    A label from an annotation, along with the directives for any operations
+    that changed the element it belongs to
+
+    Converting it to a str gives the form used by older versions of annotate,
+    e.g. 'a+R(a,b)+I(c)'.
+    """
+    __slots__ = ()
+
+    def __new__(cls, base, directives=()):
+        return super().__new__(cls, base, tuple(directives))
+
+    @staticmethod
+    def parse(label):
         """
-        Marks *annotation* as being modified by this operation
+        Reads a label back from its str form
 
-        :param annotation: The annotation to mark
-        :type annotation: list of str
-        :param origin: The original iterable
-        :type origin: list or str
-        :param reference: The reference that this operation should modify
-                          toward
-        :type reference: list or str
+        :param label: The label to read
+        :type label: str
+        :rtype: AnnotatedLabel
+        """
+        base, _, tags = label.partition('+')
+        directives = [Directive(symbol, tuple(args.split(',')))
+                      for symbol, args
+                      in re.findall(r'(\w+)\((.*?)\)', tags)]
+        return AnnotatedLabel(base, directives)
+
+    def extend(self, directives):
+        """
+        Gives back a copy of this label with more directives on the end
+
+        :param directives: The directives to add
+        :type directives: iterable of Directive
+        :rtype: AnnotatedLabel
+        """
+        return AnnotatedLabel(self.base, self.directives + tuple(directives))
+
+    def is_deleted(self):
         """
-        origin_str = origin[self.origin_pos]
-        match = re.search(r'\+.*$', annotation[self.origin_pos])
-        tags = match[0] if match else ''
-        annotation[self.origin_pos] = f"+{DELETE_SYMBOL}({origin_str}){tags}"
+        Whether the element this label belongs to was deleted
+
+        :rtype: bool
+        """
+        return not self.base and bool(self.directives)
+
+    def num_directives(self, symbol):
+        """
+        Counts the directives of one kind
+
+        :param symbol: The symbol of the directives to count, e.g.
+                       INSERT_SYMBOL
+        :type symbol: str
+        :rtype: int
+        """
+        return sum(directive.symbol == symbol
+                   for directive in self.directives)
+
+    def __str__(self):
+        return self.base + ''.join(str(directive)
+                                   for directive in self.directives)
+
+
+class EditScript:
+    """
+    A compact sequence of operations
+
+    Each operation is stored as three integers in a flat array: a code for
+    its type, its origin position, and its target position (-1 if it has
+    none). Iterating over the script gives the equivalent Operation objects,
+    so it can be used anywhere a list of operations can.
+    """
+    REPLACE = 0
+    INSERT = 1
+    DELETE = 2
+    CODES = {'REPLACE': REPLACE, 'INSERT': INSERT, 'DELETE': DELETE}
+
+    def __init__(self, codes=None):
+        """
+        Initializes the script
+
+        :param codes: The flattened (code, origin_pos, target_pos) triples of
+                      the operations
+        :type codes: array of int
+        """
+        self.codes = codes if codes is not None else array('i')
+
+    @staticmethod
+    def from_operations(ops):
+        """
+        Packs a list of operations into a script
+
+        :param ops: The operations to pack
+        :type ops: list of Operation
+        :rtype: EditScript
+        """
+        script = EditScript()
+        for oper in ops:
+            script.append(oper)
+        return script
+
+    def append(self, oper):
+        """
+        Adds an operation to the end of the script
+
+        :param oper: The operation to add
+        :type oper: Operation
+        """
+        code = EditScript.CODES[oper.type]
+        target_pos = -1 if oper.target_pos is None else oper.target_pos
+        self.codes.extend((code, oper.origin_pos, target_pos))
+
+    def as_array(self):
+        """
+        Returns the operations as a matrix, with a row for each operation and
+        columns for the code, origin position, and target position
+
+        :rtype: np.array
+        """
+        return np.frombuffer(self.codes, dtype=np.intc).reshape(-1, 3)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('EditScript index out of range')
+
+        code, origin_pos, target_pos = self.codes[3*index:3*index+3]
+        if code == EditScript.REPLACE:
+            return ReplaceOperation(origin_pos, target_pos)
+        if code == EditScript.INSERT:
+            return InsertOperation(origin_pos, target_pos)
+        return DeleteOperation(origin_pos)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __len__(self):
+        return len(self.codes) // 3
+
+    def __eq__(self, other):
+        if isinstance(other, EditScript):
+            return self.codes == other.codes
+        if not isinstance(other, Sequence):
+            return NotImplemented
+        return list(self) == list(other)
 
     def __repr__(self):
-        return f"Delete at position {self.origin_pos}"
+        return f"EditScript({list(self)})"
+
+
+class AlignmentCache:
+    """
+    Remembers the operations found between pairs of iterables, so that each
+    unique pair only has to be aligned once
+
+    The cache lives in memory, and can be saved to disk to be reused across
+    runs.
+    """
+    def __init__(self, alignments=None):
+        """
+        Initializes the cache
+
+        :param alignments: Previously cached operations, keyed on the origin
+                           and target as tuples
+        :type alignments: dict of (tuple, tuple) => EditScript
+        """
+        self.alignments = alignments or {}
+
+    def operations(self, origin, target):
+        """
+        Finds the operations needed to get from *origin* to *target*, reusing
+        a previous result if the pair has been seen before
+
+        :param origin: The iterable to start from
+        :type origin: str or list of str
+        :param target: The iterable to end at
+        :type target: str or list of str
+        :return: The operations used to get from the origin to the target
+        :rtype: EditScript
+        """
+        key = (tuple(origin), tuple(target))
+        try:
+            return self.alignments[key]
+        except KeyError:
+            ops = edit_script(origin, target)
+            self.alignments[key] = ops
+            return ops
+
+    def operations_many(self, pairs):
+        """
+        Finds the operations for many origin/target pairs, aligning any pairs
+        that have not been seen before together in one batch
+
+        :param pairs: Origin/target pairs
+        :type pairs: list of (str, str) or list of (list of str, list of str)
+        :return: The operations used to get from each origin to its target
+        :rtype: list of EditScript
+        """
+        keys = [(tuple(origin), tuple(target)) for origin, target in pairs]
+        missing = list(dict.fromkeys(key for key in keys
+                                     if key not in self.alignments))
+        self.alignments.update(zip(missing, operations_many(missing)))
+        return [self.alignments[key] for key in keys]
+
+    def save(self, path):
+        """
+        Saves the cache to the specified path
+        """
+        with open(path, 'wb') as cache_file:
+            pickle.dump(self.alignments, cache_file)
+
+    @staticmethod
+    def load(path):
+        """
+        Loads a saved cache from a specified path
+        """
+        with open(path, 'rb') as cache_file:
+            alignments = pickle.load(cache_file)
+        return AlignmentCache(alignments)
+
+    def __len__(self):
+        return len(self.alignments)
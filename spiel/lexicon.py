@@ -0,0 +1,344 @@
+"""
+spiel.lexicon
+
+Indexes for finding the words in a lexicon that are close to a given word,
+as measured by Levenshtein distance
+"""
+import heapq
+import pickle
+
+from spiel import levenshtein
+
+
+class BKTree:
+    """
+    A metric tree over the Levenshtein distance between tokenized words
+    (Burkhard and Keller, 1973)
+
+    Each node holds a word, and each of its children is filed under its
+    distance from that word. Because the distance obeys the triangle
+    inequality, a search only has to visit the children whose distance is
+    within the search radius of the distance to the query.
+    """
+    def __init__(self, tokenize=None):
+        """
+        Initializes an empty tree
+
+        :param tokenize: A function to tokenize incoming strings. Defaults to
+                         list()
+        :type tokenize: callable
+        """
+        self.tokenize = tokenize or list
+        self.words = []
+        self.values = []
+        self.children = []
+
+    @staticmethod
+    def build(words, tokenize=None):
+        """
+        Builds a tree from a list of words
+
+        :param words: The words to index
+        :type words: list of str or list of list of str
+        :param tokenize: A function to tokenize incoming strings
+        :type tokenize: callable
+        :rtype: BKTree
+        """
+        tree = BKTree(tokenize=tokenize)
+        for word in words:
+            tree.add(word)
+        return tree
+
+    @staticmethod
+    def from_instances(instances, tokenize=None):
+        """
+        Builds a tree from the shapes of a list of instances, with the
+        instances themselves as the values that are looked up
+
+        :param instances: The instances to index
+        :type instances: list of spiel.data.Instance
+        :param tokenize: A function to tokenize the shapes
+        :type tokenize: callable
+        :rtype: BKTree
+        """
+        tree = BKTree(tokenize=tokenize)
+        for instance in instances:
+            tree.add(instance.shape, instance)
+        return tree
+
+    def add(self, word, value=None):
+        """
+        Adds a word to the tree
+
+        :param word: The word to add
+        :type word: str or list of str
+        :param value: What to give back when the word is found. Defaults to
+                      the word itself. If the word is already in the tree,
+                      the value is added alongside the existing ones.
+        """
+        value = word if value is None else value
+        tokens = self.__prepare(word)
+
+        if not self.words:
+            self.__add_node(tokens, value)
+            return
+
+        node = 0
+        while True:
+            distance = levenshtein.distance(tokens, self.words[node])
+            if distance == 0:
+                self.values[node].append(value)
+                return
+
+            child = self.children[node].get(distance)
+            if child is None:
+                self.children[node][distance] = self.__add_node(tokens, value)
+                return
+            node = child
+
+    def query(self, word, max_distance):
+        """
+        Finds every value whose word is within *max_distance* edits of
+        *word*
+
+        :param word: The word to search for
+        :type word: str or list of str
+        :param max_distance: The largest distance to include
+        :type max_distance: int
+        :return: Distance/value pairs, closest first; ties are in the order
+                 their words were added
+        :rtype: list of (int, any)
+        """
+        tokens = self.__prepare(word)
+        matches = []
+        nodes = [0] if self.words else []
+
+        while nodes:
+            node = nodes.pop()
+            distance = levenshtein.distance(tokens, self.words[node])
+            if distance <= max_distance:
+                matches.append((distance, node))
+
+            for edge, child in self.children[node].items():
+                if abs(edge - distance) <= max_distance:
+                    nodes.append(child)
+
+        return [(distance, value)
+                for distance, node in sorted(matches)
+                for value in self.values[node]]
+
+    def nearest(self, word, k=1):
+        """
+        Finds the *k* words closest to *word*
+
+        :param word: The word to search for
+        :type word: str or list of str
+        :param k: The number of words to find
+        :type k: int
+        :return: Distance/value pairs, closest first. Every value of each of
+                 the k closest words is included.
+        :rtype: list of (int, any)
+        """
+        tokens = self.__prepare(word)
+        # A max-heap (by negated distance) of the k closest nodes so far
+        best = []
+        # Nodes still to visit, by the least distance they could be from
+        # *word*, so that the search radius shrinks as quickly as possible
+        nodes = [(0, 0)] if self.words and k > 0 else []
+
+        while nodes:
+            bound, node = heapq.heappop(nodes)
+            if len(best) == k and bound > -best[0][0]:
+                break
+
+            distance = levenshtein.distance(tokens, self.words[node])
+            if len(best) < k:
+                heapq.heappush(best, (-distance, -node))
+            elif distance < -best[0][0]:
+                heapq.heapreplace(best, (-distance, -node))
+
+            for edge, child in self.children[node].items():
+                heapq.heappush(nodes, (abs(edge - distance), child))
+
+        return [(distance, value)
+                for distance, node in sorted((-d, -n) for d, n in best)
+                for value in self.values[node]]
+
+    def save(self, path):
+        """
+        Saves the tree to the specified path
+        """
+        with open(path, 'wb') as tree_file:
+            pickle.dump(self, tree_file)
+
+    @staticmethod
+    def load(path):
+        """
+        Loads a saved tree from a specified path
+        """
+        with open(path, 'rb') as tree_file:
+            return pickle.load(tree_file)
+
+    def __add_node(self, tokens, value):
+        self.words.append(tokens)
+        self.values.append([value])
+        self.children.append({})
+        return len(self.words) - 1
+
+    def __prepare(self, word):
+        if isinstance(word, str):
+            word = self.tokenize(word)
+        return tuple(word)
+
+    def __len__(self):
+        return len(self.words)
+
+    def __contains__(self, word):
+        return bool(self.query(word, 0))
+
+
+class Trie:
+    """
+    A trie of tokenized words that can be searched for every word within a
+    number of edits of a query
+
+    The search walks the trie depth first, computing one row of the
+    Levenshtein matrix per node. Words that share a prefix share the rows for
+    it, and a branch is abandoned as soon as every cell in its row is too far
+    away, so the cost depends on how much of the trie is near the query
+    rather than on the number of words in it.
+    """
+    def __init__(self, tokenize=None):
+        """
+        Initializes an empty trie
+
+        :param tokenize: A function to tokenize incoming strings. Defaults to
+                         list(), like spiel.segmentation.Featurizer
+        :type tokenize: callable
+        """
+        self.tokenize = tokenize or list
+        self.children = [{}]
+        self.values = [None]
+        self.num_words = 0
+
+    @staticmethod
+    def build(words, tokenize=None):
+        """
+        Builds a trie from a list of words
+
+        :param words: The words to index
+        :type words: list of str or list of list of str
+        :param tokenize: A function to tokenize incoming strings
+        :type tokenize: callable
+        :rtype: Trie
+        """
+        trie = Trie(tokenize=tokenize)
+        for word in words:
+            trie.add(word)
+        return trie
+
+    @staticmethod
+    def from_instances(instances, tokenize=None, segments=False):
+        """
+        Builds a trie from the shapes of a list of instances, with the
+        instances themselves as the values that are looked up
+
+        :param instances: The instances to index
+        :type instances: list of spiel.data.Instance
+        :param tokenize: A function to tokenize the shapes
+        :type tokenize: callable
+        :param segments: Whether to also index the segments of each instance,
+                         with their segment/label pairs as values
+        :type segments: bool
+        :rtype: Trie
+        """
+        trie = Trie(tokenize=tokenize)
+        for instance in instances:
+            trie.add(instance.shape, instance)
+            if segments and instance.segments:
+                for annotation in instance.annotations:
+                    trie.add(annotation[0], annotation)
+        return trie
+
+    def add(self, word, value=None):
+        """
+        Adds a word to the trie
+
+        :param word: The word to add
+        :type word: str or list of str
+        :param value: What to give back when the word is found. Defaults to
+                      the word itself. If the word is already in the trie,
+                      the value is added alongside the existing ones.
+        """
+        value = word if value is None else value
+        if isinstance(word, str):
+            word = self.tokenize(word)
+
+        node = 0
+        for token in word:
+            child = self.children[node].get(token)
+            if child is None:
+                child = len(self.children)
+                self.children[node][token] = child
+                self.children.append({})
+                self.values.append(None)
+            node = child
+
+        if self.values[node] is None:
+            self.values[node] = []
+        self.values[node].append((self.num_words, value))
+        self.num_words += 1
+
+    def search(self, word, max_distance):
+        """
+        Finds every value whose word is within *max_distance* edits of
+        *word*
+
+        :param word: The word to search for
+        :type word: str or list of str
+        :param max_distance: The largest distance to include
+        :type max_distance: int
+        :return: Distance/value pairs, closest first; ties are in the order
+                 they were added
+        :rtype: list of (int, any)
+        """
+        if isinstance(word, str):
+            word = self.tokenize(word)
+
+        matches = []
+        first_row = list(range(len(word) + 1))
+        self.__collect(0, first_row, max_distance, matches)
+
+        nodes = [(child, token, first_row)
+                 for token, child in self.children[0].items()]
+
+        while nodes:
+            node, token, prev_row = nodes.pop()
+
+            row = [prev_row[0] + 1]
+            for j, query_token in enumerate(word, 1):
+                row.append(min(row[j-1] + 1,
+                               prev_row[j] + 1,
+                               prev_row[j-1] + (token != query_token)))
+
+            self.__collect(node, row, max_distance, matches)
+
+            # Every word further down starts from this row, so if none of it
+            # is close enough, neither are they
+            if min(row) <= max_distance:
+                nodes.extend((child, child_token, row) for child_token, child
+                             in self.children[node].items())
+
+        return [(distance, value)
+                for distance, _, value in sorted(matches, key=lambda x: x[:2])]
+
+    def __collect(self, node, row, max_distance, matches):
+        if self.values[node] is not None and row[-1] <= max_distance:
+            matches.extend((row[-1], order, value)
+                           for order, value in self.values[node])
+
+    def __len__(self):
+        return self.num_words
+
+    def __contains__(self, word):
+        return bool(self.search(word, 0))
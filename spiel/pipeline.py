@@ -0,0 +1,304 @@
+"""
+spiel.pipeline
+
+A trained segmenter and labeller, run one after the other
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import copy
+from datetime import datetime, timezone
+from itertools import islice
+import json
+import os
+import pickle
+import platform
+
+import sklearn
+
+from spiel import __version__
+from spiel.levenshtein import AlignmentCache
+from spiel.segmentation import ConstraintSegmenter, Featurizer
+from spiel.util import num_workers
+from spiel.vocab import Tokenizer
+
+# The number of shapes that Pipeline.stream() annotates at a time
+DEFAULT_BATCH_SIZE = 64
+
+# The version of the model directory layout written by Pipeline.save_model()
+MODEL_FORMAT_VERSION = 1
+
+# The files in a model directory
+METADATA_FILE = 'metadata.json'
+SEGMENTER_FILE = 'segmenter.pkl'
+LABELLER_FILE = 'labeller.pkl'
+
+# The settings of a segmentation Featurizer that are kept in a model's
+# metadata, and used to build it again when the model is loaded
+FEATURIZER_SETTINGS = ('mode', 'inside_label', 'pad_token', 'sparse',
+                       'unknown_features')
+
+# The number of batches segment_parallel() keeps queued for each worker, so
+# that none of them sits idle waiting for the next one
+BATCHES_PER_WORKER = 2
+
+# The pipeline that each segment_parallel() worker process annotates with
+__worker_pipeline = None
+
+
+class ModelError(ValueError):
+    """ Raised by model directories that cannot be saved or loaded """
+
+
+class Pipeline:
+    """
+    Segments shapes into morphemes with a ConstraintSegmenter, and then
+    labels the morphemes with a SequenceLabeller
+    """
+    def __init__(self, segmenter, labeller):
+        """
+        Initializes the pipeline
+
+        :param segmenter: A trained segmenter
+        :type segmenter: spiel.segmentation.ConstraintSegmenter
+        :param labeller: A trained labeller
+        :type labeller: spiel.sequence_labelling.SequenceLabeller
+        """
+        self.segmenter = segmenter
+        self.labeller = labeller
+        self.metadata = None
+
+    def annotate(self, shape):
+        """
+        Segments and labels a shape
+
+        :param shape: The shape to annotate
+        :type shape: str or list of str or np.array
+        :return: A list of morpheme/label pairs
+        :rtype: list of (str, str)
+        """
+        return self.annotate_many([shape])[0]
+
+    def annotate_many(self, shapes):
+        """
+        Segments and labels several shapes, labelling all of their segments
+        at once; see annotate()
+
+        :param shapes: The shapes to annotate
+        :type shapes: list of str or list of list of str
+        :rtype: list of list of (str, str)
+        """
+        all_segments = [self.segmenter.segment(shape) if len(shape) else []
+                        for shape in shapes]
+        all_labels = self.labeller.label_many(all_segments)
+        return [list(zip(segments, labels))
+                for segments, labels in zip(all_segments, all_labels)]
+
+    def stream(self, shapes, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Annotates shapes as they arrive, a batch at a time
+
+        Only one batch is held in memory at once, so the shapes can come from
+        a stream of any length.
+
+        :param shapes: The shapes to annotate
+        :type shapes: iterable of str
+        :param batch_size: The number of shapes to annotate at a time
+        :type batch_size: int
+        :return: Each shape with its annotations, in order
+        :rtype: generator of (str, list of (str, str))
+        """
+        shapes = iter(shapes)
+        batch = list(islice(shapes, batch_size))
+        while batch:
+            yield from zip(batch, self.annotate_many(batch))
+            batch = list(islice(shapes, batch_size))
+
+    def without_alignment_cache(self):
+        """
+        Gives back a copy of the pipeline whose featurizer has an empty
+        alignment cache
+
+        The cache is only used in training, so the copy annotates just the
+        same, and is much smaller to send to other processes.
+
+        :rtype: Pipeline
+        """
+        featurizer = getattr(self.segmenter, 'featurizer', None)
+        if featurizer is None or not len(featurizer.alignment_cache):
+            return self
+
+        featurizer = copy.copy(featurizer)
+        featurizer.alignment_cache = AlignmentCache()
+        segmenter = copy.copy(self.segmenter)
+        segmenter.featurizer = featurizer
+
+        pipeline = Pipeline(segmenter, self.labeller)
+        pipeline.metadata = self.metadata
+        return pipeline
+
+    def save(self, path):
+        """
+        Saves the pipeline to the specified path, without its featurizer's
+        alignment cache
+        """
+        with open(path, 'wb') as pipeline_file:
+            pickle.dump(self.without_alignment_cache(), pipeline_file)
+
+    @staticmethod
+    def load(path):
+        """
+        Loads a saved pipeline from a specified path, which may be a model
+        directory written by save_model()
+        """
+        if os.path.isdir(path):
+            return Pipeline.load_model(path)
+        with open(path, 'rb') as pipeline_file:
+            return pickle.load(pipeline_file)
+
+    def save_model(self, directory):
+        """
+        Saves the pipeline to a model directory, which holds:
+
+        - metadata.json: the versions it was saved with, and the settings of
+          the segmentation featurizer
+        - segmenter.pkl: the segmenter's classifier and feature vocabulary
+        - labeller.pkl: the labeller
+
+        The featurizer's alignment cache is only used in training, so it is
+        left out.
+
+        :param directory: The directory to save to; it is created if it does
+                          not exist
+        :type directory: str or os.PathLike
+        """
+        featurizer = self.segmenter.featurizer
+        tokenize = featurizer.tokenize
+        if not (tokenize is list or isinstance(tokenize, Tokenizer)):
+            raise ModelError("Only a Tokenizer can be saved with a model.")
+
+        settings = {setting: getattr(featurizer, setting)
+                    for setting in FEATURIZER_SETTINGS}
+        settings['token_pattern'] = getattr(tokenize, 'pattern', None)
+
+        metadata = {
+            'format_version': MODEL_FORMAT_VERSION,
+            'spiel_version': __version__,
+            'python_version': platform.python_version(),
+            'sklearn_version': sklearn.__version__,
+            'created': datetime.now(timezone.utc).isoformat(),
+            'featurizer': settings
+        }
+
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, SEGMENTER_FILE), 'wb') as model:
+            pickle.dump({'classifier_type': self.segmenter.classifier_type,
+                         'classifier': self.segmenter.classifier,
+                         'vocabulary': featurizer.vocabulary}, model)
+        with open(os.path.join(directory, LABELLER_FILE), 'wb') as model:
+            pickle.dump(self.labeller, model)
+        # The metadata goes last, so that a directory with metadata is whole
+        with open(os.path.join(directory, METADATA_FILE), 'w') as model:
+            json.dump(metadata, model, indent=2)
+
+    @staticmethod
+    def load_model(directory):
+        """
+        Loads a pipeline from a model directory written by save_model()
+
+        :param directory: The directory to load from
+        :type directory: str or os.PathLike
+        :rtype: Pipeline
+        """
+        try:
+            with open(os.path.join(directory, METADATA_FILE)) as model:
+                metadata = json.load(model)
+        except (OSError, ValueError) as error:
+            raise ModelError(f"{os.fspath(directory)} is not a model \
+directory: {error}") from error
+
+        if metadata.get('format_version', 0) > MODEL_FORMAT_VERSION:
+            raise ModelError(f"{os.fspath(directory)} was saved by a newer \
+version of spiel ({metadata.get('spiel_version')}).")
+
+        settings = dict(metadata['featurizer'])
+        tokenize = Tokenizer(settings.pop('token_pattern'))
+        featurizer = Featurizer(tokenize=tokenize, **settings)
+
+        with open(os.path.join(directory, SEGMENTER_FILE), 'rb') as model:
+            state = pickle.load(model)
+        featurizer.vocabulary = state['vocabulary']
+        segmenter = ConstraintSegmenter(state['classifier_type'], featurizer)
+        segmenter.classifier = state['classifier']
+
+        with open(os.path.join(directory, LABELLER_FILE), 'rb') as model:
+            labeller = pickle.load(model)
+
+        pipeline = Pipeline(segmenter, labeller)
+        pipeline.metadata = metadata
+        return pipeline
+
+
+def segment_parallel(pipeline, shapes, n_jobs=-1,
+                     batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Annotates shapes in a pool of processes; see Pipeline.stream()
+
+    The pipeline is given to each worker once, when it starts, rather than
+    with every batch: it is inherited where processes are forked, and
+    otherwise sent once to each worker, without its alignment cache. If it
+    is a path instead, each worker loads it from there. Only a few batches
+    per worker are read ahead of the results, so the shapes can come from a
+    stream of any length.
+
+    :param pipeline: The pipeline to annotate with, or a file it was saved to
+    :type pipeline: Pipeline or str or os.PathLike
+    :param shapes: The shapes to annotate
+    :type shapes: iterable of str
+    :param n_jobs: The number of processes to use; -1 uses every available
+                   CPU
+    :type n_jobs: int
+    :param batch_size: The number of shapes to send to a worker at a time
+    :type batch_size: int
+    :return: Each shape with its annotations, in the order of the input
+    :rtype: generator of (str, list of (str, str))
+    """
+    workers = num_workers(n_jobs)
+    shapes = iter(shapes)
+    pending = deque()
+    if isinstance(pipeline, Pipeline):
+        pipeline = pipeline.without_alignment_cache()
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=__init_worker,
+                             initargs=(pipeline,)) as pool:
+        while True:
+            while len(pending) < workers * BATCHES_PER_WORKER:
+                batch = list(islice(shapes, batch_size))
+                if not batch:
+                    break
+                pending.append((batch, pool.submit(__annotate_batch, batch)))
+
+            if not pending:
+                return
+
+            batch, future = pending.popleft()
+            yield from zip(batch, future.result())
+
+
+def __init_worker(pipeline):
+    """
+    Sets the pipeline that a worker process annotates with
+    """
+    global __worker_pipeline
+    if isinstance(pipeline, (str, os.PathLike)):
+        pipeline = Pipeline.load(pipeline)
+    __worker_pipeline = pipeline
+
+
+def __annotate_batch(shapes):
+    """
+    Annotates a batch of shapes in a worker process
+
+    :rtype: list of list of (str, str)
+    """
+    return __worker_pipeline.annotate_many(shapes)
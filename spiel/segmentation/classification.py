@@ -37,6 +37,54 @@ class ClassifierAdaptor(metaclass=ABCMeta):
         :return: An instance of this class
         """
 
+    def prob_classify_matrix(self, matrix):
+        """
+        Gives back the labels and their probabilities for each row of a
+        feature matrix, for use with a sparse Featurizer
+
+        By default, each row is given to prob_classify() as a dict of its
+        features, keyed by column.
+
+        :param matrix: The features to classify, one instance per row
+        :type matrix: scipy.sparse.csr_matrix
+        :return: The available labels and their corresponding probabilities,
+                 for each row
+        :rtype: list of list of (str, float)
+        """
+        return [self.prob_classify(features)
+                for features in ClassifierAdaptor.__row_features(matrix)]
+
+    @classmethod
+    def train_matrix(cls, matrix, labels):
+        """
+        Initializes a new instance of the classifier from a feature matrix,
+        for use with a sparse Featurizer
+
+        By default, each row is given to train() as a dict of its features,
+        keyed by column.
+
+        :param matrix: The features to train on, one instance per row
+        :type matrix: scipy.sparse.csr_matrix
+        :param labels: The label of each row
+        :type labels: list of str
+        :return: An instance of this class
+        """
+        return cls.train(list(zip(ClassifierAdaptor.__row_features(matrix),
+                                  labels)))
+
+    @staticmethod
+    def __row_features(matrix):
+        # Only the stored entries of each row are read, so the matrix is
+        # never made dense
+        matrix = matrix.tocsr()
+        indptr, indices, data = matrix.indptr, matrix.indices, matrix.data
+        return [{str(column): value
+                 for column, value in zip(indices[start:end].tolist(),
+                                          data[start:end].tolist())
+                 if value}
+                for start, end in zip(indptr[:-1].tolist(),
+                                      indptr[1:].tolist())]
+
 
 class SKLearnNaiveBayesClassifier(ClassifierAdaptor):
     """
@@ -51,6 +99,13 @@ class SKLearnNaiveBayesClassifier(ClassifierAdaptor):
         labels = self.pipeline.classes_
         return list(zip(labels, probabilities))
 
+    def prob_classify_matrix(self, matrix):
+        if matrix.shape[0] == 0:
+            return []
+        probabilities = self.pipeline.predict_proba(matrix)
+        labels = self.pipeline.classes_
+        return [list(zip(labels, row)) for row in probabilities]
+
     @staticmethod
     def train(data):
         pipeline = Pipeline([
@@ -59,3 +114,13 @@ class SKLearnNaiveBayesClassifier(ClassifierAdaptor):
         ])
         pipeline.fit(*zip(*data))
         return SKLearnNaiveBayesClassifier(pipeline)
+
+    @classmethod
+    def train_matrix(cls, matrix, labels):
+        # The columns already come from a FeatureVocabulary, so there is
+        # nothing to vectorize
+        pipeline = Pipeline([
+            ('clf', MultinomialNB())
+        ])
+        pipeline.fit(matrix, labels)
+        return SKLearnNaiveBayesClassifier(pipeline)
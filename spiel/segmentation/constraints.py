@@ -6,9 +6,11 @@ van den Bosch and Canisius (2006). (http://aclweb.org/anthology/W06-3206)
 """
 import re
 from collections import defaultdict
-from spiel.segmentation.features import Featurizer
+from spiel.data import Corpus
+from spiel.segmentation.features import Featurizer, FeaturizationException
 from spiel.segmentation.classification import SKLearnNaiveBayesClassifier
 from spiel.util import all_permutations
+from spiel.vocab import is_encoded
 
 
 class SegmentationException(Exception):
@@ -82,44 +84,54 @@ class ConstraintSegmenter:
         self.featurizer = featurizer or Featurizer()
         self.classifier = None
 
-    def train(self, shapes, annotations):
+    def train(self, shapes, annotations=None):
         """
         Trains the underlying classifier
 
-        :param shapes: The observable strings to train on
-        :type shapes: list of str or list of list of str
-        :param annotations: Annotations for each shape
+        :param shapes: The observable strings to train on, or a corpus to
+                       train on the annotated instances of
+        :type shapes: list of str or list of list of str or spiel.data.Corpus
+        :param annotations: Annotations for each shape; not needed for a
+                            corpus
         :type annotations: list of list of str
         """
+        if isinstance(shapes, Corpus):
+            self.__train_corpus(shapes)
+            return
+        if annotations is None:
+            raise SegmentationException("Annotations are required unless \
+training on a corpus")
+
         if not len(shapes) == len(annotations):
             raise SegmentationException(f"There are {len(shapes)} shapes but \
 {len(annotations)} annotations.")
-        instances = []
-        for shape, annotation in zip(shapes, annotations):
-            labels = self.featurizer.label(shape, annotation)
-            instances += self.featurizer.convert_pairs(shape, labels)
-        self.classifier = self.classifier_type.train(instances)
+        all_labels = self.featurizer.label_many(shapes, annotations)
+        self.__fit(shapes, all_labels)
 
     def annotate(self, sequence):
         """
         Generates an annotated version of a sequence
 
         :param sequence: The sequence to segment
-        :type sequence: list or str
+        :type sequence: list or str or np.array
         :return: A list of morpheme/label pairs
         :rtype: list of (str, str)
         """
         if self.classifier is None:
             raise SegmentationException("The segmenter has not been trained")
 
-        if isinstance(sequence, str):
-            sequence = self.featurizer.tokenize(sequence)
-
         constraints = {}
-        features = self.featurizer.convert_features(sequence)
+        if self.featurizer.sparse:
+            matrix = self.featurizer.convert_matrix([sequence])
+            distributions = self.classifier.prob_classify_matrix(matrix)
+            sequence = self.featurizer.tokens(sequence)
+        else:
+            sequence = self.featurizer.tokens(sequence)
+            distributions = [self.classifier.prob_classify(feature)
+                             for feature
+                             in self.featurizer.convert_features(sequence)]
 
-        for i, feature in enumerate(features):
-            distribution = self.classifier.prob_classify(feature)
+        for i, distribution in enumerate(distributions):
             constraints.update(generate_constraints(distribution, i+2))
 
         options = generate_options(sequence, constraints)
@@ -133,7 +145,7 @@ class ConstraintSegmenter:
         Segments a sequence into morphemes
 
         :param sequence: The sequence to segment
-        :type sequence: list or str
+        :type sequence: list or str or np.array
         :return: A list of morpheme/label pairs
         :rtype: list of (str, str)
         """
@@ -144,12 +156,56 @@ class ConstraintSegmenter:
         Generates the labels for a sequence
 
         :param sequence: The sequence to segment
-        :type sequence: list or str
+        :type sequence: list or str or np.array
         :return: A list of morpheme/label pairs
         :rtype: list of (str, str)
         """
         return [label for _, label in self.annotate(sequence)]
 
+    def __train_corpus(self, corpus):
+        indices = corpus.annotated_indices()
+        token_spans = list(zip(corpus.token_offsets[indices],
+                               corpus.token_offsets[indices+1]))
+        segment_spans = list(zip(corpus.segment_offsets[indices],
+                                 corpus.segment_offsets[indices+1]))
+
+        # Alignments are cached by their strings, so the flat arrays are
+        # decoded once, end to end, and sliced for them
+        tokens = corpus.token_table.decode(corpus.token_ids)
+        segments = corpus.segment_table.decode(corpus.segment_ids)
+        labels = corpus.label_table.decode(corpus.label_ids)
+        shapes = [tokens[start:end] for start, end in token_spans]
+        all_labels = self.featurizer.label_many(
+            shapes, [list(zip(segments[start:end], labels[start:end]))
+                     for start, end in segment_spans])
+
+        if self.featurizer.sparse:
+            # The features are taken from the token ids themselves
+            shapes = [corpus.token_ids[start:end]
+                      for start, end in token_spans]
+        self.__fit(shapes, all_labels, corpus.token_table)
+
+    def __fit(self, shapes, all_labels, token_vocabulary=None):
+        if self.featurizer.sparse:
+            shapes = [shape if is_encoded(shape)
+                      else self.featurizer.tokens(shape) for shape in shapes]
+            for shape, labels in zip(shapes, all_labels):
+                if not len(shape) == len(labels):
+                    raise FeaturizationException(f"{len(shape)} tokens in \
+*shape*, but {len(labels)} labels provided")
+            self.featurizer.fit_vocabulary(shapes, token_vocabulary)
+            matrix = self.featurizer.convert_matrix(shapes, token_vocabulary)
+            trigrams = [trigram for labels in all_labels
+                        for trigram in self.featurizer.convert_labels(labels)]
+            self.classifier = self.classifier_type.train_matrix(matrix,
+                                                                trigrams)
+            return
+
+        instances = []
+        for shape, labels in zip(shapes, all_labels):
+            instances += self.featurizer.convert_pairs(shape, labels)
+        self.classifier = self.classifier_type.train(instances)
+
     def __merge_labels(self, sequence, labels):
         segments = []
         curr_segment = ''
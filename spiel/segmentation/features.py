@@ -3,22 +3,30 @@ spiel.segmentation.features
 
 Handles featurization of strings for segmenters
 """
-import re
+import numpy as np
+from scipy.sparse import csr_matrix
 from spiel import levenshtein
-from spiel.levenshtein import INSERT_SYMBOL
+from spiel.levenshtein import INSERT_SYMBOL, AlignmentCache, AnnotatedLabel
 from spiel.util import pad
+from spiel.vocab import is_encoded
 
 
 class FeaturizationException(Exception):
     """Raises for an error in segmentation"""
 
 
+# The number of tokens on either side of the focus that make up the prefix
+# and suffix features
+WINDOW_SIZE = 3
+
+
 class Featurizer:
     """
     Used to convert basic instances into training instances for a classifier
     """
     def __init__(self, mode='normal', inside_label='I', pad_token='_',
-                 tokenize=None):
+                 tokenize=None, alignment_cache=None, sparse=False,
+                 unknown_features='ignore'):
         """
         Initializes the featurizer
 
@@ -30,14 +38,51 @@ class Featurizer:
         :type inside_label: str
         :param pad_token: The token to pad strings with; default '_'
         :type pade_token: str
-        :param tokenize: A function to tokenize incoming strings. Defaults to
-                         list()
+        :param tokenize: A function to tokenize incoming strings, such as a
+                         spiel.vocab.Tokenizer. Defaults to list()
         :type tokenize: callable
+        :param alignment_cache: A cache of alignments between annotations and
+                                shapes to share. Defaults to a new, empty
+                                cache.
+        :type alignment_cache: spiel.levenshtein.AlignmentCache
+        :param sparse: Whether segmenters should featurize shapes with
+                       convert_matrix() rather than convert_features()
+        :type sparse: bool
+        :param unknown_features: What convert_matrix() should do with
+                                 features that were not seen by
+                                 fit_vocabulary(); either 'ignore' them or
+                                 raise an 'error'
+        :type unknown_features: str
         """
         self.inside_label = inside_label
         self.pad_token = pad_token
         self.tokenize = tokenize or list
         self.mode = mode
+        if alignment_cache is None:
+            alignment_cache = AlignmentCache()
+        self.alignment_cache = alignment_cache
+        self.sparse = sparse
+        self.unknown_features = unknown_features
+        self.vocabulary = None
+
+    def tokens(self, shape):
+        """
+        Gives back the tokens of a shape
+
+        :param shape: The shape to split up; an array of token ids can be
+                      given if the featurizer's tokenize function is a
+                      spiel.vocab.Tokenizer
+        :type shape: str or list of str or np.array
+        :rtype: list of str
+        """
+        if isinstance(shape, str):
+            return self.tokenize(shape)
+        if is_encoded(shape):
+            if not hasattr(self.tokenize, 'decode'):
+                raise FeaturizationException("Decoding token ids requires a \
+spiel.vocab.Tokenizer")
+            return self.tokenize.decode(shape)
+        return shape
 
     def convert_pairs(self, shape, labels):
         """
@@ -52,20 +97,31 @@ class Featurizer:
                  instance
         :rtype: list of (dict, str)
         """
-        if isinstance(shape, str):
-            shape = self.tokenize(shape)
+        shape = self.tokens(shape)
 
         if not len(shape) == len(labels):
             raise FeaturizationException(f"{len(shape)} tokens in *shape*,\
 but {len(labels)} labels provided")
 
         features = self.convert_features(shape)
+        return list(zip(features, self.convert_labels(labels)))
 
-        padded_labels = pad(labels, self.pad_token, 4)
-        instances = ['-'.join(padded_labels[i-1:i+2])
-                     for i in range(3, len(padded_labels) - 3)]
+    def convert_labels(self, labels):
+        """
+        Converts the labels of each token in a shape into the trigram labels
+        of its training instances
 
-        return list(zip(features, instances))
+        :param labels: The labels for each token in a shape
+        :type labels: list
+        :return: A trigram label for each training instance of the shape
+        :rtype: list of str
+        """
+        if not labels:
+            return []
+
+        padded_labels = pad(labels, self.pad_token, 4)
+        return ['-'.join(padded_labels[i-1:i+2])
+                for i in range(3, len(padded_labels) - 3)]
 
     def convert_features(self, shape):
         """
@@ -78,11 +134,10 @@ but {len(labels)} labels provided")
                  instance
         :rtype: list of dict
         """
-        if not shape:
+        if len(shape) == 0:
             return []
 
-        if isinstance(shape, str):
-            shape = self.tokenize(shape)
+        shape = self.tokens(shape)
 
         padded_shape = pad(shape, self.pad_token, 4)
         instances = []
@@ -98,6 +153,50 @@ but {len(labels)} labels provided")
 
         return instances
 
+    def fit_vocabulary(self, shapes, token_vocabulary=None):
+        """
+        Freezes the features of a set of shapes into the vocabulary used by
+        convert_matrix()
+
+        :param shapes: The shapes to take features from; arrays of token ids
+                       are featurized without being decoded
+        :type shapes: list of str or list of list of str or list of np.array
+        :param token_vocabulary: The vocabulary that the arrays of token ids
+                                 were encoded with, if not that of the
+                                 featurizer's Tokenizer
+        :type token_vocabulary: spiel.vocab.Vocabulary
+        :return: The new vocabulary
+        :rtype: FeatureVocabulary
+        """
+        shapes, token_vocabulary = self.__split_shapes(shapes,
+                                                       token_vocabulary)
+        self.vocabulary = FeatureVocabulary.fit(shapes, self.pad_token,
+                                                self.unknown_features,
+                                                token_vocabulary)
+        return self.vocabulary
+
+    def convert_matrix(self, shapes, token_vocabulary=None):
+        """
+        Converts shapes into a sparse matrix of features, where each row
+        holds the same features as the corresponding dict from
+        convert_features()
+
+        :param shapes: The shapes to convert; arrays of token ids are
+                       featurized without being decoded
+        :type shapes: list of str or list of list of str or list of np.array
+        :param token_vocabulary: The vocabulary that the arrays of token ids
+                                 were encoded with; see fit_vocabulary()
+        :type token_vocabulary: spiel.vocab.Vocabulary
+        :return: A matrix with a row for each instance of each shape, in order
+        :rtype: scipy.sparse.csr_matrix
+        """
+        if self.vocabulary is None:
+            raise FeaturizationException("The featurizer has no vocabulary; \
+call fit_vocabulary() first")
+
+        return self.vocabulary.transform(*self.__split_shapes(
+            shapes, token_vocabulary))
+
     def analogize(self, shape, annotations):
         """
         Converts the segments of a set of annotations to match a given shape
@@ -117,9 +216,7 @@ but {len(labels)} labels provided")
                        if not annotation[0] == '∅']
         labels = [label for _, label in annotations]
 
-        # Tokenize the shape if necessary
-        if isinstance(shape, str):
-            shape = self.tokenize(shape)
+        shape = self.tokens(shape)
 
         # Get a map of where the segmentations should occur
         seg_map = self.label(shape, annotations)
@@ -148,32 +245,72 @@ but {len(labels)} labels provided")
         :return: A list of labels
         :rtype: list
         """
-        if isinstance(shape, str):
-            shape = self.tokenize(shape)
+        shape, annotation_string, labels = self.__prepare(shape, annotations)
+        ops = self.alignment_cache.operations(annotation_string, shape)
+        return self.__align_labels(shape, annotation_string, labels, ops)
+
+    def label_many(self, shapes, annotations):
+        """
+        Generates the labels for many shapes at once; see label()
+
+        Any alignments that are not already cached are computed together in
+        a batch, which is much faster than labelling each shape on its own.
+
+        :param shapes: The sequences to annotate
+        :type shapes: list of list or list of str
+        :param annotations: The annotations for each shape
+        :type annotations: list of list of (str, str)
+        :return: A list of labels for each shape
+        :rtype: list of list
+        """
+        prepared = [self.__prepare(shape, shape_annotations)
+                    for shape, shape_annotations in zip(shapes, annotations)]
+        ops = self.alignment_cache.operations_many(
+            [(annotation_string, shape)
+             for shape, annotation_string, _ in prepared])
+        return [self.__align_labels(*args, shape_ops)
+                for args, shape_ops in zip(prepared, ops)]
+
+    def __split_shapes(self, shapes, token_vocabulary=None):
+        # Arrays of token ids are kept as they are, along with the vocabulary
+        # they were encoded with; anything else is tokenized
+        shapes = [shape if is_encoded(shape) else self.tokens(shape)
+                  for shape in shapes]
+        if not any(is_encoded(shape) for shape in shapes):
+            return shapes, None
+        if token_vocabulary is not None:
+            return shapes, token_vocabulary
+        if not hasattr(self.tokenize, 'vocabulary'):
+            raise FeaturizationException("Featurizing token ids requires a \
+spiel.vocab.Tokenizer")
+        return shapes, self.tokenize.vocabulary
+
+    def __prepare(self, shape, annotations):
+        shape = self.tokens(shape)
         annotation_string = self.tokenize(concat_annotations(annotations))
         labels = label_annotations(annotations, self.inside_label,
                                    self.tokenize)
+        return shape, annotation_string, labels
 
-        ops = levenshtein.operations(annotation_string, shape)
-        labels = levenshtein.annotate(annotation_string, shape, ops, labels)
+    def __align_labels(self, shape, annotation_string, labels, ops):
+        labels = levenshtein.annotate(annotation_string, shape, ops, labels,
+                                      structured=True)
+        inside_label = self.__format_label(AnnotatedLabel(self.inside_label))
 
-        for i, label in enumerate(labels):
-            # Perform any insertion directives
-            matches = re.findall(rf'\+{INSERT_SYMBOL}(.*?)', label)
-            for _ in matches:
-                labels.insert(i+1, self.inside_label)
+        aligned = []
+        for label in labels:
+            aligned.append(self.__format_label(label))
+            # Each insertion adds a token that continues the label
+            aligned += [inside_label] * label.num_directives(INSERT_SYMBOL)
 
-        return [self.__format_label(label) for label in labels]
+        return aligned
 
     def __format_label(self, label):
-        if self.mode == 'basic' or self.mode == 'normal':
-            # Get rid of any directives
-            label = re.match(r'^[^+]*', label)[0]
-
         if self.mode == 'basic':
-            label = self.__simplify_label(label)
-
-        return label
+            return self.__simplify_label(label.base)
+        if self.mode == 'normal':
+            return label.base
+        return str(label)
 
     def __simplify_label(self, label):
         if label == self.pad_token:
@@ -183,6 +320,201 @@ but {len(labels)} labels provided")
         return 'B'
 
 
+class FeatureVocabulary:
+    """
+    A frozen mapping from the prefix, focus, and suffix features of
+    Featurizer to the columns of a feature matrix
+
+    Tokens are mapped to integer ids, and each feature is identified by the
+    ids of the tokens in its window, so features are looked up without
+    joining any strings. Shapes that are already arrays of the ids of a
+    spiel.vocab.Vocabulary are mapped to these ids with one array lookup.
+    """
+    FIELDS = ('prefix', 'focus', 'suffix')
+    PAD_ID = 0
+    UNKNOWN_ID = 1
+
+    def __init__(self, token_ids, field_keys, unknown='ignore'):
+        """
+        Initializes the vocabulary
+
+        :param token_ids: The id of each token; PAD_ID is reserved for the
+                          pad token, and UNKNOWN_ID for unseen tokens
+        :type token_ids: dict of str => int
+        :param field_keys: The sorted keys of the windows seen for each field
+        :type field_keys: list of numpy.ndarray
+        :param unknown: Either 'ignore' or 'error'; what to do with features
+                        that are not in the vocabulary
+        :type unknown: str
+        """
+        if unknown not in ('ignore', 'error'):
+            raise ValueError(f"Unknown feature policy: {unknown}")
+        if len(token_ids) + 2 > 2 ** (63 // WINDOW_SIZE):
+            raise FeaturizationException(f"Too many distinct tokens \
+({len(token_ids)}) to key their windows")
+
+        self.token_ids = token_ids
+        self.field_keys = field_keys
+        self.unknown = unknown
+        self.base = max(token_ids.values(), default=self.UNKNOWN_ID) + 1
+        self.offsets = np.cumsum([0] + [len(keys) for keys in field_keys])
+        self.__lookup = (None, None)
+
+    @staticmethod
+    def fit(shapes, pad_token='_', unknown='ignore', token_vocabulary=None):
+        """
+        Builds a vocabulary out of the features of a set of shapes
+
+        :param shapes: The tokenized shapes to take features from, or arrays
+                       of the ids of *token_vocabulary*
+        :type shapes: list of list of str or list of np.array
+        :param pad_token: The token shapes are padded with
+        :type pad_token: str
+        :param unknown: What to do with unseen features; see __init__()
+        :type unknown: str
+        :param token_vocabulary: The vocabulary that the arrays of token ids
+                                 in *shapes* were encoded with
+        :type token_vocabulary: spiel.vocab.Vocabulary
+        :rtype: FeatureVocabulary
+        """
+        token_ids = {pad_token: FeatureVocabulary.PAD_ID}
+        encoded = [shape for shape in shapes if is_encoded(shape)]
+        tokens = [token for shape in shapes if not is_encoded(shape)
+                  for token in shape]
+        if encoded:
+            # Only the distinct ids need to be decoded
+            tokens += token_vocabulary.decode(np.unique(np.concatenate(
+                encoded)))
+        for token in tokens:
+            if token not in token_ids:
+                token_ids[token] = len(token_ids) + 1
+
+        vocabulary = FeatureVocabulary(token_ids, [], unknown)
+        keys = vocabulary.__window_keys(shapes, token_vocabulary)
+        vocabulary.field_keys = [np.unique(field) for field in keys]
+        vocabulary.offsets = np.cumsum(
+            [0] + [len(field) for field in vocabulary.field_keys])
+        return vocabulary
+
+    @property
+    def num_columns(self):
+        """
+        The number of columns in the matrices this vocabulary produces
+
+        :rtype: int
+        """
+        return int(self.offsets[-1])
+
+    def lookup(self, token_vocabulary):
+        """
+        Maps the ids of a spiel.vocab.Vocabulary to the ids of this vocabulary
+
+        :param token_vocabulary: The vocabulary to map from
+        :type token_vocabulary: spiel.vocab.Vocabulary
+        :return: The id in this vocabulary of each id in *token_vocabulary*
+        :rtype: np.array
+        """
+        cached, lookup = self.__lookup
+        if cached is not token_vocabulary:
+            lookup = np.empty(0, dtype=np.int64)
+        # Vocabularies only ever grow, so only new ids need to be added
+        if len(lookup) < len(token_vocabulary.tokens):
+            token_ids = self.token_ids
+            lookup = np.concatenate([lookup, np.array(
+                [token_ids.get(token, self.UNKNOWN_ID)
+                 for token in token_vocabulary.tokens[len(lookup):]],
+                dtype=np.int64)])
+            self.__lookup = (token_vocabulary, lookup)
+        return lookup
+
+    def transform(self, shapes, token_vocabulary=None):
+        """
+        Converts tokenized shapes into a sparse matrix of their features
+
+        :param shapes: The tokenized shapes to convert, or arrays of the ids
+                       of *token_vocabulary*
+        :type shapes: list of list of str or list of np.array
+        :param token_vocabulary: The vocabulary that the arrays of token ids
+                                 in *shapes* were encoded with
+        :type token_vocabulary: spiel.vocab.Vocabulary
+        :return: A matrix with a row for each instance of each shape, in order
+        :rtype: scipy.sparse.csr_matrix
+        """
+        keys = self.__window_keys(shapes, token_vocabulary)
+        num_rows = len(keys[0])
+
+        columns = np.empty((num_rows, len(self.FIELDS)), dtype=np.int64)
+        known = np.empty((num_rows, len(self.FIELDS)), dtype=bool)
+        for i, (field, field_keys) in enumerate(zip(keys, self.field_keys)):
+            positions = np.searchsorted(field_keys, field)
+            positions[positions == len(field_keys)] = 0
+            known[:, i] = (field_keys[positions] == field
+                           if len(field_keys) else False)
+            columns[:, i] = positions + self.offsets[i]
+
+        if self.unknown == 'error' and not known.all():
+            row, field = np.argwhere(~known)[0]
+            raise FeaturizationException(
+                f"Unknown {self.FIELDS[field]} feature in instance {row}")
+
+        indptr = np.zeros(num_rows + 1, dtype=np.int64)
+        np.cumsum(known.sum(axis=1), out=indptr[1:])
+        indices = columns[known]
+        data = np.ones(len(indices))
+
+        return csr_matrix((data, indices, indptr),
+                          shape=(num_rows, self.num_columns))
+
+    def __window_keys(self, shapes, token_vocabulary=None):
+        # Every shape is padded and laid end to end in one array of token
+        # ids, and each instance's window is a view into it
+        width = 2 * WINDOW_SIZE + 1
+        lengths = np.array([len(shape) for shape in shapes if len(shape)],
+                           dtype=np.int64)
+        ids = np.full(int(lengths.sum()) + (len(lengths) or 1) * (width + 1),
+                      self.PAD_ID, dtype=np.int64)
+        starts = np.zeros(len(lengths), dtype=np.int64)
+        np.cumsum(lengths[:-1] + width + 1, out=starts[1:])
+
+        token_ids = self.token_ids
+        lookup = self.lookup(token_vocabulary) \
+            if token_vocabulary is not None else None
+        for shape, start in zip((shape for shape in shapes if len(shape)),
+                                starts):
+            begin = start + WINDOW_SIZE + 1
+            if is_encoded(shape):
+                ids[begin:begin+len(shape)] = lookup[shape]
+            else:
+                ids[begin:begin+len(shape)] = [
+                    token_ids.get(token, self.UNKNOWN_ID) for token in shape]
+
+        # Each shape has an instance for each of its tokens, plus one on
+        # either side
+        counts = lengths + 2
+        rows = (np.repeat(starts - np.cumsum(counts) + counts, counts)
+                + np.arange(int(counts.sum())))
+        windows = ids[rows[:, np.newaxis] + np.arange(width)]
+
+        # Each window of token ids is read as the digits of a number in base
+        # self.base, which is unique to the tokens in the window
+        weights = self.base ** np.arange(WINDOW_SIZE - 1, -1, -1,
+                                         dtype=np.int64)
+        return (windows[:, :WINDOW_SIZE] @ weights,
+                windows[:, WINDOW_SIZE],
+                windows[:, WINDOW_SIZE+1:] @ weights)
+
+    def __getstate__(self):
+        return {'token_ids': self.token_ids, 'field_keys': self.field_keys,
+                'unknown': self.unknown}
+
+    def __setstate__(self, state):
+        self.__init__(state['token_ids'], state['field_keys'],
+                      state['unknown'])
+
+    def __len__(self):
+        return self.num_columns
+
+
 def concat_annotations(annotations):
     """
     Glues the shapes of a list of annotations together
@@ -3,24 +3,41 @@ spiel.sequence_labelling.features
 
 Handles featurization for the sequence labelling stage
 """
+from spiel.vocab import is_encoded
 
 
 class Featurizer:
     """
     Converts sequences to features for use in sequence labelling
     """
-    def __init__(self, ngrams=3):
+    def __init__(self, ngrams=3, vocabulary=None):
+        """
+        Initializes the featurizer
+
+        :param ngrams: The longest prefix and suffix of each segment to use
+                       as features
+        :type ngrams: int
+        :param vocabulary: The vocabulary that segments are encoded with, if
+                           sequences are given as arrays of ids
+        :type vocabulary: spiel.vocab.Vocabulary
+        """
         self.ngrams = ngrams
+        self.vocabulary = vocabulary
 
     def convert(self, sequence):
         """
         Converts a single sequence to features
 
         :param sequence: The sequence to convert
-        :type sequence: list
+        :type sequence: list or np.array
         :return: The features for each segment in the sequence
         :rtype: list of dict
         """
+        if is_encoded(sequence):
+            if self.vocabulary is None:
+                raise ValueError("Decoding segment ids requires a vocabulary")
+            sequence = self.vocabulary.decode(sequence)
+
         return [self.__convert_segment(sequence, index)
                 for index, _ in enumerate(sequence)]
 
@@ -35,9 +52,48 @@ class Featurizer:
         """
         return [self.convert(sequence) for sequence in sequences]
 
+    def convert_ids(self, ids, spans, vocabulary):
+        """
+        Converts sequences that lie end to end in one array of segment ids,
+        such as the segments of a spiel.data.Corpus; each distinct segment
+        is only featurized once
+
+        :param ids: The segment ids of every sequence
+        :type ids: np.array
+        :param spans: Where each sequence starts and ends in *ids*
+        :type spans: iterable of (int, int)
+        :param vocabulary: The vocabulary that the segments were encoded with
+        :type vocabulary: spiel.vocab.Vocabulary
+        :return: A list of lists of features for each sequence
+        :rtype: list of list of dict
+        """
+        segments = vocabulary.tokens
+        segment_features = {}
+        sequences = []
+
+        for start, end in spans:
+            sequence = ids[start:end].tolist()
+            features = []
+            for index, segment_id in enumerate(sequence):
+                if segment_id not in segment_features:
+                    segment_features[segment_id] = self.__segment_features(
+                        segments[segment_id])
+                previous = segments[sequence[index-1]] if index > 0 else None
+                following = segments[sequence[index+1]] \
+                    if index < len(sequence) - 1 else None
+                features.append(self.__add_context(
+                    dict(segment_features[segment_id]), previous, following))
+            sequences.append(features)
+
+        return sequences
+
     def __convert_segment(self, sequence, index):
-        segment = sequence[index]
+        previous = sequence[index-1] if index > 0 else None
+        following = sequence[index+1] if index < len(sequence) - 1 else None
+        return self.__add_context(self.__segment_features(sequence[index]),
+                                  previous, following)
 
+    def __segment_features(self, segment):
         features = {
             'bias': 1.0,
             'shape': segment,
@@ -47,13 +103,17 @@ class Featurizer:
             features[f"prefix{i}"] = segment[:i]
             features[f"suffix{i}"] = segment[-i:]
 
-        if index > 0:
-            features['prev_shape'] = sequence[index-1]
+        return features
+
+    @staticmethod
+    def __add_context(features, previous, following):
+        if previous is not None:
+            features['prev_shape'] = previous
         else:
             features['BOS'] = True
 
-        if index < len(sequence) - 1:
-            features['next_shape'] = sequence[index+1]
+        if following is not None:
+            features['next_shape'] = following
         else:
             features['EOS'] = True
 
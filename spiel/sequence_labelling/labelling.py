@@ -1,6 +1,7 @@
 """
 spiel.sequence_labelling.labelling
 """
+from spiel.data import Corpus
 from spiel.sequence_labelling.features import Featurizer
 from spiel.sequence_labelling.crf import SequenceClassifier
 
@@ -18,19 +19,27 @@ class SequenceLabeller:
         self.classifier_type = Classifier or SequenceClassifier
         self.model = None
 
-    def train(self, sequences, labels, grid_search=True):
+    def train(self, sequences, labels=None, grid_search=True):
         """
         Trains the underlying classifier
 
-        :param sequences: The sequences to train on
-        :type sequences: list of list
-        :param labels: The labels for each sequence
+        :param sequences: The sequences to train on, or a corpus to train on
+                          the segments of the annotated instances of
+        :type sequences: list of list or spiel.data.Corpus
+        :param labels: The labels for each sequence; not needed for a corpus
         :type labels: list of list
         :param grid_search: Whether or not to use grid search to optimize the
                             model
         :type grid_search: bool
         """
-        features = self.featurizer.convert_many(sequences)
+        if isinstance(sequences, Corpus):
+            features, labels = self.__corpus_features(sequences)
+        elif labels is None:
+            raise LabellingException("Labels are required unless training \
+on a corpus")
+        else:
+            features = self.featurizer.convert_many(sequences)
+
         if grid_search:
             self.model = self.classifier_type.grid_search(features, labels)
         else:
@@ -49,3 +58,30 @@ class SequenceLabeller:
             raise LabellingException("The model has not been trained.")
         features = self.featurizer.convert(sequence)
         return self.model.predict(features)
+
+    def label_many(self, sequences):
+        """
+        Labels several sequences at once; see label()
+
+        :param sequences: The sequences to label
+        :type sequences: list of list
+        :return: The labels for each segment of each sequence
+        :rtype: list of list of str
+        """
+        if not self.model:
+            raise LabellingException("The model has not been trained.")
+        if not sequences:
+            return []
+        features = self.featurizer.convert_many(sequences)
+        return [list(labels) for labels in self.model.predict_many(features)]
+
+    def __corpus_features(self, corpus):
+        # The segments are featurized straight from the corpus's flat array
+        # of segment ids, and the labels are decoded once, end to end
+        indices = corpus.annotated_indices()
+        spans = list(zip(corpus.segment_offsets[indices],
+                         corpus.segment_offsets[indices+1]))
+        features = self.featurizer.convert_ids(corpus.segment_ids, spans,
+                                               corpus.segment_table)
+        all_labels = corpus.label_table.decode(corpus.label_ids)
+        return features, [all_labels[start:end] for start, end in spans]
@@ -0,0 +1,440 @@
+"""
+spiel.server
+
+A long-running server that segments shapes with a loaded pipeline, and a
+client for it
+
+The protocol is one JSON object per line in each direction. A request is
+answered by one response, in the order the requests were sent:
+
+{"op": "segment", "shape": "foo", "id": 1}
+    => {"id": 1, "shape": "foo", "segments": [...], "labels": [...]}
+{"op": "segment", "shapes": ["foo", "bar"]}
+    => {"results": [{"shape": "foo", ...}, {"shape": "bar", ...}]}
+{"op": "health"}
+    => {"status": "ok", "pending": 0, "shapes": 12, "batches": 3, ...}
+
+"op" defaults to "segment", and "id" is optional; it is sent back as is.
+A request that cannot be answered gets {"id": ..., "error": "..."} instead.
+"""
+import asyncio
+import json
+import os
+import socket
+
+# The defaults for the limits of a SegmentationServer
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_MAX_WAIT = 0.005
+DEFAULT_MAX_PENDING = 1024
+DEFAULT_MAX_IN_FLIGHT = 64
+
+# The default address to listen on
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# The longest line the server will read, in bytes
+MAX_LINE_LENGTH = 2 ** 20
+
+
+class ServerError(RuntimeError):
+    """ Raised by the client when the server answers with an error """
+
+
+class SegmentationServer:
+    """
+    Answers segmentation requests from many connections with one pipeline
+
+    Shapes from all of the connections are put in one queue, and annotated
+    together in micro-batches of up to *batch_size* shapes. A batch starts
+    as soon as the first shape arrives, and waits up to *max_wait* seconds
+    for more to fill it. The queue holds at most *max_pending* shapes, and
+    each connection has at most *max_in_flight* requests being answered, so
+    a client that sends requests faster than they are answered is made to
+    wait, rather than filling memory.
+    """
+    def __init__(self, pipeline, batch_size=DEFAULT_BATCH_SIZE,
+                 max_wait=DEFAULT_MAX_WAIT, max_pending=DEFAULT_MAX_PENDING,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        """
+        Initializes the server
+
+        :param pipeline: The pipeline to annotate shapes with
+        :type pipeline: spiel.pipeline.Pipeline
+        :param batch_size: The most shapes to annotate at once
+        :type batch_size: int
+        :param max_wait: The longest a batch waits to be filled, in seconds
+        :type max_wait: float
+        :param max_pending: The most shapes waiting to be annotated
+        :type max_pending: int
+        :param max_in_flight: The most requests being answered for each
+                              connection
+        :type max_in_flight: int
+        """
+        self.pipeline = pipeline
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.max_pending = max_pending
+        self.max_in_flight = max_in_flight
+        self.num_shapes = 0
+        self.num_batches = 0
+        self.num_connections = 0
+        self.server = None
+        self.path = None
+        self.__queue = None
+        self.__batcher = None
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None):
+        """
+        Starts listening for connections
+
+        :param host: The interface to listen on
+        :type host: str
+        :param port: The TCP port to listen on; 0 picks a free one
+        :type port: int
+        :param path: A Unix socket to listen on instead of a TCP port
+        :type path: str
+        :rtype: asyncio.AbstractServer
+        """
+        self.__queue = asyncio.Queue(maxsize=self.max_pending)
+        self.__batcher = asyncio.ensure_future(self.__run_batches())
+
+        if path is not None:
+            self.server = await asyncio.start_unix_server(
+                self.__handle, path=path, limit=MAX_LINE_LENGTH)
+            self.path = path
+        else:
+            self.server = await asyncio.start_server(
+                self.__handle, host, port, limit=MAX_LINE_LENGTH)
+        return self.server
+
+    @property
+    def address(self):
+        """
+        The address the server is listening on: a (host, port) pair, or the
+        path of a Unix socket
+
+        :rtype: tuple or str
+        """
+        return self.server.sockets[0].getsockname()
+
+    async def serve_forever(self):
+        """
+        Answers requests until the server is cancelled
+        """
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.close()
+
+    async def close(self):
+        """
+        Stops listening, and stops annotating once the current batch is done
+
+        A Unix socket that the server was listening on is removed.
+        """
+        self.server.close()
+        await self.server.wait_closed()
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+        self.__batcher.cancel()
+        try:
+            await self.__batcher
+        except asyncio.CancelledError:
+            pass
+
+    async def annotate(self, shapes):
+        """
+        Annotates shapes as part of the next batches
+
+        :param shapes: The shapes to annotate
+        :type shapes: list of str
+        :rtype: list of list of (str, str)
+        """
+        loop = asyncio.get_running_loop()
+        futures = []
+        for shape in shapes:
+            future = loop.create_future()
+            await self.__queue.put((shape, future))
+            futures.append(future)
+        return await asyncio.gather(*futures)
+
+    def health(self):
+        """
+        Reports the state of the server
+
+        :rtype: dict
+        """
+        return {
+            'status': 'ok',
+            'pending': self.__queue.qsize(),
+            'shapes': self.num_shapes,
+            'batches': self.num_batches,
+            'connections': self.num_connections,
+            'model': getattr(self.pipeline, 'metadata', None)
+        }
+
+    async def respond(self, line):
+        """
+        Answers one line of the protocol
+
+        :param line: The request
+        :type line: bytes or str
+        :rtype: dict
+        """
+        try:
+            request = json.loads(line)
+        except ValueError as error:
+            return {'error': f"Invalid JSON: {error}"}
+        if not isinstance(request, dict):
+            return {'error': "Requests must be JSON objects."}
+
+        response = {'id': request['id']} if 'id' in request else {}
+        op = request.get('op', 'segment')
+
+        try:
+            if op == 'health':
+                response.update(self.health())
+            elif op == 'segment':
+                response.update(await self.__segment(request))
+            else:
+                response['error'] = f"Unknown op '{op}'."
+        except Exception as error:  # pylint: disable=W0703
+            response['error'] = f"{type(error).__name__}: {error}"
+
+        return response
+
+    async def __segment(self, request):
+        shape, shapes = request.get('shape'), request.get('shapes')
+
+        if isinstance(shape, str):
+            annotations, = await self.annotate([shape])
+            return self.__result(shape, annotations)
+
+        if isinstance(shapes, list) \
+                and all(isinstance(shape, str) for shape in shapes):
+            results = await self.annotate(shapes)
+            return {'results': [self.__result(shape, annotations)
+                                for shape, annotations
+                                in zip(shapes, results)]}
+
+        return {'error': "A segment request needs a 'shape' string or a \
+'shapes' list of strings."}
+
+    async def __handle(self, reader, writer):
+        self.num_connections += 1
+        # Holds the answers to the requests being worked on, in the order
+        # they were sent; while it is full, no more requests are read
+        responses = asyncio.Queue(maxsize=self.max_in_flight)
+        replier = asyncio.ensure_future(self.__reply(responses, writer))
+
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # The line is longer than the limit; nothing after it can
+                    # be trusted to start on a new request
+                    await responses.put(self.__error(
+                        f"Requests must be under {MAX_LINE_LENGTH} bytes."))
+                    break
+                if not line:
+                    break
+                if line.strip():
+                    await responses.put(
+                        asyncio.ensure_future(self.respond(line)))
+        except ConnectionError:
+            pass
+        finally:
+            await responses.put(None)
+            await replier
+            self.num_connections -= 1
+
+    async def __reply(self, responses, writer):
+        connected = True
+        try:
+            while True:
+                response = await responses.get()
+                if response is None:
+                    break
+                if not connected:
+                    # There is no one left to answer, but the queue is still
+                    # drained, so that the reader never waits on it forever
+                    response.cancel()
+                    continue
+                try:
+                    response = await response
+                    writer.write(json.dumps(response, ensure_ascii=False)
+                                 .encode('utf-8') + b'\n')
+                    await writer.drain()
+                except ConnectionError:
+                    connected = False
+        finally:
+            writer.close()
+
+    async def __run_batches(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self.__queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            while len(batch) < self.batch_size:
+                if not self.__queue.empty():
+                    batch.append(self.__queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.__queue.get(),
+                                                        timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            shapes = [shape for shape, _ in batch]
+            try:
+                # The pipeline runs in a thread, so that connections are
+                # still read from and written to while it works
+                results = await loop.run_in_executor(
+                    None, self.pipeline.annotate_many, shapes)
+            except Exception:  # pylint: disable=W0703
+                # Each shape is tried again on its own, so that only the
+                # requests with the shapes that failed are answered with an
+                # error
+                results = await loop.run_in_executor(
+                    None, self.__annotate_each, shapes)
+
+            self.num_shapes += len(batch)
+            self.num_batches += 1
+            for (_, future), annotations in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(annotations, Exception):
+                    future.set_exception(annotations)
+                else:
+                    future.set_result(annotations)
+
+    def __annotate_each(self, shapes):
+        results = []
+        for shape in shapes:
+            try:
+                results.append(self.pipeline.annotate_many([shape])[0])
+            except Exception as error:  # pylint: disable=W0703
+                results.append(error)
+        return results
+
+    @staticmethod
+    def __error(message):
+        future = asyncio.get_running_loop().create_future()
+        future.set_result({'error': message})
+        return future
+
+    @staticmethod
+    def __result(shape, annotations):
+        return {
+            'shape': shape,
+            'segments': [segment for segment, _ in annotations],
+            'labels': [label for _, label in annotations]
+        }
+
+
+class SegmentationClient:
+    """
+    A blocking client for a SegmentationServer
+
+    It can be used as a context manager, which closes the connection on
+    exit.
+    """
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None,
+                 timeout=None):
+        """
+        Connects to a server
+
+        :param host: The host the server is on
+        :type host: str
+        :param port: The TCP port the server is listening on
+        :type port: int
+        :param path: The Unix socket the server is listening on, instead of a
+                     TCP port
+        :type path: str
+        :param timeout: How long to wait for the server, in seconds; by
+                        default, it is waited for indefinitely
+        :type timeout: float
+        """
+        if path is not None:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.settimeout(timeout)
+            self.socket.connect(path)
+        else:
+            self.socket = socket.create_connection((host, port), timeout)
+        self.__file = self.socket.makefile('rwb')
+
+    def request(self, request):
+        """
+        Sends a request and waits for its response
+
+        :param request: The request; see the module documentation
+        :type request: dict
+        :rtype: dict
+        """
+        self.__file.write(json.dumps(request).encode('utf-8') + b'\n')
+        self.__file.flush()
+        line = self.__file.readline()
+        if not line:
+            raise ConnectionError("The server closed the connection.")
+
+        response = json.loads(line)
+        if 'error' in response:
+            raise ServerError(response['error'])
+        return response
+
+    def segment(self, shape):
+        """
+        Segments and labels a shape
+
+        :param shape: The shape to annotate
+        :type shape: str
+        :return: A list of morpheme/label pairs
+        :rtype: list of (str, str)
+        """
+        return self.__annotations(self.request({'shape': shape}))
+
+    def segment_many(self, shapes):
+        """
+        Segments and labels several shapes in one request
+
+        :param shapes: The shapes to annotate
+        :type shapes: list of str
+        :rtype: list of list of (str, str)
+        """
+        response = self.request({'shapes': list(shapes)})
+        return [self.__annotations(result) for result in response['results']]
+
+    def health(self):
+        """
+        Asks the server for its state; see SegmentationServer.health()
+
+        :rtype: dict
+        """
+        return self.request({'op': 'health'})
+
+    def close(self):
+        """
+        Closes the connection
+        """
+        self.__file.close()
+        self.socket.close()
+
+    @staticmethod
+    def __annotations(result):
+        return list(zip(result['segments'], result['labels']))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
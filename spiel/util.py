@@ -5,6 +5,7 @@ Utility methods for SPieL
 """
 import collections
 from itertools import zip_longest
+import os
 
 
 def flatten(lst):
@@ -48,7 +49,7 @@ def pad(item, char, size):
     Adds *size* *char*s to either side of *item*
 
     :param item: The base item to pad
-    :type item: list or str
+    :type item: list or tuple or str
     :param char: The char to pad with
     :type char: str
     :param size: The number of *chars* to put on either end
@@ -58,6 +59,22 @@ def pad(item, char, size):
     """
     if isinstance(item, str):
         padding = char * size
+    elif isinstance(item, tuple):
+        padding = (char,) * size
     else:
         padding = [char] * size
     return padding + item + padding
+
+
+def num_workers(n_jobs):
+    """
+    Interprets an *n_jobs* argument as a number of worker processes
+
+    :param n_jobs: The requested number of jobs; -1 for one per CPU, -2 for
+                   all but one, and so on. 0 is taken to mean 1.
+    :type n_jobs: int
+    :rtype: int
+    """
+    if n_jobs < 0:
+        return max(1, (os.cpu_count() or 1) + 1 + n_jobs)
+    return max(1, n_jobs)
@@ -0,0 +1,180 @@
+"""
+spiel.vocab
+
+Tokenization, and mappings between tokens and the integer ids that stand in
+for them
+"""
+import re
+import numpy as np
+
+# The number of tokenized strings a Tokenizer remembers before starting over
+TOKENIZER_CACHE_SIZE = 2 ** 16
+
+
+class Vocabulary:
+    """
+    A two-way mapping between tokens and integer ids
+
+    Ids start at 1; UNKNOWN_ID stands in for tokens that are not in a frozen
+    vocabulary.
+    """
+    UNKNOWN_ID = 0
+
+    def __init__(self, tokens=None):
+        """
+        Initializes the vocabulary
+
+        :param tokens: Tokens to give ids to, in order
+        :type tokens: iterable of str
+        """
+        self.ids = {}
+        self.tokens = [None]
+        self.frozen = False
+        for token in tokens or []:
+            self.id(token)
+
+    def id(self, token):
+        """
+        Looks up the id of a token, giving it a new one if it has none and
+        the vocabulary is not frozen
+
+        :param token: The token to look up
+        :type token: str
+        :rtype: int
+        """
+        token_id = self.ids.get(token)
+        if token_id is None:
+            if self.frozen:
+                return self.UNKNOWN_ID
+            token_id = self.ids[token] = len(self.tokens)
+            self.tokens.append(token)
+        return token_id
+
+    def encode(self, tokens):
+        """
+        Converts tokens into an array of their ids
+
+        :param tokens: The tokens to convert
+        :type tokens: list of str
+        :rtype: np.array
+        """
+        return np.array([self.id(token) for token in tokens], dtype=np.int32)
+
+    def decode(self, ids):
+        """
+        Converts an array of ids back into tokens; unknown ids become None
+
+        :param ids: The ids to convert
+        :type ids: np.array or list of int
+        :rtype: list of str
+        """
+        tokens = self.tokens
+        return [tokens[token_id] for token_id in ids]
+
+    def freeze(self):
+        """
+        Stops new tokens from being added; they are given UNKNOWN_ID instead
+        """
+        self.frozen = True
+
+    def __getitem__(self, token_id):
+        return self.tokens[token_id]
+
+    def __contains__(self, token):
+        return token in self.ids
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class Tokenizer:
+    """
+    Splits strings into tokens with a compiled regular expression
+
+    A Tokenizer can be passed anywhere spiel accepts a *tokenize* function.
+    Unlike a lambda, it can be pickled along with the objects that use it,
+    and it remembers the strings it has recently split, so each shape is only
+    run through the expression once. It also holds a Vocabulary, so that the
+    same strings can be encoded as arrays of token ids.
+    """
+    def __init__(self, pattern=None, vocabulary=None):
+        """
+        Initializes the tokenizer
+
+        :param pattern: The regular expression that matches one token.
+                        Defaults to splitting strings into characters.
+        :type pattern: str
+        :param vocabulary: The vocabulary to encode tokens with. Defaults to a
+                           new, empty vocabulary.
+        :type vocabulary: Vocabulary
+        """
+        self.pattern = pattern
+        self.vocabulary = vocabulary if vocabulary is not None \
+            else Vocabulary()
+        self.__regex = re.compile(pattern) if pattern is not None else None
+        self.__cache = {}
+
+    def tokenize(self, text):
+        """
+        Splits a string into tokens
+
+        :param text: The string to split
+        :type text: str
+        :return: The tokens of the string; the same tuple is given back for
+                 each call with the same string
+        :rtype: tuple of str
+        """
+        tokens = self.__cache.get(text)
+        if tokens is None:
+            if len(self.__cache) >= TOKENIZER_CACHE_SIZE:
+                self.__cache.clear()
+            if self.__regex is None:
+                tokens = tuple(text)
+            else:
+                tokens = tuple(self.__regex.findall(text))
+            self.__cache[text] = tokens
+        return tokens
+
+    def encode(self, text):
+        """
+        Converts a string, or a list of its tokens, into an array of token ids
+
+        :param text: The string to convert
+        :type text: str or list of str
+        :rtype: np.array
+        """
+        if isinstance(text, str):
+            text = self.tokenize(text)
+        return self.vocabulary.encode(text)
+
+    def decode(self, ids):
+        """
+        Converts an array of token ids back into tokens
+
+        :param ids: The ids to convert
+        :type ids: np.array or list of int
+        :rtype: list of str
+        """
+        return self.vocabulary.decode(ids)
+
+    def __call__(self, text):
+        return self.tokenize(text)
+
+    def __getstate__(self):
+        return {'pattern': self.pattern, 'vocabulary': self.vocabulary}
+
+    def __setstate__(self, state):
+        self.__init__(state['pattern'], state['vocabulary'])
+
+
+def is_encoded(sequence):
+    """
+    Whether a sequence is an array of token ids rather than a string or a
+    list of tokens
+
+    :param sequence: The sequence to check
+    :type sequence: any
+    :rtype: bool
+    """
+    return isinstance(sequence, np.ndarray) \
+        and np.issubdtype(sequence.dtype, np.integer)
@@ -16,6 +16,16 @@ def captured_output():
         sys.stdout, sys.stderr = old_out, old_err
 
 
+@contextmanager
+def captured_input(text):
+    old_in = sys.stdin
+    try:
+        sys.stdin = StringIO(text)
+        yield
+    finally:
+        sys.stdin = old_in
+
+
 @contextmanager
 def cl_args(*args):
     old_args = sys.argv
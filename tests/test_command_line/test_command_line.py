@@ -1,6 +1,11 @@
 # coding: spec
-from util import captured_output, command_line_args
+import json
+from pathlib import Path
+import shutil
+
+from util import captured_input, captured_output, cl_args, command_line_args
 from spiel.command_line import main
+from spiel.data import Corpus, load_file
 
 
 describe 'main':
@@ -29,3 +34,146 @@ Accuracy: 0.8
 Test results
 Shape 'fo' segmented to 'f/A-o/B'.
 Accuracy: 0.5""")
+
+    @command_line_args('--train',
+                       'tests/test_command_line/resources/train_instances.txt',
+                       '--test',
+                       'tests/test_command_line/resources/test_instances.txt',
+                       '--jobs', '2')
+    it 'can segment in several processes':
+        with captured_output() as (out, err):
+            main()
+        output = out.getvalue().strip()
+        self.assertEqual(output, """Train results
+Accuracy: 0.8
+
+Test results
+Shape 'fo' segmented to 'f/A-o/B'.
+Accuracy: 0.5""")
+
+    @command_line_args('--train',
+                       'tests/test_command_line/resources/train_instances.txt',
+                       '--test',
+                       'tests/test_command_line/resources/test_instances.txt',
+                       '--jobs', '0')
+    it 'segments in this process if no jobs are asked for':
+        with captured_output() as (out, err):
+            main()
+        output = out.getvalue().strip()
+        self.assertEqual(output, """Train results
+Accuracy: 0.8
+
+Test results
+Shape 'fo' segmented to 'f/A-o/B'.
+Accuracy: 0.5""")
+
+    describe 'compile-corpus':
+        after_each:
+            delete_file(Path('TEST_CORPUS.bin'))
+
+        @command_line_args('compile-corpus',
+                           'tests/test_command_line/resources/train_instances.txt',
+                           'TEST_CORPUS.bin')
+        it 'writes the instances to a compiled corpus':
+            with captured_output() as (out, err):
+                main()
+            corpus = Corpus.load_compiled('TEST_CORPUS.bin')
+            instances = load_file('tests/test_command_line/resources/train_instances.txt')
+            self.assertEqual(list(corpus), instances)
+            self.assertEqual(out.getvalue().strip(),
+                             'Compiled 5 instances into TEST_CORPUS.bin.')
+
+        @command_line_args('--train', 'TEST_CORPUS.bin')
+        it 'can train on the compiled corpus':
+            Corpus.load('tests/test_command_line/resources/train_instances.txt') \
+                .save('TEST_CORPUS.bin')
+            with captured_output() as (out, err):
+                main()
+            self.assertEqual(out.getvalue().strip(), """Train results
+Accuracy: 0.8""")
+
+    describe 'train':
+        after_each:
+            shutil.rmtree('TEST_MODEL', ignore_errors=True)
+
+        @command_line_args('train',
+                           'tests/test_command_line/resources/train_instances.txt',
+                           '--out', 'TEST_MODEL')
+        it 'saves the model to a directory':
+            with captured_output() as (out, err):
+                main()
+            self.assertEqual(out.getvalue().strip(),
+                             'Saved model to TEST_MODEL.')
+            metadata = json.loads(Path('TEST_MODEL/metadata.json').read_text())
+            self.assertEqual(metadata['format_version'], 1)
+            self.assertEqual(metadata['featurizer']['mode'], 'basic')
+
+        @command_line_args('--train',
+                           'tests/test_command_line/resources/train_instances.txt',
+                           '--save-model', 'TEST_MODEL')
+        it 'can save the model while evaluating':
+            with captured_output() as (out, err):
+                main()
+            self.assertTrue(Path('TEST_MODEL/metadata.json').exists())
+
+    describe 'run':
+        before_each:
+            train_model('TEST_MODEL')
+
+        after_each:
+            shutil.rmtree('TEST_MODEL', ignore_errors=True)
+
+        @command_line_args('run', '--model', 'TEST_MODEL',
+                           'tests/test_command_line/resources/test_instances.txt')
+        it 'evaluates the saved model without training':
+            with captured_output() as (out, err):
+                main()
+            self.assertEqual(out.getvalue().strip(), """Test results
+Shape 'fo' segmented to 'f/A-o/B'.
+Accuracy: 0.5""")
+
+    describe 'segment':
+        before_each:
+            train_model('TEST_MODEL')
+
+        after_each:
+            shutil.rmtree('TEST_MODEL', ignore_errors=True)
+
+        @command_line_args('segment', '--model', 'TEST_MODEL')
+        it 'writes a line of TSV for each line of input':
+            with captured_input('fo\n\nfoo\n'), captured_output() as (out, err):
+                main()
+            self.assertEqual(out.getvalue(),
+                             'fo\tf o\tA B\n\t\t\nfoo\tfo o\tF B\n')
+
+        @command_line_args('segment', '--model', 'TEST_MODEL',
+                           '--format', 'jsonl', '--words', '--batch-size', '1')
+        it 'writes a line of JSON for each word of input':
+            with captured_input('fo foo\n'), captured_output() as (out, err):
+                main()
+            results = [json.loads(line) for line in out.getvalue().splitlines()]
+            self.assertEqual(results,
+                             [{'shape': 'fo', 'segments': ['f', 'o'],
+                               'labels': ['A', 'B']},
+                              {'shape': 'foo', 'segments': ['fo', 'o'],
+                               'labels': ['F', 'B']}])
+
+        @command_line_args('segment', '--model', 'TEST_MODEL',
+                           '--jobs', '2', '--batch-size', '1')
+        it 'can segment in several processes':
+            with captured_input('fo\n\nfoo\n'), captured_output() as (out, err):
+                main()
+            self.assertEqual(out.getvalue(),
+                             'fo\tf o\tA B\n\t\t\nfoo\tfo o\tF B\n')
+
+
+def train_model(path):
+    with cl_args('train',
+                 'tests/test_command_line/resources/train_instances.txt',
+                 '--out', path), captured_output():
+        main()
+
+
+def delete_file(path):
+    if path.exists():
+        path.unlink()
@@ -1,5 +1,27 @@
 # coding: spec
-from spiel.data import Instance, load, load_file, ParseError
+import re
+import tarfile
+
+from pathlib import Path
+from types import GeneratorType
+
+from spiel.data import (
+    archive_splits,
+    Corpus,
+    Instance,
+    InstanceIndex,
+    InstanceView,
+    is_archive,
+    is_compiled,
+    iter_archive_instances,
+    iter_instances,
+    iter_paired_instances,
+    load,
+    load_file,
+    load_parallel,
+    ParseError,
+    split_archive_path
+)
 
 
 describe 'Instance':
@@ -11,6 +33,36 @@ describe 'Instance':
             self.assertEqual(instance.annotations,
                              [('f', 'B'), ('o', 'A'), ('o', 'R')])
 
+        it 'only builds its annotations once':
+            instance = Instance('foo', ['f', 'oo'], ['B', 'A'])
+            self.assertIs(instance.annotations, instance.annotations)
+
+        it 'rebuilds its annotations when its labels change':
+            instance = Instance('foo', ['f', 'oo'], ['B', 'A'])
+            instance.annotations
+            instance.labels = ['A', 'B']
+            self.assertEqual(instance.annotations, [('f', 'A'), ('oo', 'B')])
+
+    describe 'tokens':
+        it 'defaults to the characters of the shape':
+            instance = Instance('foo', ['f', 'oo'], ['B', 'A'])
+            self.assertEqual(instance.tokens, ['f', 'o', 'o'])
+
+        it 'can be provided':
+            instance = Instance('fo·o', ['f', 'o·o'], ['B', 'A'],
+                                tokens=['f', 'o·', 'o'])
+            self.assertEqual(instance.tokens, ['f', 'o·', 'o'])
+
+    it 'keeps its attributes in slots':
+        instance = Instance('foo', ['f', 'oo'], ['B', 'A'])
+        self.assertFalse(hasattr(instance, '__dict__'))
+
+    it 'interns its strings':
+        label = ''.join(['FO', 'O'])
+        instance_1 = Instance('foo', ['foo'], [label])
+        instance_2 = Instance('foo', ['foo'], [''.join(['F', 'OO'])])
+        self.assertIs(instance_1.labels[0], instance_2.labels[0])
+
     describe 'annotation_string':
         it "presents the instance's annotation as a string":
             instance = Instance('foo', ['f', 'o', 'o'], ['B', 'A', 'R'])
@@ -61,6 +113,11 @@ describe 'load':
         with self.assertRaises(ParseError):
             load(['', 'f o o', 'b a r'])
 
+    it 'tokenizes shapes with a provided function':
+        instances = load(['fo·o', 'f o·o', 'B A'],
+                         tokenize=lambda x: re.findall(r'.[·]*', x))
+        self.assertEqual(instances[0].tokens, ['f', 'o·', 'o'])
+
     it 'handles multiple blank lines':
         instances = load(['foo', 'f o o', 'B A R', '', '', 'ba', 'b a', 'A B'])
         self.assertEqual(instances,
@@ -98,3 +155,301 @@ describe 'load':
         it 'raises an error if only two lines are present':
             with self.assertRaises(ParseError):
                 load(['foo', 'f o o'], strict=True)
+
+
+describe 'iter_instances':
+    it 'yields instances from a list of lines':
+        instances = iter_instances(['foo', 'f o o', 'B A R', '', 'ba', 'b a',
+                                    'A B'])
+        self.assertIsInstance(instances, GeneratorType)
+        self.assertEqual(list(instances),
+                         [Instance('foo', ['f', 'o', 'o'], ['B', 'A', 'R']),
+                          Instance('ba', ['b', 'a'], ['A', 'B'])])
+
+    it 'yields instances from a file':
+        for path in ['tests/test_data/resources/instances.txt',
+                     Path('tests/test_data/resources/instances.txt')]:
+            self.assertEqual(list(iter_instances(path)),
+                             load_file('tests/test_data/resources/instances.txt'))
+
+    it 'yields each instance as soon as its block is finished':
+        def lines():
+            yield from ['foo', 'f o o', 'B A R', '']
+            raise AssertionError('read too far')
+
+        instances = iter_instances(lines())
+        self.assertEqual(next(instances),
+                         Instance('foo', ['f', 'o', 'o'], ['B', 'A', 'R']))
+
+    it 'reports the line that a bad instance starts on':
+        instances = iter_instances(['foo', 'f o o', 'B A R', '', '',
+                                    'ba', 'b a', 'A'])
+        with self.assertRaisesRegex(ParseError, 'line 6'):
+            list(instances)
+
+    it 'reports the file that a bad instance is in':
+        with self.assertRaisesRegex(ParseError, 'incomplete.txt, line 1'):
+            list(iter_instances('tests/test_data/resources/incomplete.txt'))
+
+
+describe 'compressed files':
+    it 'are decompressed as they are read':
+        expected = load_file('tests/test_data/resources/instances.txt')
+        for extension in ['gz', 'bz2', 'xz']:
+            path = f'tests/test_data/resources/instances.txt.{extension}'
+            self.assertEqual(load_file(path), expected)
+            self.assertEqual(list(iter_instances(path)), expected)
+
+    it 'are recognized without their extensions':
+        path = Path('TEST_INSTANCES.txt')
+        path.write_bytes(
+            Path('tests/test_data/resources/instances.txt.gz').read_bytes())
+        try:
+            self.assertEqual(
+                load_file(path, n_jobs=2),
+                load_file('tests/test_data/resources/instances.txt'))
+        finally:
+            delete_file(path)
+
+
+describe 'iter_paired_instances':
+    it 'pairs shapes with their segmentations':
+        instances = iter_paired_instances(['foo', 'ba'], ['f-o-o', 'b-a'])
+        self.assertEqual(list(instances),
+                         [Instance('foo', ['f', 'o', 'o'], ['f', 'o', 'o']),
+                          Instance('ba', ['b', 'a'], ['b', 'a'])])
+
+    it 'raises an error if the files are different lengths':
+        with self.assertRaisesRegex(ParseError, 'line 2'):
+            list(iter_paired_instances(['foo', 'ba'], ['f-o-o']))
+        with self.assertRaises(ParseError):
+            list(iter_paired_instances(['foo'], ['f-o-o', 'b-a']))
+
+
+describe 'iter_archive_instances':
+    before_each:
+        self.path = 'tests/test_data/resources/corpus.tgz'
+
+    it 'reads every pair of files in an archive':
+        self.assertEqual([instance.shape for instance
+                          in iter_archive_instances(self.path)],
+                         ['foo', 'ba', 'baz'])
+
+    it 'reads the pairs of one split':
+        instances = iter_archive_instances(self.path, 'dev')
+        self.assertEqual(list(instances),
+                         [Instance('baz', ['ba', 'z'], ['ba', 'z'])])
+
+    it 'is used for one split of an archive by the other loaders':
+        path = f'{self.path}#dev'
+        self.assertTrue(is_archive(path))
+        self.assertFalse(is_compiled(path))
+        self.assertEqual(load_file(path),
+                         list(iter_archive_instances(self.path, 'dev')))
+        self.assertEqual(list(Corpus.load(path)), load_file(path))
+
+    it 'makes the other loaders choose a split of an archive with several':
+        with self.assertRaisesRegex(ParseError, 'several splits'):
+            load_file(self.path)
+
+    it 'lists the splits of an archive':
+        self.assertEqual(archive_splits(self.path), ['dev', 'train'])
+
+
+describe 'split_archive_path':
+    it 'separates an archive from its split':
+        self.assertEqual(split_archive_path('corpus.tgz#train'),
+                         ('corpus.tgz', 'train'))
+
+    it 'gives back other paths whole':
+        self.assertEqual(split_archive_path('corpus.tgz'),
+                         ('corpus.tgz', None))
+        self.assertEqual(split_archive_path('notes#1.txt'),
+                         ('notes#1.txt', None))
+
+
+describe 'load_parallel':
+    before_each:
+        self.path = Path('TEST_INSTANCES.txt')
+        self.blocks = [f'ab{i}\na b{i}\nA B\n' for i in range(50)]
+        self.path.write_text('\n'.join(self.blocks))
+
+    after_each:
+        delete_file(self.path)
+
+    it 'loads the same instances as load_file':
+        instances = load_parallel(self.path, n_jobs=2)
+        self.assertEqual(len(instances), 50)
+        self.assertEqual(instances, load_file(self.path))
+
+    it 'is used by load_file when it is given more than one job':
+        self.assertEqual(load_file(self.path, n_jobs=2), load_file(self.path))
+
+    it 'reports the line of a bad instance in the whole file':
+        self.blocks[40] = 'ab\na b\nA\n'
+        self.path.write_text('\n'.join(self.blocks))
+        with self.assertRaisesRegex(ParseError,
+                                    'TEST_INSTANCES.txt, line 161'):
+            load_parallel(self.path, n_jobs=2)
+
+
+describe 'InstanceIndex':
+    before_each:
+        self.path = Path('TEST_INSTANCES.txt')
+        self.blocks = [f'ab{i}\na b{i}\nA B\n' for i in range(20)]
+        self.path.write_text('\n\n'.join(self.blocks))
+        self.instances = load_file(self.path)
+        self.index = InstanceIndex.build(self.path)
+
+    after_each:
+        delete_file(self.path)
+        delete_file(Path('TEST_INSTANCES.txt.idx'))
+        delete_file(Path('TEST_CORPUS.spielcor'))
+        delete_file(Path('TEST_ARCHIVE.txt'))
+
+    it 'finds every instance':
+        self.assertEqual(len(self.index), 20)
+        self.assertEqual(list(self.index.line_numbers[:3]), [1, 6, 11])
+
+    it 'reads any instance on its own':
+        self.assertEqual(self.index.read(7), self.instances[7])
+        self.assertEqual(self.index.read(-1), self.instances[-1])
+        with self.assertRaises(IndexError):
+            self.index.read(20)
+
+    it 'reports the line of a bad instance':
+        self.blocks[3] = 'ab\na b\nA\n'
+        self.path.write_text('\n\n'.join(self.blocks))
+        index = InstanceIndex.build(self.path)
+        with self.assertRaisesRegex(ParseError, 'line 16'):
+            index.read(3)
+
+    it 'divides the instances into shards':
+        shards = [self.index.shard(shard, 3) for shard in range(3)]
+        self.assertEqual(sorted(i for shard in shards for i in shard),
+                         list(range(20)))
+        self.assertEqual(list(self.index.iter_shard(1, 3)),
+                         [self.instances[i] for i in shards[1]])
+
+    it 'puts instances with the same shape in the same shard':
+        self.path.write_text('foo\nf o o\nA B C\n\nfoo\nfo o\nA B\n')
+        index = InstanceIndex.build(self.path)
+        self.assertEqual(index.keys[0], index.keys[1])
+
+    it 'refuses compressed files':
+        with self.assertRaises(ParseError):
+            InstanceIndex.build('tests/test_data/resources/instances.txt.gz')
+
+    it 'refuses compiled corpora':
+        path = Path('TEST_CORPUS.spielcor')
+        Corpus.from_instances(self.instances).save(path)
+        with self.assertRaisesRegex(ParseError, 'Compiled corpora'):
+            InstanceIndex.build(path)
+
+    it 'refuses archives, whatever they are named':
+        path = Path('TEST_ARCHIVE.txt')
+        with tarfile.open(path, 'w') as archive:
+            archive.add(self.path)
+        with self.assertRaisesRegex(ParseError, 'Archives'):
+            InstanceIndex.build(path)
+
+    describe 'open':
+        it 'keeps the index beside the file':
+            index = InstanceIndex.open(self.path)
+            self.assertTrue(Path('TEST_INSTANCES.txt.idx').exists())
+            self.assertEqual(list(InstanceIndex.open(self.path).starts),
+                             list(index.starts))
+
+        it 'rebuilds the index when the file changes':
+            InstanceIndex.open(self.path)
+            self.path.write_text('\n'.join(self.blocks[:5]))
+            self.assertEqual(len(InstanceIndex.open(self.path)), 5)
+
+
+describe 'Corpus':
+    before_each:
+        self.lines = ['foo', 'f o o', 'B A R', '', 'baz', '', 'ba', 'b a',
+                      'A B']
+        self.instances = load(self.lines, strict=False)
+        self.corpus = Corpus.from_instances(self.instances)
+
+    it 'holds every instance':
+        self.assertEqual(len(self.corpus), 3)
+        self.assertEqual(list(self.corpus), self.instances)
+
+    it 'gives back views of its instances':
+        view = self.corpus[2]
+        self.assertIsInstance(view, InstanceView)
+        self.assertEqual(view.shape, 'ba')
+        self.assertEqual(view.tokens, ['b', 'a'])
+        self.assertEqual(view.annotations, [('b', 'A'), ('a', 'B')])
+        self.assertEqual(view.annotation_string(), 'b/A-a/B')
+
+    it 'counts back from the end for negative indices':
+        self.assertEqual(self.corpus[-1].shape, 'ba')
+
+    it 'raises an error for indices past the end':
+        with self.assertRaises(IndexError):
+            self.corpus[3]
+
+    it 'has no segments or labels for instances that are only shapes':
+        self.assertIsNone(self.corpus[1].segments)
+        self.assertIsNone(self.corpus[1].labels)
+        self.assertEqual(list(self.corpus.annotated_indices()), [0, 2])
+
+    it 'stores its instances in flat arrays':
+        self.assertEqual(list(self.corpus.token_offsets), [0, 3, 6, 8])
+        self.assertEqual(list(self.corpus.segment_offsets), [0, 3, 3, 5])
+        self.assertEqual(len(self.corpus.token_ids), 8)
+        self.assertEqual(len(self.corpus.label_ids), 5)
+
+    it 'shares strings between instances':
+        self.assertEqual(len(self.corpus.segment_table), 4)
+        self.assertEqual(len(self.corpus.label_table), 3)
+
+    it 'keeps the tokens that instances were loaded with':
+        corpus = Corpus.load(['fo·o', 'f o·o', 'B A'],
+                             tokenize=lambda x: re.findall(r'.[·]*', x))
+        self.assertEqual(corpus[0].tokens, ['f', 'o·', 'o'])
+        self.assertEqual(corpus[0].shape, 'fo·o')
+
+    it 'can be loaded from a file':
+        corpus = Corpus.load('tests/test_data/resources/instances.txt')
+        self.assertEqual(list(corpus),
+                         load_file('tests/test_data/resources/instances.txt'))
+
+    describe 'save':
+        before_each:
+            self.path = Path('TEST_CORPUS.bin')
+            self.corpus.save(self.path)
+
+        after_each:
+            delete_file(self.path)
+
+        it 'writes a compiled corpus':
+            self.assertTrue(is_compiled(self.path))
+            self.assertFalse(is_compiled('tests/test_data/resources/instances.txt'))
+
+        it 'can be opened again':
+            corpus = Corpus.load_compiled(self.path)
+            self.assertEqual(list(corpus), self.instances)
+            self.assertEqual(list(corpus.segment_offsets),
+                             list(self.corpus.segment_offsets))
+
+        it 'can be opened by the other loaders':
+            self.assertEqual(list(load_file(self.path)), self.instances)
+            self.assertEqual(list(iter_instances(self.path)), self.instances)
+            self.assertEqual(list(Corpus.load(self.path)), self.instances)
+
+        it 'handles empty corpora':
+            Corpus.from_instances([]).save(self.path)
+            self.assertEqual(len(Corpus.load_compiled(self.path)), 0)
+
+        it 'refuses files that are not compiled corpora':
+            with self.assertRaises(ParseError):
+                Corpus.load_compiled('tests/test_data/resources/instances.txt')
+
+
+def delete_file(path):
+    if path.exists():
+        path.unlink()
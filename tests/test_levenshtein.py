@@ -1,29 +1,178 @@
 # coding: spec
+from functools import partial
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
 from spiel import levenshtein
-from spiel.levenshtein import DeleteOperation, InsertOperation, ReplaceOperation
+from spiel.levenshtein import (
+    AlignmentCache,
+    AnnotatedLabel,
+    DeleteOperation,
+    Directive,
+    EditScript,
+    InsertOperation,
+    ReplaceOperation
+)
+from spiel.vocab import Tokenizer
 
 
 describe 'distance':
+    before_each:
+        self.distance = levenshtein.distance
+
     it 'returns 0 for identical strings':
-        distance = levenshtein.distance('foo', 'foo')
+        distance = self.distance('foo', 'foo')
         self.assertEqual(distance, 0)
 
     it 'returns 1 for strings with one substitution':
-        distance = levenshtein.distance('bar', 'baz')
+        distance = self.distance('bar', 'baz')
         self.assertEqual(distance, 1)
 
     it 'returns 1 for strings with one deletion':
-        distance = levenshtein.distance('foo', 'fo')
+        distance = self.distance('foo', 'fo')
         self.assertEqual(distance, 1)
 
     it 'returns 1 for strings with one insertion':
-        distance = levenshtein.distance('fo', 'foo')
+        distance = self.distance('fo', 'foo')
         self.assertEqual(distance, 1)
 
     it 'returns 3 for strings with exactly one substitution, deletion, and insertion':
-        distance = levenshtein.distance('banana', 'faanaa')
+        distance = self.distance('banana', 'faanaa')
         self.assertEqual(distance, 3)
 
+    it 'compares lists of tokens as whole tokens':
+        distance = self.distance(['k', 'i·', 'w'], ['k', 'i', 'w'])
+        self.assertEqual(distance, 1)
+
+    it 'handles empty iterables':
+        self.assertEqual(self.distance('', 'foo'), 3)
+        self.assertEqual(self.distance('foo', ''), 3)
+
+    it 'rejects unknown backends':
+        with self.assertRaises(ValueError):
+            self.distance('foo', 'bar', backend='foo')
+
+    context 'with the matrix backend':
+        before_each:
+            self.distance = partial(levenshtein.distance, backend='matrix')
+
+    context 'with the bit-parallel backend':
+        before_each:
+            self.distance = partial(levenshtein.distance,
+                                    backend='bit_parallel')
+
+        it 'falls back to the matrix for long iterables':
+            origin = 'ab' * 40
+            target = 'ba' * 40
+            self.assertEqual(self.distance(origin, target),
+                             levenshtein.distance(origin, target,
+                                                  backend='matrix'))
+
+        it 'uses the banded computation for long iterables with a maximum':
+            origin = 'ab' * 40
+            with mock.patch.object(levenshtein, '__build_matrix',
+                                   side_effect=AssertionError):
+                self.assertEqual(self.distance(origin, 'ba' * 40,
+                                               max_distance=1), 2)
+                self.assertEqual(self.distance(origin, origin + 'c',
+                                               max_distance=2), 1)
+
+    context 'with a maximum distance':
+        it 'returns the distance if it is within the maximum':
+            distance = self.distance('banana', 'faanaa', max_distance=3)
+            self.assertEqual(distance, 3)
+
+        it 'returns one more than the maximum if the distance is greater':
+            distance = self.distance('banana', 'faanaa', max_distance=2)
+            self.assertEqual(distance, 3)
+            distance = self.distance('banana', 'f', max_distance=1)
+            self.assertEqual(distance, 2)
+
+        it 'ignores common prefixes and suffixes':
+            distance = self.distance('prefixAsuffix', 'prefixBsuffix',
+                                     max_distance=1)
+            self.assertEqual(distance, 1)
+
+        it 'returns 0 for identical strings':
+            distance = self.distance('foo', 'foo', max_distance=0)
+            self.assertEqual(distance, 0)
+
+        it 'compares lists of tokens as whole tokens':
+            distance = self.distance(['k', 'i·', 'w'], ['k', 'i', 'w'],
+                                     max_distance=1)
+            self.assertEqual(distance, 1)
+
+        it 'handles iterables that are too long for the bit-parallel backend':
+            origin = 'ab' * 40
+            self.assertEqual(self.distance(origin, origin + 'c',
+                                           max_distance=2), 1)
+            self.assertEqual(self.distance(origin, 'ba' * 40,
+                                           max_distance=1), 2)
+
+
+describe 'arrays of token ids':
+    before_each:
+        self.tokenizer = Tokenizer(r'.[·]*')
+
+    it 'finds the same distances as the tokens':
+        for origin, target in [('ki·w', 'kiw'), ('banana', 'faanaa'),
+                               ('', 'foo'), ('ab' * 40, 'ba' * 40)]:
+            self.assertEqual(
+                levenshtein.distance(self.tokenizer.encode(origin),
+                                     self.tokenizer.encode(target)),
+                levenshtein.distance(self.tokenizer(origin),
+                                     self.tokenizer(target)))
+
+    it 'finds the same operations as the tokens':
+        origin, target = 'ki·wa', 'kiwaa'
+        self.assertEqual(
+            list(levenshtein.operations(self.tokenizer.encode(origin),
+                                        self.tokenizer.encode(target))),
+            list(levenshtein.operations(self.tokenizer(origin),
+                                        self.tokenizer(target))))
+
+    it 'finds the same distances in batches':
+        words = ['ki·w', 'kiw', 'banana', 'faanaa', '']
+        encoded = [self.tokenizer.encode(word) for word in words]
+        distances = levenshtein.pairwise_distances(encoded)
+        expected = levenshtein.pairwise_distances(
+            [self.tokenizer(word) for word in words])
+        self.assertTrue((distances == expected).all())
+
+
+describe 'distance_many':
+    it 'returns a matrix of distances from each origin to each target':
+        distances = levenshtein.distance_many(['foo', 'ba'], ['foo', 'bar', ''])
+        self.assertIsInstance(distances, np.ndarray)
+        self.assertEqual(distances.tolist(), [[0, 3, 3], [3, 1, 2]])
+
+    it 'matches the distance of each individual pair':
+        origins = ['banana', 'fo', '', 'abcde']
+        targets = ['faanaa', 'foo', 'fcdeg', 'b']
+        distances = levenshtein.distance_many(origins, targets)
+        for i, origin in enumerate(origins):
+            for j, target in enumerate(targets):
+                self.assertEqual(distances[i, j],
+                                 levenshtein.distance(origin, target))
+
+    it 'accepts lists of tokens':
+        distances = levenshtein.distance_many([['k', 'i·']], [['k', 'i']])
+        self.assertEqual(distances.tolist(), [[1]])
+
+    it 'can spread the work over multiple processes':
+        words = ['foo', 'bar', 'baz', 'banana']
+        distances = levenshtein.distance_many(words, words, n_jobs=2)
+        self.assertEqual(distances.tolist(),
+                         levenshtein.distance_many(words, words).tolist())
+
+
+describe 'pairwise_distances':
+    it 'returns a symmetric matrix of distances':
+        distances = levenshtein.pairwise_distances(['foo', 'fo', 'bar'])
+        self.assertEqual(distances.tolist(), [[0, 1, 3], [1, 0, 3], [3, 3, 0]])
+
 
 describe 'operations':
     it 'returns an empty generator for identical strings':
@@ -50,6 +199,71 @@ describe 'operations':
             ReplaceOperation(0, 0)
         ])
 
+    it 'inserts at position -1 when the target has extra leading elements':
+        operations = levenshtein.operations('a', 'ba')
+        self.assertEqual(list(operations), [InsertOperation(-1, 0)])
+
+    it 'deletes when the origin has extra leading elements':
+        operations = levenshtein.operations('bb', 'b')
+        self.assertEqual(list(operations), [DeleteOperation(0)])
+
+    context 'in linear space':
+        it 'returns the same operations as the full matrix':
+            pairs = [('abcde', 'fcdeg'), ('banana', 'faanaa'), ('', 'foo'),
+                     ('foo', ''), ('abbc', 'acccbabbb'), ('foo', 'foo')]
+            for origin, target in pairs:
+                self.assertEqual(
+                    list(levenshtein.operations(origin, target,
+                                                linear_space=True)),
+                    list(levenshtein.operations(origin, target,
+                                                linear_space=False)))
+
+        it 'returns the same operations as the full matrix for long iterables':
+            origin = 'abcab' * 40
+            target = 'bacca' * 30
+            self.assertEqual(
+                list(levenshtein.operations(origin, target,
+                                            linear_space=True)),
+                list(levenshtein.operations(origin, target,
+                                            linear_space=False)))
+
+
+describe 'operations_many':
+    it 'returns an EditScript for each pair':
+        scripts = levenshtein.operations_many([('abcde', 'fcdeg'),
+                                               ('foo', 'foo')])
+        self.assertEqual(len(scripts), 2)
+        self.assertIsInstance(scripts[0], EditScript)
+        self.assertEqual(list(scripts[0]), [
+            InsertOperation(4, 4),
+            DeleteOperation(1),
+            ReplaceOperation(0, 0)
+        ])
+        self.assertEqual(list(scripts[1]), [])
+
+    it 'returns the same operations as operations() for each pair':
+        pairs = [('abcde', 'fcdeg'), ('banana', 'faanaa'), ('', 'foo'),
+                 ('foo', ''), ('abbc', 'acccbabbb'), ('a', 'ba'), ('bb', 'b'),
+                 (['k', 'i·'], ['k', 'i'])]
+        scripts = levenshtein.operations_many(pairs)
+        for (origin, target), script in zip(pairs, scripts):
+            self.assertEqual(list(script),
+                             list(levenshtein.operations(origin, target)))
+
+    it 'returns nothing for no pairs':
+        self.assertEqual(levenshtein.operations_many([]), [])
+
+
+describe 'edit_script':
+    it 'returns the operations as an EditScript':
+        script = levenshtein.edit_script('abcde', 'fcdeg')
+        self.assertIsInstance(script, EditScript)
+        self.assertEqual(list(script), [
+            InsertOperation(4, 4),
+            DeleteOperation(1),
+            ReplaceOperation(0, 0)
+        ])
+
 
 describe 'apply_operations':
     it 'does nothing if there are no operations':
@@ -78,6 +292,27 @@ describe 'apply_operations':
         output = levenshtein.apply_operations(['f', 'o', 'o'], 'bar', operations)
         self.assertEqual(output, ['b', 'o', 'o', 'a'])
 
+    it 'puts later insertions at the same index closer to the original element':
+        operations = [
+            InsertOperation(0, 0),
+            InsertOperation(0, 1)
+        ]
+        output = levenshtein.apply_operations('foo', 'bar', operations)
+        self.assertEqual(output, 'faboo')
+
+    it 'counts negative positions back from the end':
+        operations = [InsertOperation(-1, 0)]
+        output = levenshtein.apply_operations('foo', 'bar', operations)
+        self.assertEqual(output, 'foob')
+
+    it 'accepts an EditScript':
+        operations = EditScript.from_operations([
+            InsertOperation(2, 1),
+            ReplaceOperation(0, 0)
+        ])
+        output = levenshtein.apply_operations('foo', 'bar', operations)
+        self.assertEqual(output, 'booa')
+
     it 'applies multiple operations on the same index':
         operations = [
             InsertOperation(1, 0),
@@ -112,6 +347,15 @@ describe 'annotate':
         annotation = levenshtein.annotate('foo', 'bar', operations)
         self.assertEqual(annotation, ['f+R(f,b)', 'o+I(r)+D(o)'])
 
+    it 'accepts an EditScript':
+        operations = EditScript.from_operations([
+            ReplaceOperation(0, 0),
+            InsertOperation(1, 2),
+            DeleteOperation(2)
+        ])
+        annotation = levenshtein.annotate('foo', 'bar', operations)
+        self.assertEqual(annotation, ['f+R(f,b)', 'o+I(r)+D(o)'])
+
     it 'can use an alternate list as a starting point':
         operations = [
             ReplaceOperation(0, 0),
@@ -122,6 +366,51 @@ describe 'annotate':
         annotation = levenshtein.annotate('foo', 'bar', operations, annotation)
         self.assertEqual(annotation, ['b+R(f,b)', 'a+I(r)+D(o)'])
 
+    it 'keeps only the first of consecutive deletions':
+        operations = [DeleteOperation(2), DeleteOperation(1)]
+        annotation = levenshtein.annotate('foo', 'f', operations)
+        self.assertEqual(annotation, ['f+D(o)'])
+
+    it 'can give back structured labels':
+        operations = [
+            ReplaceOperation(0, 0),
+            InsertOperation(1, 2),
+            DeleteOperation(2)
+        ]
+        annotation = levenshtein.annotate('foo', 'bar', operations,
+                                          structured=True)
+        self.assertEqual(annotation, [
+            AnnotatedLabel('f', [Directive('R', ('f', 'b'))]),
+            AnnotatedLabel('o', [Directive('I', ('r',)),
+                                 Directive('D', ('o',))])
+        ])
+
+
+describe 'AnnotatedLabel':
+    it 'has no directives by default':
+        self.assertEqual(AnnotatedLabel('f').directives, ())
+
+    it 'renders its directives after its base':
+        label = AnnotatedLabel('f', [Directive('R', ('f', 'b')),
+                                     Directive('I', ('r',))])
+        self.assertEqual(str(label), 'f+R(f,b)+I(r)')
+
+    it 'can be parsed from its rendered form':
+        for label in ['f', 'f+R(f,b)+I(r)', '+D(a)+I(f)']:
+            self.assertEqual(str(AnnotatedLabel.parse(label)), label)
+
+    it 'knows when its element was deleted':
+        self.assertTrue(AnnotatedLabel('', [Directive('D', ('a',))])
+                        .is_deleted())
+        self.assertFalse(AnnotatedLabel('f', [Directive('D', ('a',))])
+                         .is_deleted())
+
+    it 'counts its directives of one kind':
+        label = AnnotatedLabel('f', [Directive('I', ('r',)),
+                                     Directive('R', ('f', 'b')),
+                                     Directive('I', ('s',))])
+        self.assertEqual(label.num_directives('I'), 2)
+
 
 describe 'ReplaceOperation':
     describe 'apply':
@@ -199,6 +488,104 @@ describe 'DeleteOperation':
             operation.annotate(annotation, 'bar', 'foo')
             self.assertEqual(annotation, ['b', '+D(a)+I(f)', 'r'])
 
+        it 'annotates structured annotations':
+            operation = DeleteOperation(1)
+            annotation = [AnnotatedLabel(token) for token in 'bar']
+            operation.annotate(annotation, 'bar', 'foo')
+            self.assertEqual(annotation[1],
+                             AnnotatedLabel('', [Directive('D', ('a',))]))
+
     it 'can be represented':
         operation = DeleteOperation(3)
         self.assertEqual(str(operation), 'Delete at position 3')
+
+
+describe 'EditScript':
+    before_each:
+        self.operations = [
+            InsertOperation(4, 4),
+            DeleteOperation(1),
+            ReplaceOperation(0, 0)
+        ]
+        self.script = EditScript.from_operations(self.operations)
+
+    it 'stores three integers per operation':
+        self.assertEqual(len(self.script), 3)
+        self.assertEqual(self.script.as_array().tolist(),
+                         [[1, 4, 4], [2, 1, -1], [0, 0, 0]])
+
+    it 'can be viewed as operations':
+        self.assertEqual(list(self.script), self.operations)
+        self.assertEqual(self.script[1], DeleteOperation(1))
+        self.assertEqual(self.script[-1], ReplaceOperation(0, 0))
+
+    it 'raises an error for an index that is out of range':
+        with self.assertRaises(IndexError):
+            self.script[3]
+
+    it 'equals another script or list with the same operations':
+        self.assertEqual(self.script, EditScript.from_operations(self.operations))
+        self.assertEqual(self.script, self.operations)
+        self.assertNotEqual(self.script, EditScript())
+
+    it 'does not equal values that are not sequences':
+        self.assertNotEqual(self.script, None)
+        self.assertFalse(self.script == 3)
+
+
+describe 'AlignmentCache':
+    describe 'operations':
+        it 'returns the same operations as levenshtein.operations':
+            cache = AlignmentCache()
+            self.assertEqual(cache.operations('abcde', 'fcdeg'),
+                             list(levenshtein.operations('abcde', 'fcdeg')))
+
+        it 'only aligns each pair once':
+            cache = AlignmentCache()
+            first = cache.operations(['f', 'o', 'o'], 'fo')
+            second = cache.operations('foo', ['f', 'o'])
+            self.assertIs(first, second)
+            self.assertEqual(len(cache), 1)
+
+    describe 'operations_many':
+        it 'returns the same operations as levenshtein.operations':
+            cache = AlignmentCache()
+            scripts = cache.operations_many([('abcde', 'fcdeg'), ('ba', 'bar')])
+            self.assertEqual(scripts, [
+                list(levenshtein.operations('abcde', 'fcdeg')),
+                list(levenshtein.operations('ba', 'bar'))
+            ])
+
+        it 'only aligns each pair once':
+            cache = AlignmentCache()
+            first = cache.operations('foo', 'fo')
+            scripts = cache.operations_many([('foo', 'fo'), ('ba', 'bar'),
+                                             ('ba', 'bar')])
+            self.assertIs(scripts[0], first)
+            self.assertIs(scripts[1], scripts[2])
+            self.assertEqual(len(cache), 2)
+
+    describe 'save':
+        before_each:
+            self.path = Path('TEST_ALIGNMENT_CACHE.pickle')
+
+        after_each:
+            delete_file(self.path)
+
+        it 'saves itself to disk':
+            cache = AlignmentCache()
+            cache.operations('bar', 'baz')
+            cache.save(self.path)
+            self.assertTrue(self.path.exists())
+
+        it 'can be loaded again':
+            cache = AlignmentCache()
+            cache.operations('bar', 'baz')
+            cache.save(self.path)
+            loaded = AlignmentCache.load(self.path)
+            self.assertEqual(loaded.alignments, cache.alignments)
+
+
+def delete_file(path):
+    if path.exists():
+        path.unlink()
@@ -0,0 +1,139 @@
+# coding: spec
+import re
+from pathlib import Path
+
+from spiel.data import Instance
+from spiel.levenshtein import distance
+from spiel.lexicon import BKTree, Trie
+
+
+describe 'BKTree':
+    before_each:
+        self.words = ['foo', 'fob', 'bar', 'baz', 'banana', 'bandana', 'fo']
+        self.tree = BKTree.build(self.words)
+
+    it 'holds one node per distinct word':
+        self.tree.add('foo')
+        self.assertEqual(len(self.tree), len(self.words))
+
+    describe 'query':
+        it 'finds the words within a distance, closest first':
+            matches = self.tree.query('foo', 1)
+            self.assertEqual(matches, [(0, 'foo'), (1, 'fob'), (1, 'fo')])
+
+        it 'matches a brute force search':
+            for word in ['fa', 'banan', 'xyz', '']:
+                for max_distance in range(4):
+                    expected = [other for other in self.words
+                                if distance(word, other) <= max_distance]
+                    matches = self.tree.query(word, max_distance)
+                    self.assertCountEqual([value for _, value in matches],
+                                          expected)
+
+        it 'returns nothing for an empty tree':
+            self.assertEqual(BKTree().query('foo', 2), [])
+
+        it 'returns every value stored for a word':
+            tree = BKTree()
+            tree.add('foo', 'first')
+            tree.add('foo', 'second')
+            self.assertEqual(tree.query('fo', 1), [(1, 'first'), (1, 'second')])
+
+        it 'uses a tokenize function to separate tokens':
+            tree = BKTree.build(['f&o', 'fo'],
+                                tokenize=lambda x: re.findall('.&?', x))
+            self.assertEqual(tree.query('fo', 1), [(0, 'fo'), (1, 'f&o')])
+
+    describe 'nearest':
+        it 'finds the k closest words':
+            matches = self.tree.nearest('bandanna', 2)
+            self.assertEqual(matches, [(1, 'bandana'), (2, 'banana')])
+
+        it 'finds the closest word':
+            self.assertEqual(self.tree.nearest('bax'), [(1, 'bar')])
+
+        it 'returns everything if k is larger than the tree':
+            self.assertEqual(len(self.tree.nearest('foo', 20)), len(self.words))
+
+    describe 'from_instances':
+        it 'looks up instances by their shapes':
+            instance = Instance('foo', ['f', 'oo'], ['A', 'B'])
+            tree = BKTree.from_instances([instance])
+            self.assertEqual(tree.nearest('fo'), [(1, instance)])
+
+    describe 'save':
+        before_each:
+            self.path = Path('TEST_BK_TREE.pickle')
+
+        after_each:
+            delete_file(self.path)
+
+        it 'can be saved and loaded again':
+            self.tree.save(self.path)
+            loaded = BKTree.load(self.path)
+            self.assertEqual(loaded.query('foo', 1), self.tree.query('foo', 1))
+
+
+
+describe 'Trie':
+    before_each:
+        self.words = ['foo', 'fob', 'bar', 'baz', 'banana', 'bandana', 'fo']
+        self.trie = Trie.build(self.words)
+
+    it 'counts every word added':
+        self.trie.add('foo')
+        self.assertEqual(len(self.trie), len(self.words) + 1)
+
+    it 'knows which words it contains':
+        self.assertIn('fob', self.trie)
+        self.assertNotIn('fox', self.trie)
+
+    describe 'search':
+        it 'finds the words within a distance, closest first':
+            matches = self.trie.search('foo', 1)
+            self.assertEqual(matches, [(0, 'foo'), (1, 'fob'), (1, 'fo')])
+
+        it 'matches a brute force search':
+            for word in ['fa', 'banan', 'xyz', '']:
+                for max_distance in range(4):
+                    expected = [(distance(word, other), other)
+                                for other in self.words
+                                if distance(word, other) <= max_distance]
+                    matches = self.trie.search(word, max_distance)
+                    self.assertEqual(matches, sorted(expected,
+                                                     key=lambda x: x[0]))
+
+        it 'returns nothing for an empty trie':
+            self.assertEqual(Trie().search('foo', 2), [])
+
+        it 'finds the empty word':
+            trie = Trie.build(['', 'f'])
+            self.assertEqual(trie.search('', 1), [(0, ''), (1, 'f')])
+
+        it 'uses a tokenize function to separate tokens':
+            trie = Trie.build(['f&o', 'fo'],
+                              tokenize=lambda x: re.findall('.&?', x))
+            self.assertEqual(trie.search('fo', 1), [(0, 'fo'), (1, 'f&o')])
+
+        it 'does not use the tokenize function on lists':
+            trie = Trie.build([['f&', 'o']],
+                              tokenize=lambda x: re.findall('.&?', x))
+            self.assertEqual(trie.search(['f', '&', 'o'], 1), [])
+            self.assertEqual(trie.search('f&o', 0), [(0, ['f&', 'o'])])
+
+    describe 'from_instances':
+        it 'looks up instances by their shapes':
+            instance = Instance('foo', ['f', 'oo'], ['A', 'B'])
+            trie = Trie.from_instances([instance])
+            self.assertEqual(trie.search('fo', 1), [(1, instance)])
+
+        it 'can look up segments as well':
+            instance = Instance('foo', ['f', 'oo'], ['A', 'B'])
+            trie = Trie.from_instances([instance], segments=True)
+            self.assertEqual(trie.search('o', 1),
+                             [(1, ('f', 'A')), (1, ('oo', 'B'))])
+
+
+def delete_file(path):
+    if path.exists():
+        path.unlink()
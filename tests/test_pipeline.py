@@ -0,0 +1,166 @@
+# coding: spec
+import json
+import os
+import shutil
+
+from spiel.pipeline import ModelError, Pipeline, segment_parallel
+from spiel.segmentation import ConstraintSegmenter, Featurizer
+from spiel.vocab import Tokenizer
+
+
+class DummySegmenter:
+    def segment(self, shape):
+        return [shape[:1], shape[1:]]
+
+
+class DummyLabeller:
+    def __init__(self):
+        self.batches = []
+
+    def label_many(self, sequences):
+        self.batches.append(len(sequences))
+        return [['A', 'B'][:len(sequence)] for sequence in sequences]
+
+
+describe 'Pipeline':
+    before_each:
+        self.labeller = DummyLabeller()
+        self.pipeline = Pipeline(DummySegmenter(), self.labeller)
+
+    it 'segments and labels a shape':
+        self.assertEqual(self.pipeline.annotate('foo'),
+                         [('f', 'A'), ('oo', 'B')])
+
+    it 'labels the segments of many shapes at once':
+        annotations = self.pipeline.annotate_many(['foo', 'ba'])
+        self.assertEqual(annotations, [[('f', 'A'), ('oo', 'B')],
+                                       [('b', 'A'), ('a', 'B')]])
+        self.assertEqual(self.labeller.batches, [2])
+
+    it 'does not segment empty shapes':
+        self.assertEqual(self.pipeline.annotate(''), [])
+
+    describe 'stream':
+        it 'annotates shapes in batches':
+            results = list(self.pipeline.stream(['foo', 'ba', 'baz'], 2))
+            self.assertEqual([shape for shape, _ in results],
+                             ['foo', 'ba', 'baz'])
+            self.assertEqual(self.labeller.batches, [2, 1])
+
+        it 'only reads as far as the current batch':
+            def shapes():
+                yield from ['foo', 'ba']
+                raise AssertionError('read too far')
+
+            results = self.pipeline.stream(shapes(), 2)
+            self.assertEqual(next(results), ('foo', [('f', 'A'), ('oo', 'B')]))
+
+    describe 'without_alignment_cache':
+        before_each:
+            segmenter = ConstraintSegmenter(
+                featurizer=Featurizer(tokenize=Tokenizer()))
+            segmenter.train(['foo', 'ba'], [[('f', 'A'), ('oo', 'B')],
+                                            [('b', 'A'), ('a', 'B')]])
+            self.pipeline = Pipeline(segmenter, self.labeller)
+
+        it 'gives back a copy with an empty alignment cache':
+            copy = self.pipeline.without_alignment_cache()
+            self.assertEqual(len(copy.segmenter.featurizer.alignment_cache),
+                             0)
+            self.assertEqual(copy.annotate('fooba'),
+                             self.pipeline.annotate('fooba'))
+
+        it 'leaves the original alignment cache alone':
+            self.pipeline.without_alignment_cache()
+            self.assertEqual(
+                len(self.pipeline.segmenter.featurizer.alignment_cache), 2)
+
+        it 'is what save writes':
+            self.pipeline.save('TEST_PIPELINE.pkl')
+            try:
+                pipeline = Pipeline.load('TEST_PIPELINE.pkl')
+            finally:
+                os.remove('TEST_PIPELINE.pkl')
+            featurizer = pipeline.segmenter.featurizer
+            self.assertEqual(len(featurizer.alignment_cache), 0)
+            self.assertEqual(pipeline.annotate('fooba'),
+                             self.pipeline.annotate('fooba'))
+
+    describe 'save':
+        after_each:
+            os.remove('TEST_PIPELINE.pkl')
+
+        it 'can be loaded again':
+            self.pipeline.save('TEST_PIPELINE.pkl')
+            pipeline = Pipeline.load('TEST_PIPELINE.pkl')
+            self.assertEqual(pipeline.annotate('foo'),
+                             [('f', 'A'), ('oo', 'B')])
+
+    describe 'save_model':
+        before_each:
+            featurizer = Featurizer(mode='basic', tokenize=Tokenizer(),
+                                    sparse=True)
+            segmenter = ConstraintSegmenter(featurizer=featurizer)
+            segmenter.train(['foo', 'ba'], [[('f', 'A'), ('oo', 'B')],
+                                            [('b', 'A'), ('a', 'B')]])
+            self.pipeline = Pipeline(segmenter, self.labeller)
+            self.pipeline.save_model('TEST_MODEL')
+
+        after_each:
+            shutil.rmtree('TEST_MODEL', ignore_errors=True)
+
+        it 'can be loaded again':
+            pipeline = Pipeline.load_model('TEST_MODEL')
+            self.assertEqual(pipeline.annotate('fooba'),
+                             self.pipeline.annotate('fooba'))
+            self.assertTrue(pipeline.segmenter.featurizer.sparse)
+            self.assertEqual(pipeline.metadata['featurizer']['mode'], 'basic')
+
+        it 'can be loaded by load':
+            self.assertEqual(Pipeline.load('TEST_MODEL').annotate('fooba'),
+                             self.pipeline.annotate('fooba'))
+
+        it 'leaves out the alignment cache':
+            pipeline = Pipeline.load_model('TEST_MODEL')
+            self.assertEqual(len(pipeline.segmenter.featurizer.alignment_cache),
+                             0)
+
+        it 'refuses models saved by newer versions':
+            with open('TEST_MODEL/metadata.json') as metadata_file:
+                metadata = json.load(metadata_file)
+            metadata['format_version'] += 1
+            with open('TEST_MODEL/metadata.json', 'w') as metadata_file:
+                json.dump(metadata, metadata_file)
+            with self.assertRaises(ModelError):
+                Pipeline.load_model('TEST_MODEL')
+
+        it 'refuses directories that are not models':
+            with self.assertRaises(ModelError):
+                Pipeline.load_model('tests')
+
+        it 'refuses tokenizers that cannot be saved':
+            self.pipeline.segmenter.featurizer.tokenize = lambda x: list(x)
+            with self.assertRaises(ModelError):
+                self.pipeline.save_model('TEST_MODEL')
+
+
+describe 'segment_parallel':
+    before_each:
+        self.pipeline = Pipeline(DummySegmenter(), DummyLabeller())
+        self.shapes = [f'shape{i}' for i in range(7)]
+
+    it 'gives the same results as the pipeline, in order':
+        results = segment_parallel(self.pipeline, iter(self.shapes),
+                                   n_jobs=2, batch_size=2)
+        self.assertEqual(list(results),
+                         list(self.pipeline.stream(self.shapes)))
+
+    it 'loads the pipeline in each worker from a file':
+        self.pipeline.save('TEST_PIPELINE.pkl')
+        try:
+            results = segment_parallel('TEST_PIPELINE.pkl', self.shapes,
+                                       n_jobs=2)
+            self.assertEqual(list(results),
+                             list(self.pipeline.stream(self.shapes)))
+        finally:
+            os.remove('TEST_PIPELINE.pkl')
@@ -2,7 +2,25 @@
 from sklearn.feature_extraction import DictVectorizer
 from sklearn.naive_bayes import MultinomialNB
 from sklearn.pipeline import Pipeline
-from spiel.segmentation.classification import SKLearnNaiveBayesClassifier
+from scipy.sparse import csr_matrix
+from spiel.segmentation import Featurizer
+from spiel.segmentation.classification import (
+    ClassifierAdaptor,
+    SKLearnNaiveBayesClassifier
+)
+
+
+class DictClassifier(ClassifierAdaptor):
+    def __init__(self, data):
+        self.data = data
+
+    @staticmethod
+    def train(data):
+        return DictClassifier(data)
+
+    def prob_classify(self, features):
+        return [(label, 1.0) for row, label in self.data if row == features]
+
 
 describe 'SKLearnNaiveBayesClassifier':
     describe 'train':
@@ -24,3 +42,45 @@ describe 'SKLearnNaiveBayesClassifier':
             for result in results:
                 self.assertIsInstance(result[0], str)
                 self.assertIsInstance(result[1], float)
+
+    describe 'train_matrix':
+        it 'creates a classifier containing only a NB classifier':
+            featurizer = Featurizer(sparse=True)
+            featurizer.fit_vocabulary(['f'])
+            matrix = featurizer.convert_matrix(['f'])
+            labels = ['_-_-FOO', '_-FOO-_', 'FOO-_-_']
+            classifier = SKLearnNaiveBayesClassifier.train_matrix(matrix,
+                                                                  labels)
+            steps = classifier.pipeline.steps
+
+            self.assertEqual(len(steps), 1)
+            self.assertIsInstance(steps[0][1], MultinomialNB)
+
+    describe 'prob_classify_matrix':
+        it 'returns a list of label/probability pairs for each row':
+            featurizer = Featurizer(sparse=True)
+            featurizer.fit_vocabulary(['f'])
+            matrix = featurizer.convert_matrix(['f'])
+            labels = ['_-_-FOO', '_-FOO-_', 'FOO-_-_']
+            classifier = SKLearnNaiveBayesClassifier.train_matrix(matrix,
+                                                                  labels)
+            results = classifier.prob_classify_matrix(matrix)
+
+            self.assertEqual(len(results), 3)
+            for row, label in zip(results, labels):
+                self.assertEqual(max(row, key=lambda x: x[1])[0], label)
+
+
+describe 'ClassifierAdaptor':
+    before_each:
+        self.matrix = csr_matrix([[0, 2, 0], [1, 0, 0], [0, 0, 0]])
+
+    it 'trains on the stored entries of each row of a matrix by default':
+        classifier = DictClassifier.train_matrix(self.matrix, ['A', 'B', 'C'])
+        self.assertEqual(classifier.data, [({'1': 2}, 'A'), ({'0': 1}, 'B'),
+                                           ({}, 'C')])
+
+    it 'classifies each row of a matrix by default':
+        classifier = DictClassifier.train_matrix(self.matrix, ['A', 'B', 'C'])
+        self.assertEqual(classifier.prob_classify_matrix(self.matrix),
+                         [[('A', 1.0)], [('B', 1.0)], [('C', 1.0)]])
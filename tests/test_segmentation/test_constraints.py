@@ -1,13 +1,19 @@
 # coding: spec
 import re
+from spiel.data import Corpus, Instance
 from spiel.segmentation import ConstraintSegmenter, Featurizer
+from spiel.segmentation.features import FeaturizationException
 from spiel.segmentation.constraints import (
     Constraint,
     SegmentationException,
     generate_constraints,
     generate_options
 )
-from spiel.segmentation.classification import ClassifierAdaptor
+from spiel.vocab import Tokenizer
+from spiel.segmentation.classification import (
+    ClassifierAdaptor,
+    SKLearnNaiveBayesClassifier
+)
 
 
 class DummyClassifier(ClassifierAdaptor):
@@ -83,6 +89,36 @@ describe 'ConstraintSegmenter':
             ]
             self.assertEqual(self.segmenter.classifier.instances, instances)
 
+        it 'trains on the annotated instances of a corpus':
+            corpus = Corpus.from_instances([
+                Instance('fo', ['f', 'o'], ['FOO', 'BAR']),
+                Instance('baz', None, None)
+            ])
+            segmenter = ConstraintSegmenter(DummyClassifier)
+            segmenter.train(corpus)
+            self.assertEqual(segmenter.classifier.instances,
+                             self.segmenter.classifier.instances)
+
+        it 'trains on the token ids of a corpus when the featurizer is sparse':
+            corpus = Corpus.from_instances([
+                Instance('fo', ['f', 'o'], ['FOO', 'BAR']),
+                Instance('of', ['o', 'f'], ['BAR', 'FOO'])
+            ])
+            from_corpus = ConstraintSegmenter(
+                featurizer=Featurizer(sparse=True))
+            from_corpus.train(corpus)
+            from_lists = ConstraintSegmenter(
+                featurizer=Featurizer(sparse=True))
+            from_lists.train(['fo', 'of'], [[('f', 'FOO'), ('o', 'BAR')],
+                                            [('o', 'BAR'), ('f', 'FOO')]])
+            self.assertEqual(from_corpus.annotate('foo'),
+                             from_lists.annotate('foo'))
+
+        it 'raises an error if no annotations are provided':
+            segmenter = ConstraintSegmenter(DummyClassifier)
+            with self.assertRaises(SegmentationException):
+                segmenter.train(self.train_shapes)
+
         it 'raises an error if the number of shapes do not match the number of annotations':
             train_shapes = ['fo', 'bar']
             train_annotations = [[('f', 'FOO'), ('o', 'BAR')]]
@@ -105,6 +141,31 @@ describe 'ConstraintSegmenter':
             self.assertEqual(segmenter.classifier.instances, instances)
 
 
+        it 'trains on a feature matrix when the featurizer is sparse':
+            featurizer = Featurizer(sparse=True)
+            segmenter = ConstraintSegmenter(featurizer=featurizer)
+            segmenter.train(self.train_shapes, self.train_annotations)
+            self.assertIsNotNone(featurizer.vocabulary)
+            self.assertIsInstance(segmenter.classifier,
+                                  SKLearnNaiveBayesClassifier)
+
+        it 'gives rows as dicts to a classifier without feature matrix support':
+            featurizer = Featurizer(sparse=True)
+            segmenter = ConstraintSegmenter(DummyClassifier, featurizer=featurizer)
+            segmenter.train(['fo'], [[('f', 'FOO'), ('o', 'BAR')]])
+            instances = segmenter.classifier.instances
+            self.assertEqual([label for _, label in instances],
+                             ['_-_-FOO', '_-FOO-BAR', 'FOO-BAR-_', 'BAR-_-_'])
+            for features, _ in instances:
+                self.assertEqual(len(features), 3)
+
+        it 'raises an error if the number of labels does not match the number of tokens in a sparse featurizer':
+            featurizer = Featurizer(tokenize=lambda x: re.findall('.&?', x),
+                                    sparse=True)
+            segmenter = ConstraintSegmenter(featurizer=featurizer)
+            with self.assertRaises(FeaturizationException):
+                segmenter.train(['f&o'], [[('f', 'FOO'), ('&o', 'BAR')]])
+
     describe 'annotate':
         it 'raises an error if the segmenter has not already been trained':
             segmenter = ConstraintSegmenter(DummyClassifier)
@@ -125,6 +186,14 @@ describe 'ConstraintSegmenter':
             labels = segmenter.annotate(['f', 'o'])
             self.assertEqual(labels, [('f', 'FOO'), ('o', 'BAR')])
 
+        it 'works on arrays of token ids':
+            tokenizer = Tokenizer()
+            featurizer = Featurizer(tokenize=tokenizer)
+            segmenter = ConstraintSegmenter(DummyClassifier, featurizer=featurizer)
+            segmenter.train(self.train_shapes, self.train_annotations)
+            labels = segmenter.annotate(tokenizer.encode('fo'))
+            self.assertEqual(labels, [('f', 'FOO'), ('o', 'BAR')])
+
         it 'uses a custom featurizer':
             shapes = ['f&o']
             annotations = [[('f&', 'FOO'), ('o', 'BAR')]]
@@ -134,6 +203,18 @@ describe 'ConstraintSegmenter':
             labels = segmenter.annotate('f&o')
             self.assertEqual(labels, [('f&', 'FOO'), ('o', 'BAR')])
 
+        it 'gives the same results with a sparse featurizer':
+            shapes = ['foo', 'fob', 'bo']
+            annotations = [[('fo', 'FOO'), ('o', 'BAR')],
+                           [('f', 'FOO'), ('ob', 'BAR')],
+                           [('b', 'FOO'), ('o', 'BAR')]]
+            dense = ConstraintSegmenter()
+            dense.train(shapes, annotations)
+            sparse = ConstraintSegmenter(featurizer=Featurizer(sparse=True))
+            sparse.train(shapes, annotations)
+            for word in ['foo', 'bob', 'of', 'x', '']:
+                self.assertEqual(sparse.annotate(word), dense.annotate(word))
+
 
     describe 'segment':
         it 'raises an error if the segmenter has not already been trained':
@@ -1,8 +1,12 @@
 # coding: spec
+import pickle
 import re
+from spiel.levenshtein import AlignmentCache
+from spiel.vocab import Tokenizer
 from spiel.segmentation.features import (
     Featurizer,
     FeaturizationException,
+    FeatureVocabulary,
     concat_annotations,
     label_annotations
 )
@@ -104,6 +108,112 @@ describe 'Featurizer':
                 {'prefix': '_fo', 'focus': '_', 'suffix': '___'}
             ])
 
+    describe 'tokens':
+        it 'tokenizes strings':
+            featurizer = Featurizer(tokenize=lambda x: re.findall('.&?', x))
+            self.assertEqual(featurizer.tokens('f&o'), ['f&', 'o'])
+
+        it 'leaves lists of tokens alone':
+            featurizer = Featurizer()
+            self.assertEqual(featurizer.tokens(['f&', 'o']), ['f&', 'o'])
+
+        it 'decodes arrays of token ids with a Tokenizer':
+            tokenizer = Tokenizer('.&?')
+            featurizer = Featurizer(tokenize=tokenizer)
+            ids = tokenizer.encode('f&o')
+            self.assertEqual(featurizer.tokens(ids), ['f&', 'o'])
+            self.assertEqual(featurizer.convert_features(ids),
+                             featurizer.convert_features('f&o'))
+
+        it 'raises an error for arrays of token ids without a Tokenizer':
+            featurizer = Featurizer()
+            with self.assertRaises(FeaturizationException):
+                featurizer.tokens(Tokenizer().encode('fo'))
+
+    describe 'convert_labels':
+        it 'returns an empty list when given no labels':
+            featurizer = Featurizer()
+            self.assertEqual(featurizer.convert_labels([]), [])
+
+        it 'returns the trigram labels from convert_pairs':
+            featurizer = Featurizer()
+            labels = ['FOO', 'BAR']
+            pairs = featurizer.convert_pairs('fo', labels)
+            self.assertEqual(featurizer.convert_labels(labels),
+                             [label for _, label in pairs])
+
+    describe 'convert_matrix':
+        before_each:
+            self.featurizer = Featurizer(sparse=True)
+            self.featurizer.fit_vocabulary(['fo', 'of'])
+
+        it 'raises an error if there is no vocabulary':
+            with self.assertRaises(FeaturizationException):
+                Featurizer(sparse=True).convert_matrix(['fo'])
+
+        it 'returns a row for each instance of each shape':
+            matrix = self.featurizer.convert_matrix(['fo', '', 'f'])
+            self.assertEqual(matrix.shape,
+                             (7, len(self.featurizer.vocabulary)))
+
+        it 'sets one column for each of the prefix, focus, and suffix':
+            matrix = self.featurizer.convert_matrix(['fo', 'of'])
+            self.assertEqual(list(matrix.getnnz(axis=1)), [3] * 8)
+            self.assertEqual(matrix.sum(), 24)
+
+        it 'gives the same columns to the same features':
+            features = self.featurizer.convert_features('fo')
+            matrix = self.featurizer.convert_matrix(['fo'])
+            for i, row in enumerate(features):
+                for j, other in enumerate(features):
+                    shared = len(set(matrix[i].indices)
+                                 & set(matrix[j].indices))
+                    same = sum(row[field] == other[field]
+                               for field in FeatureVocabulary.FIELDS)
+                    self.assertEqual(shared, same)
+
+        it 'tokenizes strings':
+            featurizer = Featurizer(sparse=True,
+                                    tokenize=lambda x: re.findall('.&?', x))
+            featurizer.fit_vocabulary(['f&o'])
+            matrix = featurizer.convert_matrix(['f&o'])
+            self.assertEqual(matrix.shape[0], 4)
+            self.assertEqual(matrix.sum(), 12)
+
+        it 'featurizes arrays of token ids without decoding them':
+            tokenizer = Tokenizer(r'.&?')
+            featurizer = Featurizer(sparse=True, tokenize=tokenizer)
+            featurizer.fit_vocabulary([tokenizer.encode('f&o')])
+            ids = featurizer.convert_matrix([tokenizer.encode('of&x')])
+            strings = featurizer.convert_matrix(['of&x'])
+            self.assertEqual((ids != strings).nnz, 0)
+            self.assertEqual(ids.shape[0], 5)
+
+        it 'leaves the token id lookup out when pickled':
+            tokenizer = Tokenizer()
+            featurizer = Featurizer(sparse=True, tokenize=tokenizer)
+            featurizer.fit_vocabulary([tokenizer.encode('fo')])
+            vocabulary = pickle.loads(pickle.dumps(featurizer.vocabulary))
+            matrix = vocabulary.transform([tokenizer.encode('of')],
+                                          tokenizer.vocabulary)
+            self.assertEqual(
+                (matrix != featurizer.convert_matrix(['of'])).nnz, 0)
+
+        it 'raises an error on token ids without a Tokenizer':
+            with self.assertRaises(FeaturizationException):
+                self.featurizer.convert_matrix([Tokenizer().encode('fo')])
+
+        it 'ignores unknown features by default':
+            matrix = self.featurizer.convert_matrix(['x'])
+            self.assertEqual(list(matrix.getnnz(axis=1)), [2, 2, 2])
+
+        it 'can raise an error on unknown features':
+            featurizer = Featurizer(sparse=True, unknown_features='error')
+            featurizer.fit_vocabulary(['fo'])
+            featurizer.convert_matrix(['fo'])
+            with self.assertRaises(FeaturizationException):
+                featurizer.convert_matrix(['of'])
+
     describe 'label':
         it 'returns an empty list if no tokens are provided':
             featurizer = Featurizer()
@@ -166,18 +276,58 @@ describe 'Featurizer':
             labels = featurizer.label('bazaa', annotations)
             self.assertEqual(labels, ['bar', 'I', 'I+I(a)+I(a)', 'I', 'I'])
 
+        it 'keeps only the first of consecutive deletions in full mode':
+            featurizer = Featurizer(mode='full',
+                                    tokenize=Tokenizer(r'.[·]*'))
+            annotations = [('ne', 'A'), ('no·hsaw', 'B'), ('ekw', 'C'),
+                           ('w', 'D'), ('aki', 'E')]
+            labels = featurizer.label('neno·hsa·ko·ki', annotations)
+            self.assertEqual(labels, ['A', 'I', 'B', 'I', 'I', 'I',
+                                      'I+R(a,a·)+D(w)', 'I',
+                                      'I+R(w,o·)+D(w)', 'I', 'I'])
+
         it 'can remove operation directions':
             featurizer = Featurizer(mode='normal')
             annotations = [('foo', 'bar'), ('baz', 'boo')]
             labels = featurizer.label('fooba', annotations)
             self.assertEqual(labels, ['bar', 'I', 'I', 'boo', 'I'])
 
+        it 'reuses alignments from its alignment cache':
+            cache = AlignmentCache()
+            featurizer = Featurizer(mode='full', alignment_cache=cache)
+            annotations = [('baz', 'bar')]
+            featurizer.label('baza', annotations)
+            labels = featurizer.label('baza', annotations)
+            self.assertEqual(labels, ['bar', 'I', 'I+I(a)', 'I'])
+            self.assertEqual(len(cache), 1)
+
         it 'can reduce labels down to B/I/O':
             featurizer = Featurizer(mode='basic')
             annotations = [('_', '_'), ('foo', 'bar'), ('baz', 'boo')]
             labels = featurizer.label('_fooba', annotations)
             self.assertEqual(labels, ['O', 'B', 'I', 'I', 'B', 'I'])
 
+    describe 'label_many':
+        it 'labels each shape the same way as label()':
+            featurizer = Featurizer(mode='full')
+            shapes = ['foobaz', 'ba', 'baza', 'bazaa', '_fooba']
+            annotations = [
+                [('foo', 'bar'), ('baz', 'boo')],
+                [('baz', 'bar')],
+                [('baz', 'bar')],
+                [('baz', 'bar')],
+                [('_', '_'), ('foo', 'bar'), ('baz', 'boo')]
+            ]
+            labels = featurizer.label_many(shapes, annotations)
+            self.assertEqual(labels, [Featurizer(mode='full').label(*args)
+                                      for args in zip(shapes, annotations)])
+
+        it 'fills its alignment cache':
+            cache = AlignmentCache()
+            featurizer = Featurizer(alignment_cache=cache)
+            featurizer.label_many(['foo', 'foo'], [[('foo', 'bar')]] * 2)
+            self.assertEqual(len(cache), 1)
+
     describe 'analogize':
         context 'basic mode':
             it 'segments a shape based on annotations':
@@ -1,5 +1,6 @@
 # coding: spec
 from spiel.sequence_labelling import Featurizer
+from spiel.vocab import Vocabulary
 
 
 describe 'Featurizer':
@@ -39,6 +40,17 @@ describe 'Featurizer':
 
             self.assertEqual(features, target)
 
+        it 'decodes arrays of segment ids with a vocabulary':
+            vocabulary = Vocabulary()
+            featurizer = Featurizer(vocabulary=vocabulary)
+            ids = vocabulary.encode(['foot', 'ball'])
+            self.assertEqual(featurizer.convert(ids),
+                             featurizer.convert(['foot', 'ball']))
+
+        it 'raises an error for arrays of segment ids without a vocabulary':
+            with self.assertRaises(ValueError):
+                self.featurizer.convert(Vocabulary().encode(['foot']))
+
     describe 'convert_many':
         it 'converts multiple sequences to features':
             sequences = [['foot'], ['ball']]
@@ -70,3 +82,14 @@ describe 'Featurizer':
                 }]
             ]
             self.assertEqual(features, target)
+
+    describe 'convert_ids':
+        it 'converts sequences laid end to end in one array of ids':
+            vocabulary = Vocabulary(['foot', 'ball', 'bat'])
+            ids = vocabulary.encode(['foot', 'ball', 'bat', 'ball', 'bat'])
+            features = self.featurizer.convert_ids(ids, [(0, 2), (2, 5)],
+                                                   vocabulary)
+            self.assertEqual(features, self.featurizer.convert_many([
+                ['foot', 'ball'],
+                ['bat', 'ball', 'bat']
+            ]))
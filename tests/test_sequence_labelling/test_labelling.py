@@ -1,4 +1,5 @@
 # coding: spec
+from spiel.data import Corpus, Instance
 from spiel.sequence_labelling import SequenceLabeller
 from spiel.sequence_labelling.labelling import LabellingException
 
@@ -24,6 +25,10 @@ class DummyClassifier:
     def predict(self, features):
         return ['FOO', 'BAR']
 
+    def predict_many(self, features):
+        return [self.predict(sequence_features)[:len(sequence_features)]
+                for sequence_features in features]
+
 
 describe 'SequenceLabeller':
     describe 'train':
@@ -57,6 +62,22 @@ describe 'SequenceLabeller':
             labeller.train([['foo']], [['FOO']], grid_search=False)
             self.assertEqual(labeller.model.mode, 'build')
 
+        it 'trains on the annotated instances of a corpus':
+            corpus = Corpus.from_instances([
+                Instance('foo', ['foo'], ['FOO']),
+                Instance('bar', None, None)
+            ])
+            labeller = SequenceLabeller(DummyClassifier)
+            labeller.train(corpus)
+            expected = SequenceLabeller(DummyClassifier)
+            expected.train([['foo']], [['FOO']])
+            self.assertEqual(labeller.model.data, expected.model.data)
+
+        it 'raises an error if no labels are provided':
+            labeller = SequenceLabeller(DummyClassifier)
+            with self.assertRaises(LabellingException):
+                labeller.train([['foo']])
+
     describe 'label':
         it 'raises an error if the model has not been trained':
             labeller = SequenceLabeller()
@@ -68,3 +89,16 @@ describe 'SequenceLabeller':
             labeller.train([['foo']], [['FOO']])
             labels = labeller.label(['foo', 'bar'])
             self.assertEqual(labels, ['FOO', 'BAR'])
+
+    describe 'label_many':
+        it 'raises an error if the model has not been trained':
+            labeller = SequenceLabeller()
+            with self.assertRaises(LabellingException):
+                labeller.label_many([['foo']])
+
+        it 'predicts several sequences at once':
+            labeller = SequenceLabeller(DummyClassifier)
+            labeller.train([['foo']], [['FOO']])
+            labels = labeller.label_many([['foo', 'bar'], ['foo']])
+            self.assertEqual(labels, [['FOO', 'BAR'], ['FOO']])
+            self.assertEqual(labeller.label_many([]), [])
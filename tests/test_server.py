@@ -0,0 +1,147 @@
+# coding: spec
+import asyncio
+import json
+import os
+import socket
+import struct
+import threading
+import time
+
+from spiel.server import SegmentationClient, SegmentationServer, ServerError
+
+
+class DummyPipeline:
+    def __init__(self):
+        self.batches = []
+        self.metadata = {'format_version': 1}
+
+    def annotate_many(self, shapes):
+        self.batches.append(len(shapes))
+        if 'bad' in shapes:
+            raise ValueError('bad shape')
+        return [[(shape[:1], 'A'), (shape[1:], 'B')] for shape in shapes]
+
+
+class SlowPipeline(DummyPipeline):
+    def annotate_many(self, shapes):
+        time.sleep(0.01)
+        return super().annotate_many(shapes)
+
+
+describe 'SegmentationServer':
+    before_each:
+        self.pipeline = DummyPipeline()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+        self.server = SegmentationServer(self.pipeline, batch_size=4,
+                                         max_pending=2, max_in_flight=2)
+        run(self.loop, self.server.start(port=0))
+        self.client = SegmentationClient(*self.server.address, timeout=5)
+
+    after_each:
+        self.client.close()
+        run(self.loop, self.server.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    it 'segments a shape':
+        self.assertEqual(self.client.segment('foo'), [('f', 'A'), ('oo', 'B')])
+
+    it 'segments several shapes in batches':
+        shapes = [f'shape{i}' for i in range(10)]
+        self.assertEqual(self.client.segment_many(shapes),
+                         [[(shape[:1], 'A'), (shape[1:], 'B')]
+                          for shape in shapes])
+        self.assertEqual(sum(self.pipeline.batches), 10)
+        self.assertTrue(all(size <= 4 for size in self.pipeline.batches))
+
+    it 'answers requests in the order they were sent':
+        with socket.create_connection(self.server.address, 5) as connection:
+            stream = connection.makefile('rwb')
+            for i in range(10):
+                stream.write(json.dumps({'id': i, 'shape': f'shape{i}'})
+                             .encode() + b'\n')
+            stream.flush()
+            responses = [json.loads(stream.readline()) for _ in range(10)]
+        self.assertEqual([response['id'] for response in responses],
+                         list(range(10)))
+        self.assertEqual(responses[3]['segments'], ['s', 'hape3'])
+
+    it 'reports its health':
+        self.client.segment('foo')
+        health = self.client.health()
+        self.assertEqual(health['status'], 'ok')
+        self.assertEqual(health['shapes'], 1)
+        self.assertEqual(health['connections'], 1)
+        self.assertEqual(health['model'], {'format_version': 1})
+
+    it 'answers bad requests with errors':
+        with self.assertRaisesRegex(ServerError, 'Unknown op'):
+            self.client.request({'op': 'foo'})
+        with self.assertRaisesRegex(ServerError, 'shape'):
+            self.client.request({'shape': 3})
+        self.assertEqual(self.client.segment('ba'), [('b', 'A'), ('a', 'B')])
+
+    it 'answers invalid JSON with an error':
+        with socket.create_connection(self.server.address, 5) as connection:
+            stream = connection.makefile('rwb')
+            stream.write(b'{"shape": \n')
+            stream.flush()
+            self.assertIn('Invalid JSON', json.loads(stream.readline())['error'])
+
+    it 'only answers the requests with shapes that fail with errors':
+        server = SegmentationServer(self.pipeline, batch_size=2, max_wait=5)
+        run(self.loop, server.start(port=0))
+        try:
+            with socket.create_connection(server.address, 5) as connection:
+                stream = connection.makefile('rwb')
+                for i, shape in enumerate(['bad', 'foo']):
+                    stream.write(json.dumps({'id': i, 'shape': shape})
+                                 .encode() + b'\n')
+                stream.flush()
+                responses = [json.loads(stream.readline()) for _ in range(2)]
+        finally:
+            run(self.loop, server.close())
+        self.assertEqual(self.pipeline.batches[0], 2)
+        self.assertIn('bad shape', responses[0]['error'])
+        self.assertEqual(responses[1]['segments'], ['f', 'oo'])
+
+    it 'lets go of a connection that is reset with requests in flight':
+        server = SegmentationServer(SlowPipeline(), batch_size=1,
+                                    max_in_flight=4)
+        run(self.loop, server.start(port=0))
+        try:
+            connection = socket.create_connection(server.address, 5)
+            connection.sendall(b''.join(
+                json.dumps({'id': i, 'shape': f'shape{i}'}).encode() + b'\n'
+                for i in range(50)))
+            time.sleep(0.05)
+            # Closing with a zero linger time resets the connection
+            connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                                  struct.pack('ii', 1, 0))
+            connection.close()
+            for _ in range(100):
+                if not server.num_connections:
+                    break
+                time.sleep(0.05)
+            self.assertEqual(server.num_connections, 0)
+        finally:
+            run(self.loop, server.close())
+
+    it 'can listen on a Unix socket':
+        path = 'TEST_SERVER.sock'
+        server = SegmentationServer(self.pipeline)
+        run(self.loop, server.start(path=path))
+        try:
+            with SegmentationClient(path=path, timeout=5) as client:
+                self.assertEqual(client.segment('foo'),
+                                 [('f', 'A'), ('oo', 'B')])
+        finally:
+            run(self.loop, server.close())
+        self.assertFalse(os.path.exists(path))
+
+
+def run(loop, coroutine):
+    return asyncio.run_coroutine_threadsafe(coroutine, loop).result(5)
@@ -1,5 +1,7 @@
 # coding: spec
-from spiel.util import all_permutations, pad, grouper
+import os
+
+from spiel.util import all_permutations, pad, grouper, num_workers
 
 
 describe 'all_permutations':
@@ -31,9 +33,25 @@ describe 'pad':
         padded = pad(['f', 'oo'], '_', 3)
         self.assertEqual(padded, ['_', '_', '_', 'f', 'oo', '_', '_', '_'])
 
+    it 'adds elements to either side of a tuple':
+        padded = pad(('f', 'oo'), '_', 1)
+        self.assertEqual(padded, ('_', 'f', 'oo', '_'))
+
 
 describe 'grouper':
     it 'fills missing values with fillvalue':
         iterable = 'abcdefg'
         iterations = list(grouper(4, iterable, fillvalue='foo'))
         self.assertEqual(iterations[-1][-1], 'foo')
+
+
+describe 'num_workers':
+    it 'gives back a positive number of jobs as it is':
+        self.assertEqual(num_workers(3), 3)
+
+    it 'counts back from the number of CPUs for negative numbers':
+        self.assertEqual(num_workers(-1), os.cpu_count() or 1)
+
+    it 'uses at least one worker':
+        self.assertEqual(num_workers(0), 1)
+        self.assertEqual(num_workers(-1000), 1)
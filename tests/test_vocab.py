@@ -0,0 +1,73 @@
+# coding: spec
+import pickle
+
+import numpy as np
+
+from spiel.vocab import Tokenizer, Vocabulary, is_encoded
+
+
+describe 'Vocabulary':
+    before_each:
+        self.vocabulary = Vocabulary(['f', 'o'])
+
+    it 'gives tokens ids in the order they are added, starting at 1':
+        self.assertEqual(self.vocabulary.id('f'), 1)
+        self.assertEqual(self.vocabulary.id('o'), 2)
+        self.assertEqual(self.vocabulary.id('b'), 3)
+        self.assertEqual(len(self.vocabulary), 3)
+
+    it 'encodes tokens as an array of ids':
+        ids = self.vocabulary.encode(['f', 'o', 'o'])
+        self.assertIsInstance(ids, np.ndarray)
+        self.assertEqual(list(ids), [1, 2, 2])
+
+    it 'decodes ids back into tokens':
+        ids = self.vocabulary.encode(['b', 'o', 'o'])
+        self.assertEqual(self.vocabulary.decode(ids), ['b', 'o', 'o'])
+
+    it 'looks up tokens by id':
+        self.assertEqual(self.vocabulary[2], 'o')
+
+    it 'gives unknown tokens the unknown id once frozen':
+        self.vocabulary.freeze()
+        self.assertEqual(list(self.vocabulary.encode(['f', 'x'])),
+                         [1, Vocabulary.UNKNOWN_ID])
+        self.assertNotIn('x', self.vocabulary)
+
+
+describe 'Tokenizer':
+    it 'splits strings into characters by default':
+        self.assertEqual(Tokenizer()('foo'), ('f', 'o', 'o'))
+
+    it 'splits strings with a regular expression':
+        tokenizer = Tokenizer(r'.[·]*')
+        self.assertEqual(tokenizer('fo·o'), ('f', 'o·', 'o'))
+
+    it 'gives back the same tuple each time it is called':
+        tokenizer = Tokenizer()
+        tokens = tokenizer('foo')
+        self.assertEqual(tokens, ('f', 'o', 'o'))
+        self.assertIs(tokenizer('foo'), tokens)
+
+    it 'encodes strings with its vocabulary':
+        tokenizer = Tokenizer(r'.[·]*')
+        ids = tokenizer.encode('fo·fo·')
+        self.assertEqual(list(ids), [1, 2, 1, 2])
+        self.assertEqual(tokenizer.decode(ids), ['f', 'o·', 'f', 'o·'])
+
+    it 'can be pickled':
+        tokenizer = Tokenizer(r'.[·]*')
+        tokenizer.encode('fo·')
+        copy = pickle.loads(pickle.dumps(tokenizer))
+        self.assertEqual(copy('fo·o'), ('f', 'o·', 'o'))
+        self.assertEqual(list(copy.encode('o·f')), [2, 1])
+
+
+describe 'is_encoded':
+    it 'recognizes arrays of ids':
+        self.assertTrue(is_encoded(np.array([1, 2])))
+
+    it 'rejects strings and lists of tokens':
+        self.assertFalse(is_encoded('foo'))
+        self.assertFalse(is_encoded(['f', 'o']))
+        self.assertFalse(is_encoded(np.array(['f', 'o'])))